@@ -1,15 +1,18 @@
 import os
+import json
 import tempfile
-import base64
-from io import BytesIO
+import uuid
 from typing import Optional
 
-from flask import Flask, request, jsonify, render_template
-from PIL import Image
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 
 from jindaishi_agent import JindaishiQuestionAgent
 from jindaishi_kg_agent import JindaishiKnowledgeGraphAgent
 from jindaishi_qa_agent import JindaishiAnswerAgent
+from shared_utils.generation_params import call_with_generation_params, resolve_response_mode
+from shared_utils.intent_router import route_message
+from shared_utils.startup_profile import profile_section
+from shared_utils.uploaded_image import UploadedImage, decode_uploaded_image
 from dotenv import load_dotenv
 
 
@@ -26,9 +29,9 @@ class KGAgentWrapper(JindaishiKnowledgeGraphAgent):
         topic = topic.strip().lstrip("，,。 、")
         return topic if topic else user_input
 
-    def process_request(self, user_input: str) -> str:
+    def process_request(self, user_input: str, generation_params: Optional[dict] = None) -> str:
         topic = self._extract_topic(user_input)
-        return self.build_knowledge_graph(topic)
+        return self.build_knowledge_graph(topic, generation_params)
 
 
 app = Flask(__name__)
@@ -43,79 +46,26 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def save_uploaded_image(image_data: str) -> Optional[str]:
-    """Save base64 image to a temp file and return its path, or None on failure."""
-    try:
-        mime_type = None
-        if isinstance(image_data, str) and image_data.startswith('data:image'):
-            header, data = image_data.split(',', 1)
-            try:
-                mime_type = header.split(';')[0].split(':', 1)[1]
-            except Exception:
-                mime_type = None
-            image_binary = base64.b64decode(data)
-        else:
-            image_binary = base64.b64decode(image_data)
-
-        if len(image_binary) > 16 * 1024 * 1024:
-            print("图片文件过大：超过16MB限制")
-            return None
-
-        try:
-            img = Image.open(BytesIO(image_binary))
-            img.verify()
-            real_format = img.format
-            if img.width > 4096 or img.height > 4096:
-                print("图片分辨率过高：超过 4K 限制，拒绝处理")
-                return None
-        except Exception as e:
-            print(f"无效的图像文件: {e}")
-            return None
-
-        def guess_ext(mt: Optional[str], fmt: Optional[str]) -> str:
-            mapping = { 'JPEG': 'jpg', 'JPG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'BMP': 'bmp', 'GIF': 'gif' }
-            if fmt and fmt.upper() in mapping:
-                return mapping[fmt.upper()]
-            if mt and '/' in mt:
-                mt_ext = mt.split('/')[-1].lower()
-                return 'jpg' if mt_ext == 'jpeg' else mt_ext
-            return 'jpg'
-
-        ext = guess_ext(mime_type, locals().get('real_format'))
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{ext}')
-        temp_file.write(image_binary)
-        temp_file.close()
-        return temp_file.name
-    except Exception as e:
-        print(f"保存图片失败: {e}")
-        return None
-
-
-def cleanup_temp_file(file_path: Optional[str]) -> None:
-    try:
-        if file_path and os.path.exists(file_path):
-            os.unlink(file_path)
-    except Exception as e:
-        print(f"清理临时文件失败: {e}")
-
-
 # Load agents once at startup
 try:
-    question_agent = JindaishiQuestionAgent()
+    with profile_section("agent", "jindaishi.question_agent"):
+        question_agent = JindaishiQuestionAgent()
     print("JindaishiQuestionAgent loaded successfully.")
 except Exception as e:
     print(f"Error loading JindaishiQuestionAgent: {e}")
     question_agent = None
 
 try:
-    kg_agent = KGAgentWrapper()
+    with profile_section("agent", "jindaishi.kg_agent"):
+        kg_agent = KGAgentWrapper()
     print("KGAgentWrapper loaded successfully.")
 except Exception as e:
     print(f"Error loading KGAgentWrapper: {e}")
     kg_agent = None
 
 try:
-    qa_agent = JindaishiAnswerAgent()
+    with profile_section("agent", "jindaishi.qa_agent"):
+        qa_agent = JindaishiAnswerAgent()
     print("JindaishiAnswerAgent loaded successfully.")
 except Exception as e:
     print(f"Error loading JindaishiAnswerAgent: {e}")
@@ -132,104 +82,131 @@ def home():
     return render_template('home.html')
 
 
+def _respond(
+    route: str,
+    user_message: str,
+    image: Optional[UploadedImage],
+    response_mode: str,
+    conversation_id: Optional[str] = None,
+) -> str:
+    params = resolve_response_mode(response_mode)
+    if route == "kg":
+        if kg_agent:
+            print("Routing to Knowledge Graph Agent.")
+            if image:
+                return "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
+            return call_with_generation_params(kg_agent, "process_request", user_message, generation_params=params)
+        return "知识图谱助手未成功加载，无法处理您的请求。"
+    if route == "question":
+        if question_agent:
+            print("Routing to Question Generation Agent.")
+            if hasattr(question_agent, 'process_multimodal_request'):
+                return call_with_generation_params(
+                    question_agent, "process_multimodal_request", user_message, image,
+                    generation_params=params, conversation_id=conversation_id,
+                )
+            if image:
+                return "当前版本暂时不支持图片分析，请使用纯文本提问。"
+            return call_with_generation_params(
+                question_agent, "process_request", user_message,
+                generation_params=params, conversation_id=conversation_id,
+            )
+        return "出题助手未成功加载，无法处理您的请求。"
+    if qa_agent:
+        print("Routing to Q&A Agent.")
+        if image and hasattr(qa_agent, 'process_multimodal_request'):
+            return call_with_generation_params(
+                qa_agent, "process_multimodal_request", user_message, image, generation_params=params
+            )
+        return call_with_generation_params(qa_agent, "process_request", user_message, generation_params=params)
+    return "问答助手未成功加载，无法处理您的请求。"
+
+
+def _conversation_id(data: dict) -> str:
+    """客户端回传的对话 id；首次请求时生成并随响应返回，出题 Agent 按它保存最近一次出题的答案解析。"""
+    conversation_id = str(data.get("conversation_id") or "").strip()[:64]
+    return conversation_id or uuid.uuid4().hex
+
+
+def _sse(payload: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return prefix + f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.get_json(silent=True) or {}
     user_message = (data.get("message") or "").strip()
     image_data = data.get("image")
     response_mode = (data.get("response_mode") or "balanced").lower()
+    conversation_id = _conversation_id(data)
 
     if not user_message and not image_data:
         return jsonify({"error": "请输入文本或上传图片"}), 400
 
-    image_path = None
+    image = None
     if image_data:
-        image_path = save_uploaded_image(image_data)
-        if not image_path:
+        image = decode_uploaded_image(image_data)
+        if not image:
             return jsonify({"error": "图片处理失败"}), 400
 
     response_text = ""
     try:
         if not user_message:
             user_message = "请结合图片进行分析并回答问题。"
-
-        def apply_mode(agent):
-            try:
-                if not hasattr(agent, 'set_generation_params'):
-                    return
-                if response_mode == 'fast':
-                    agent.set_generation_params(max_tokens=400, timeout=15, retrieval_k=3)
-                elif response_mode == 'detailed':
-                    agent.set_generation_params(max_tokens=1600, timeout=45, retrieval_k=7)
-                else:
-                    agent.set_generation_params(max_tokens=1000, timeout=30, retrieval_k=5)
-            except Exception:
-                pass
-
-        if any(k in user_message for k in ["知识图谱", "思维导图", "mindmap", "图谱"]):
-            if kg_agent:
-                print("Routing to Knowledge Graph Agent.")
-                apply_mode(kg_agent)
-                if image_path:
-                    response_text = "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
-                else:
-                    response_text = kg_agent.process_request(user_message)
-            else:
-                response_text = "知识图谱助手未成功加载，无法处理您的请求。"
-        else:
-            answer_keywords = ["解答", "答案", "解析", "请回答", "帮我回答", "帮我解答"]
-
-            contains_mcq_options = False
-            try:
-                import re
-                if re.search(r"[A-DＡ-Ｄ][\.．、]\s?", user_message):
-                    contains_mcq_options = True
-            except Exception:
-                contains_mcq_options = False
-
-            if any(kw in user_message for kw in answer_keywords) or contains_mcq_options:
-                if qa_agent:
-                    print("Routing to Q&A Agent (answer mode).")
-                    apply_mode(qa_agent)
-                    if image_path and hasattr(qa_agent, 'process_multimodal_request'):
-                        response_text = qa_agent.process_multimodal_request(user_message, image_path)
-                    else:
-                        response_text = qa_agent.process_request(user_message)
-                else:
-                    response_text = "问答助手未成功加载，无法处理您的请求。"
-            else:
-                exam_keywords = ["出题", "生成题目", "选择题", "判断题", "简答题", "试题", "练习"]
-                if any(kw in user_message for kw in exam_keywords):
-                    if question_agent:
-                        print("Routing to Question Generation Agent.")
-                        apply_mode(question_agent)
-                        if hasattr(question_agent, 'process_multimodal_request'):
-                            response_text = question_agent.process_multimodal_request(user_message, image_path)
-                        else:
-                            if image_path:
-                                response_text = "当前版本暂时不支持图片分析，请使用纯文本提问。"
-                            else:
-                                response_text = question_agent.process_request(user_message)
-                    else:
-                        response_text = "出题助手未成功加载，无法处理您的请求。"
-                else:
-                    if qa_agent:
-                        print("Routing to Q&A Agent (default).")
-                        apply_mode(qa_agent)
-                        if image_path and hasattr(qa_agent, 'process_multimodal_request'):
-                            response_text = qa_agent.process_multimodal_request(user_message, image_path)
-                        else:
-                            response_text = qa_agent.process_request(user_message)
-                    else:
-                        response_text = "问答助手未成功加载，无法处理您的请求。"
+        response_text = _respond(route_message(user_message), user_message, image, response_mode, conversation_id)
     except Exception as e:
         print(f"An error occurred during processing: {e}")
         response_text = f"处理您的请求时发生内部错误: {e}"
-    finally:
-        if image_path:
-            cleanup_temp_file(image_path)
 
-    return jsonify({"response": response_text})
+    return jsonify({"response": response_text, "conversation_id": conversation_id})
+
+
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """Same routing as /chat, answered as Server-Sent Events.
+
+    Text-only Q&A requests are streamed token by token; the other agents emit
+    their complete answer as a single `delta` event. The stream always ends
+    with an `event: done` message.
+    """
+    data = request.get_json(silent=True) or {}
+    user_message = (data.get("message") or "").strip()
+    image_data = data.get("image")
+    response_mode = (data.get("response_mode") or "balanced").lower()
+    conversation_id = _conversation_id(data)
+
+    if not user_message and not image_data:
+        return jsonify({"error": "请输入文本或上传图片"}), 400
+
+    image = None
+    if image_data:
+        image = decode_uploaded_image(image_data)
+        if not image:
+            return jsonify({"error": "图片处理失败"}), 400
+
+    if not user_message:
+        user_message = "请结合图片进行分析并回答问题。"
+
+    def generate():
+        try:
+            route = route_message(user_message)
+            if route == "qa" and not image and qa_agent and hasattr(qa_agent, 'stream_request'):
+                params = resolve_response_mode(response_mode)
+                for delta in qa_agent.stream_request(user_message, generation_params=params):
+                    yield _sse({"delta": delta})
+            else:
+                yield _sse({"delta": _respond(route, user_message, image, response_mode, conversation_id)})
+        except Exception as e:
+            print(f"An error occurred during streaming: {e}")
+            yield _sse({"error": f"处理您的请求时发生内部错误: {e}"}, event="error")
+        yield _sse({"conversation_id": conversation_id}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 def run_app():
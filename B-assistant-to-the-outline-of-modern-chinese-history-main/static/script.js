@@ -13,6 +13,8 @@ document.addEventListener("DOMContentLoaded", () => {
     const removeImageBtn = document.getElementById("remove-image");
 
     let selectedImageData = null;
+    // 服务端在首次回复中下发的对话 id，之后每次请求带上（用于取回本对话所出题目的答案解析）
+    let conversationId = null;
 
     try {
         if (window.mermaidMindmap && typeof mermaid.registerExternalDiagrams === 'function') {
@@ -26,6 +28,7 @@ document.addEventListener("DOMContentLoaded", () => {
         chatBox.innerHTML = initialChatHTML;
         userInput.value = "";
         clearSelectedImage();
+        conversationId = null;
     };
 
     const clearSelectedImage = () => {
@@ -62,6 +65,7 @@ document.addEventListener("DOMContentLoaded", () => {
         const modeEl = document.getElementById('response-mode');
         if (modeEl && modeEl.value) { requestData.response_mode = modeEl.value; }
         if (selectedImageData) { requestData.image = selectedImageData; }
+        if (conversationId) { requestData.conversation_id = conversationId; }
 
         userInput.value = "";
         clearSelectedImage();
@@ -76,6 +80,7 @@ document.addEventListener("DOMContentLoaded", () => {
             });
             if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
             const data = await response.json();
+            if (data.conversation_id) { conversationId = data.conversation_id; }
             appendMessage(data.response, "bot");
         } catch (error) {
             console.error("Error:", error);
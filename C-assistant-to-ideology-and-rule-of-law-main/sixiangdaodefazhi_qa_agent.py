@@ -5,9 +5,8 @@ from __future__ import annotations
 """
 
 import os
-import re
 import sys
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional
 
 from langchain_core.messages import HumanMessage, SystemMessage
 
@@ -28,6 +27,12 @@ except Exception:
     from common_utils.base_retrieval_agent import BaseRetrievalAgent
     from common_utils.multimodal_agent import MayuanMultimodalAgent
 
+from shared_utils.generation_params import generation_scope, llm_kwargs, retrieval_k
+from shared_utils.multimodal_race import race_image_answer
+from shared_utils.ocr import get_ocr_service
+from shared_utils.semantic_cache import answer_variant, clean_answer, get_semantic_cache
+from shared_utils.uploaded_image import ImageInput
+
 
 class SixiangDaodeFazhiAnswerAgent(BaseRetrievalAgent):
     def __init__(
@@ -54,26 +59,43 @@ class SixiangDaodeFazhiAnswerAgent(BaseRetrievalAgent):
             print(f"[{self.subject_name}] ⚠️  Multimodal initialisation failed: {exc}")
             self.multimodal_agent = None
 
-    def process_multimodal_request(self, text_input: str, image_path: Optional[str] = None) -> str:
+        # 语义缓存：换种说法的同一问题直接复用已有答案，知识库重建后自动失效
+        self.answer_cache = None
+        try:
+            self.answer_cache = get_semantic_cache(vectorstore_path, embedding_model)
+        except Exception as exc:
+            print(f"[{self.subject_name}] ⚠️  Semantic cache unavailable: {exc}")
+
+    def process_multimodal_request(
+        self,
+        text_input: str,
+        image_path: Optional[ImageInput] = None,
+        generation_params: Optional[Dict[str, Any]] = None,
+    ) -> str:
         if not image_path:
-            return self.process_request(text_input)
-        extracted_text = self._extract_text_from_image(image_path)
+            return self.process_request(text_input, generation_params)
         if self.multimodal_agent is None:
+            extracted_text = self._extract_text_from_image(image_path)
             if extracted_text:
                 base = text_input or "请根据图片中的题目进行解答。"
                 combined = base + "\n\n以下是 OCR 自动识别的图片文字，请据此解答：\n" + extracted_text[:1500]
-                return self.process_request(combined)
-            return self.process_request(text_input)
-        combined_input = text_input
-        if extracted_text:
-            combined_input += "\n\n以下是 OCR 自动识别的图片文字，请据此解答：\n" + extracted_text[:1500]
-        try:
-            response = self.multimodal_agent.process_multimodal_request(combined_input, image_path)
-            return str(response).strip()
-        except Exception:
-            if extracted_text:
-                return self.process_request(extracted_text)
-            return self.process_request(text_input)
+                return self.process_request(combined, generation_params)
+            return self.process_request(text_input, generation_params)
+        # OCR 与视觉模型请求并发执行，先得到可用回答者胜出
+        return race_image_answer(
+            text_input,
+            image_path,
+            extract_text=self._extract_text_from_image,
+            vision=lambda text, image: self._vision_answer(text, image, generation_params),
+            answer_text=lambda question: self.process_request(question, generation_params),
+        )
+
+    def _vision_answer(
+        self, text_input: str, image: ImageInput, generation_params: Optional[Dict[str, Any]] = None
+    ) -> str:
+        # 视觉模型的调用在多模态 Agent 内部，本次请求的参数经 generation_scope 传到 llm.invoke
+        with generation_scope(generation_params):
+            return str(self.multimodal_agent.process_multimodal_request(text_input, image)).strip()
 
     def _build_prompt(self, user_question: str, context: str) -> str:
         return (
@@ -93,11 +115,11 @@ class SixiangDaodeFazhiAnswerAgent(BaseRetrievalAgent):
             "参考资料（可能为空）：\n" + context + "\n\n学生问题：" + user_question + "\n回答："
         )
 
-    def process_request(self, user_question: str) -> str:
-        docs = self._retrieve_docs(f"{user_question} {self.subject_name}", k=5)
-        context = "\n\n".join(docs[:5])
+    def _build_messages(self, user_question: str, k: int = 5) -> list:
+        docs = self._retrieve_docs(f"{user_question} {self.subject_name}", k=k)
+        context = "\n\n".join(docs[:k])
         prompt = self._build_prompt(user_question, context)
-        messages = [
+        return [
             SystemMessage(content=(
                 f"你是一位严谨的{self.subject_name}解答专家。"
                 "请使用结构化 Markdown（标题、列表、加粗）输出，层次清晰，美观易读；"
@@ -105,35 +127,67 @@ class SixiangDaodeFazhiAnswerAgent(BaseRetrievalAgent):
             )),
             HumanMessage(content=prompt),
         ]
+
+    def _llm_kwargs(self, generation_params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        # 本次请求的参数覆盖 Agent 默认值，但不写回 Agent，保证并发请求互不影响
+        return {**self.generation_kwargs, **llm_kwargs(generation_params)}
+
+    def _lookup_cached_answer(self, user_question: str, variant: str):
+        if self.answer_cache is None:
+            return None, None
+        return self.answer_cache.lookup(f"{user_question} {self.subject_name}", variant)
+
+    def process_request(
+        self, user_question: str, generation_params: Optional[Dict[str, Any]] = None
+    ) -> str:
+        llm_call_kwargs = self._llm_kwargs(generation_params)
+        variant = answer_variant(user_question, str(llm_call_kwargs.get("max_tokens", "")))
+        cached, cache_ticket = self._lookup_cached_answer(user_question, variant)
+        if cached is not None:
+            return cached
+        messages = self._build_messages(user_question, retrieval_k(generation_params))
         try:
-            response = self.llm.invoke(messages, **self.generation_kwargs)
-            answer = str(getattr(response, "content", response)).strip()
-            answer = re.sub(r"^`+|`+$", "", answer).strip()
+            response = self.llm.invoke(messages, **llm_call_kwargs)
+            answer = clean_answer(getattr(response, "content", response))
+            if self.answer_cache is not None:
+                self.answer_cache.store(cache_ticket, answer, variant)
             return answer
         except Exception as exc:
             print(f"[{self.subject_name}] Answer generation failed: {exc}")
             return "抱歉，回答过程中出现问题，请稍后再试。"
 
-    def _extract_text_from_image(self, image_path: str) -> str:
+    def stream_request(
+        self, user_question: str, generation_params: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """与 process_request 相同的检索与提示，但按增量片段逐步产出回答。"""
+        llm_call_kwargs = self._llm_kwargs(generation_params)
+        variant = answer_variant(user_question, str(llm_call_kwargs.get("max_tokens", "")))
+        cached, cache_ticket = self._lookup_cached_answer(user_question, variant)
+        if cached is not None:
+            yield cached
+            return
+        messages = self._build_messages(user_question, retrieval_k(generation_params))
+        started = False
+        parts = []
         try:
-            import pytesseract
-            from PIL import Image
-            custom_cmd = os.environ.get("TESSERACT_CMD")
-            if custom_cmd and os.path.exists(custom_cmd):
-                pytesseract.pytesseract.tesseract_cmd = custom_cmd  # type: ignore[attr-defined]
-            else:
-                common_paths = [
-                    r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe",
-                    r"C:\\Program Files (x86)\\Tesseract-OCR\\tesseract.exe",
-                ]
-                for p in common_paths:
-                    if os.path.exists(p):
-                        pytesseract.pytesseract.tesseract_cmd = p  # type: ignore[attr-defined]
-                        break
-            img = Image.open(image_path)
-            text = pytesseract.image_to_string(img, lang="chi_sim+eng")
-            return text.strip()
-        except Exception:
-            return ""
+            for chunk in self.llm.stream(messages, **llm_call_kwargs):
+                delta = str(getattr(chunk, "content", chunk))
+                if not started:
+                    delta = delta.lstrip("`")
+                    if not delta:
+                        continue
+                    started = True
+                parts.append(delta)
+                yield delta
+            if self.answer_cache is not None:
+                self.answer_cache.store(cache_ticket, clean_answer("".join(parts)), variant)
+        except Exception as exc:
+            print(f"[{self.subject_name}] Answer streaming failed: {exc}")
+            if not started:
+                yield "抱歉，回答过程中出现问题，请稍后再试。"
+
+    def _extract_text_from_image(self, image_path: ImageInput) -> str:
+        # 共享的 OCR 进程池：同一图片命中结果缓存，超时或失败时返回空字符串
+        return get_ocr_service().extract_text(image_path)
 
 
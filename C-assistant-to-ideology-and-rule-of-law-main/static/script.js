@@ -12,12 +12,14 @@ document.addEventListener("DOMContentLoaded", () => {
     const removeImageBtn = document.getElementById("remove-image");
 
     let selectedImageData = null;
+    // 服务端在首次回复中下发的对话 id，之后每次请求带上（用于取回本对话所出题目的答案解析）
+    let conversationId = null;
 
     try { if (window.mermaidMindmap && typeof mermaid.registerExternalDiagrams === 'function') { mermaid.registerExternalDiagrams([window.mermaidMindmap]); } } catch (_) {}
     mermaid.initialize({ startOnLoad: false, theme: 'neutral', securityLevel: 'loose' });
 
     const initialChatHTML = chatBox.innerHTML;
-    const resetChat = () => { chatBox.innerHTML = initialChatHTML; userInput.value = ""; clearSelectedImage(); };
+    const resetChat = () => { chatBox.innerHTML = initialChatHTML; userInput.value = ""; clearSelectedImage(); conversationId = null; };
     const clearSelectedImage = () => { selectedImageData = null; imagePreview.style.display = 'none'; previewImg.src = ''; imageInput.value = ''; };
     const handleImageSelection = (file) => { if (!file) return; if (!file.type.startsWith('image/')) { alert('请选择图片文件！'); return; } if (file.size > 16 * 1024 * 1024) { alert('图片文件过大，请选择小于16MB的图片！'); return; } const reader = new FileReader(); reader.onload = (e) => { selectedImageData = e.target.result; previewImg.src = selectedImageData; imagePreview.style.display = 'block'; }; reader.readAsDataURL(file); };
     const showLoading = (show) => { loading.style.display = show ? 'block' : 'none'; sendBtn.disabled = show; };
@@ -29,12 +31,14 @@ document.addEventListener("DOMContentLoaded", () => {
         const requestData = { message: query };
         const modeEl = document.getElementById('response-mode'); if (modeEl && modeEl.value) requestData.response_mode = modeEl.value;
         if (selectedImageData) requestData.image = selectedImageData;
+        if (conversationId) requestData.conversation_id = conversationId;
         userInput.value = ""; clearSelectedImage(); showLoading(true);
         try {
             const base = (window.__APP_BASE__ || "");
             const response = await fetch(`${base}/chat`, { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify(requestData) });
             if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
             const data = await response.json();
+            if (data.conversation_id) conversationId = data.conversation_id;
             appendMessage(data.response, "bot");
         } catch (error) { console.error("Error:", error); appendMessage("抱歉，处理您的请求时出错，请查看控制台了解详情。", "bot"); } finally { showLoading(false); }
     };
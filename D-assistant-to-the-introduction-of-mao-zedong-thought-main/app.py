@@ -1,9 +1,7 @@
 import os
 import sys
-from flask import Flask, request, jsonify, render_template
-from PIL import Image
-from io import BytesIO
-import base64
+import json
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import tempfile
 import uuid
 from dotenv import load_dotenv
@@ -33,6 +31,11 @@ from role_agent import SocratesAgent
 from maogai_agent import MaogaiQuestionAgent
 from maogai_kg_agent import MaogaiKnowledgeGraphAgent
 from maogai_qa_agent import MaogaiAnswerAgent
+from shared_utils.generation_params import call_with_generation_params, llm_kwargs, resolve_response_mode
+from shared_utils.intent_router import route_message
+from shared_utils.session_store import get_session_store
+from shared_utils.startup_profile import profile_section
+from shared_utils.uploaded_image import UploadedImage, decode_uploaded_image
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage
 from shared_utils.llm_wrapper import CustomChatDashScope as _KGLLM
@@ -48,7 +51,7 @@ class KGAgentWrapper:
             print(f"[KG] 标准Agent初始化失败，将使用降级模式：{e}")
             # 准备降级所需对象（仅LLM，无检索）
             self.subject_name = "毛泽东思想与中国特色社会主义概论"
-            self._llm = _KGLLM(model="qwen-max", temperature=0.5)
+            self._llm = _KGLLM(model="qwen-max", temperature=0.5, use_cache=True)
             self._graph_prompt = PromptTemplate.from_template(
                 """
 你是一位{subject_name}知识图谱专家。请围绕知识点"{topic}"构建一个 Mermaid mindmap（思维导图）格式的知识图谱，突出关键概念及其主要关系，并保持简洁易读。
@@ -68,12 +71,12 @@ mindmap
 """
             )
 
-    def build_knowledge_graph(self, topic: str) -> str:
+    def build_knowledge_graph(self, topic: str, generation_params: Optional[dict] = None) -> str:
         if self._agent is not None:
-            return self._agent.build_knowledge_graph(topic)
+            return self._agent.build_knowledge_graph(topic, generation_params)
         prompt_text = self._graph_prompt.format(subject_name=self.subject_name, topic=topic)
         messages = [SystemMessage(content="你是一位精通知识图谱构建的学者。"), HumanMessage(content=prompt_text)]
-        response = self._llm.invoke(messages)
+        response = self._llm.invoke(messages, **llm_kwargs(generation_params))
         return str(getattr(response, "content", response)).strip()
 
     def _extract_topic(self, user_input: str) -> str:
@@ -86,9 +89,9 @@ mindmap
         topic = topic.strip().lstrip("，,。 、")
         return topic if topic else user_input
 
-    def process_request(self, user_input: str) -> str:
+    def process_request(self, user_input: str, generation_params: Optional[dict] = None) -> str:
         topic = self._extract_topic(user_input)
-        return self.build_knowledge_graph(topic)
+        return self.build_knowledge_graph(topic, generation_params)
 
 
 app = Flask(__name__)
@@ -104,68 +107,34 @@ app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', tempfile.gettempdi
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
 
 
-def save_uploaded_image(image_data: str) -> Optional[str]:
-    try:
-        mime_type = None
-        if isinstance(image_data, str) and image_data.startswith('data:image'):
-            header, data = image_data.split(',', 1)
-            try:
-                mime_type = header.split(';')[0].split(':', 1)[1]
-            except Exception:
-                mime_type = None
-            image_binary = base64.b64decode(data)
-        else:
-            image_binary = base64.b64decode(image_data)
-        if len(image_binary) > 16 * 1024 * 1024:
-            return None
-        try:
-            img = Image.open(BytesIO(image_binary))
-            img.verify()
-            real_format = img.format
-            if img.width > 4096 or img.height > 4096:
-                return None
-        except Exception:
-            return None
-        def guess_ext(mt: Optional[str], fmt: Optional[str]) -> str:
-            mapping = { 'JPEG': 'jpg', 'JPG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'BMP': 'bmp', 'GIF': 'gif' }
-            if fmt and fmt.upper() in mapping:
-                return mapping[fmt.upper()]
-            if mt and '/' in mt:
-                mt_ext = mt.split('/')[-1].lower()
-                return 'jpg' if mt_ext == 'jpeg' else mt_ext
-            return 'jpg'
-        ext = guess_ext(mime_type, locals().get('real_format'))
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{ext}')
-        temp_file.write(image_binary)
-        temp_file.close()
-        return temp_file.name
-    except Exception:
-        return None
-
-
 # -------------- Agent 初始化 --------------
 try:
-    question_agent = MaogaiQuestionAgent()
+    with profile_section("agent", "maogai.question_agent"):
+        question_agent = MaogaiQuestionAgent()
 except Exception as e:
     print(f"Error loading MaogaiQuestionAgent: {e}")
     question_agent = None
 
 try:
-    kg_agent = KGAgentWrapper()
+    with profile_section("agent", "maogai.kg_agent"):
+        kg_agent = KGAgentWrapper()
 except Exception as e:
     print(f"Error loading MaogaiKnowledgeGraphAgent: {e}")
     kg_agent = None
 
 try:
-    qa_agent = MaogaiAnswerAgent()
+    with profile_section("agent", "maogai.qa_agent"):
+        qa_agent = MaogaiAnswerAgent()
 except Exception as e:
     print(f"Error loading MaogaiAnswerAgent: {e}")
     qa_agent = None
 
 # ----- Role Play Agent -----
-dialogue_sessions = {}
+# 会话状态：进程内 LRU + TTL，设置 SESSION_DB 后改用可跨 worker 共享的 sqlite
+dialogue_sessions = get_session_store("maogai")
 try:
-    socrates_agent = SocratesAgent()
+    with profile_section("agent", "maogai.socrates_agent"):
+        socrates_agent = SocratesAgent()
     print("SocratesAgent initialized (Maogai context).")
 except Exception as e:
     print(f"Error initializing SocratesAgent: {e}")
@@ -199,49 +168,37 @@ def start_dialogue():
     if not user_message and not image_data:
         return jsonify({"error": "请输入您想探讨的话题或上传图片"}), 400
 
-    image_path = None
+    image = None
     if image_data:
-        image_path = save_uploaded_image(image_data)
-        if not image_path:
+        image = decode_uploaded_image(image_data)
+        if not image:
             return jsonify({"error": "图片处理失败"}), 400
 
-    try:
-        session_id = str(uuid.uuid4())
-        try:
-            if hasattr(socrates_agent, 'set_generation_params'):
-                if response_mode == 'fast':
-                    socrates_agent.set_generation_params(max_tokens=400, timeout=15, retrieval_k=3)
-                elif response_mode == 'detailed':
-                    socrates_agent.set_generation_params(max_tokens=1600, timeout=45, retrieval_k=7)
-                else:
-                    socrates_agent.set_generation_params(max_tokens=1000, timeout=30, retrieval_k=5)
-        except Exception:
-            pass
-
-        if not user_message:
-            user_message = "请结合这张图片开始对话并提出苏格拉底式问题。"
-        if image_path and hasattr(socrates_agent, 'process_multimodal_dialogue'):
-            response_data = socrates_agent.process_multimodal_dialogue(user_message, None, image_path)
-        else:
-            response_data = socrates_agent.process_dialogue(user_message, None)
-
-        if response_data.get("status") == "error":
-            return jsonify({"error": response_data.get("response", "内部错误")}), 500
-        dialogue_sessions[session_id] = response_data["state"]
-        return jsonify({
-            "session_id": session_id,
-            "response": response_data["response"],
-            "character": response_data["state"]["simulated_character"],
-            "topic": response_data["state"]["current_topic"],
-            "turn_count": response_data["state"]["turn_count"],
-        })
-    finally:
-        if image_path:
-            try:
-                if os.path.exists(image_path):
-                    os.unlink(image_path)
-            except Exception:
-                pass
+    session_id = str(uuid.uuid4())
+    params = resolve_response_mode(response_mode)
+
+    if not user_message:
+        user_message = "请结合这张图片开始对话并提出苏格拉底式问题。"
+    if image and hasattr(socrates_agent, 'process_multimodal_dialogue'):
+        response_data = call_with_generation_params(
+            socrates_agent, "process_multimodal_dialogue", user_message, None, image,
+            generation_params=params,
+        )
+    else:
+        response_data = call_with_generation_params(
+            socrates_agent, "process_dialogue", user_message, None, generation_params=params
+        )
+
+    if response_data.get("status") == "error":
+        return jsonify({"error": response_data.get("response", "内部错误")}), 500
+    dialogue_sessions.set(session_id, response_data["state"])
+    return jsonify({
+        "session_id": session_id,
+        "response": response_data["response"],
+        "character": response_data["state"]["simulated_character"],
+        "topic": response_data["state"]["current_topic"],
+        "turn_count": response_data["state"]["turn_count"],
+    })
 
 
 @app.route('/continue_dialogue', methods=['POST'])
@@ -254,160 +211,172 @@ def continue_dialogue():
     image_data = data.get("image")
     response_mode = (data.get("response_mode") or "balanced").lower()
 
-    if not session_id or session_id not in dialogue_sessions:
+    current_state = dialogue_sessions.get(session_id) if session_id else None
+    if current_state is None:
         return jsonify({"error": "会话已过期，请重新开始对话"}), 400
     if not user_message and not image_data:
         return jsonify({"error": "请输入您的回应或上传图片"}), 400
 
-    image_path = None
+    image = None
     if image_data:
-        image_path = save_uploaded_image(image_data)
-        if not image_path:
+        image = decode_uploaded_image(image_data)
+        if not image:
             return jsonify({"error": "图片处理失败"}), 400
 
-    try:
-        current_state = dialogue_sessions[session_id]
-        try:
-            if hasattr(socrates_agent, 'set_generation_params'):
-                if response_mode == 'fast':
-                    socrates_agent.set_generation_params(max_tokens=400, timeout=15, retrieval_k=3)
-                elif response_mode == 'detailed':
-                    socrates_agent.set_generation_params(max_tokens=1600, timeout=45, retrieval_k=7)
-                else:
-                    socrates_agent.set_generation_params(max_tokens=1000, timeout=30, retrieval_k=5)
-        except Exception:
-            pass
-
-        if not user_message:
-            user_message = "请结合这张图片继续对话并提出苏格拉底式问题。"
-        if image_path and hasattr(socrates_agent, 'process_multimodal_dialogue'):
-            response_data = socrates_agent.process_multimodal_dialogue(user_message, current_state, image_path)
-        else:
-            response_data = socrates_agent.process_dialogue(user_message, current_state)
-
-        if response_data.get("status") == "error":
-            return jsonify({"error": response_data.get("response", "内部错误")}), 500
-        dialogue_sessions[session_id] = response_data["state"]
-        return jsonify({
-            "response": response_data["response"],
-            "character": response_data["state"]["simulated_character"],
-            "topic": response_data["state"]["current_topic"],
-            "turn_count": response_data["state"]["turn_count"],
-        })
-    finally:
-        if image_path:
-            try:
-                if os.path.exists(image_path):
-                    os.unlink(image_path)
-            except Exception:
-                pass
+    params = resolve_response_mode(response_mode)
+
+    if not user_message:
+        user_message = "请结合这张图片继续对话并提出苏格拉底式问题。"
+    if image and hasattr(socrates_agent, 'process_multimodal_dialogue'):
+        response_data = call_with_generation_params(
+            socrates_agent, "process_multimodal_dialogue", user_message, current_state, image,
+            generation_params=params,
+        )
+    else:
+        response_data = call_with_generation_params(
+            socrates_agent, "process_dialogue", user_message, current_state, generation_params=params
+        )
+
+    if response_data.get("status") == "error":
+        return jsonify({"error": response_data.get("response", "内部错误")}), 500
+    dialogue_sessions.set(session_id, response_data["state"])
+    return jsonify({
+        "response": response_data["response"],
+        "character": response_data["state"]["simulated_character"],
+        "topic": response_data["state"]["current_topic"],
+        "turn_count": response_data["state"]["turn_count"],
+    })
 
 
 @app.route('/end_dialogue', methods=['POST'])
 def end_dialogue():
     data = request.get_json(silent=True) or {}
     session_id = data.get("session_id")
-    if session_id and session_id in dialogue_sessions:
-        dialogue_sessions.pop(session_id, None)
+    if session_id and dialogue_sessions.delete(session_id):
         return jsonify({"message": "对话已结束"})
     return jsonify({"message": "会话未找到或已结束"})
 
 
+def _respond(
+    route: str,
+    user_message: str,
+    image: Optional[UploadedImage],
+    response_mode: str,
+    conversation_id: Optional[str] = None,
+) -> str:
+    params = resolve_response_mode(response_mode)
+    if route == "kg":
+        if kg_agent:
+            if image:
+                return "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
+            return call_with_generation_params(kg_agent, "process_request", user_message, generation_params=params)
+        return "知识图谱助手未成功加载，无法处理您的请求。"
+    if route == "question":
+        if question_agent:
+            if hasattr(question_agent, 'process_multimodal_request') and image:
+                return call_with_generation_params(
+                    question_agent, "process_multimodal_request", user_message, image,
+                    generation_params=params, conversation_id=conversation_id,
+                )
+            if image:
+                return "当前版本暂时不支持图片分析，请使用纯文本提问。"
+            return call_with_generation_params(
+                question_agent, "process_request", user_message,
+                generation_params=params, conversation_id=conversation_id,
+            )
+        return "出题助手未成功加载，无法处理您的请求。"
+    if qa_agent:
+        if image and hasattr(qa_agent, 'process_multimodal_request'):
+            return call_with_generation_params(
+                qa_agent, "process_multimodal_request", user_message, image, generation_params=params
+            )
+        return call_with_generation_params(qa_agent, "process_request", user_message, generation_params=params)
+    return "问答助手未成功加载，无法处理您的请求。"
+
+
+def _conversation_id(data: dict) -> str:
+    """客户端回传的对话 id；首次请求时生成并随响应返回，出题 Agent 按它保存最近一次出题的答案解析。"""
+    conversation_id = str(data.get("conversation_id") or "").strip()[:64]
+    return conversation_id or uuid.uuid4().hex
+
+
+def _sse(payload: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return prefix + f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.get_json(silent=True) or {}
     user_message = (data.get("message") or "").strip()
     image_data = data.get("image")
     response_mode = (data.get("response_mode") or "balanced").lower()
+    conversation_id = _conversation_id(data)
 
     if not user_message and not image_data:
         return jsonify({"error": "请输入文本或上传图片"}), 400
 
-    image_path = None
+    image = None
     if image_data:
-        image_path = save_uploaded_image(image_data)
-        if not image_path:
+        image = decode_uploaded_image(image_data)
+        if not image:
             return jsonify({"error": "图片处理失败"}), 400
 
     response_text = ""
     try:
         if not user_message:
             user_message = "请结合图片进行分析并回答问题。"
-
-        def apply_mode(agent):
-            try:
-                if not hasattr(agent, 'set_generation_params'):
-                    return
-                if response_mode == 'fast':
-                    agent.set_generation_params(max_tokens=400, timeout=15, retrieval_k=3)
-                elif response_mode == 'detailed':
-                    agent.set_generation_params(max_tokens=1600, timeout=45, retrieval_k=7)
-                else:
-                    agent.set_generation_params(max_tokens=1000, timeout=30, retrieval_k=5)
-            except Exception:
-                pass
-
-        if any(k in user_message for k in ["知识图谱", "思维导图", "mindmap", "图谱"]):
-            if kg_agent:
-                apply_mode(kg_agent)
-                if image_path:
-                    response_text = "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
-                else:
-                    response_text = kg_agent.process_request(user_message)
-            else:
-                response_text = "知识图谱助手未成功加载，无法处理您的请求。"
-        else:
-            answer_keywords = ["解答", "答案", "解析", "请回答", "帮我回答", "帮我解答"]
-            contains_mcq_options = False
-            try:
-                import re
-                if re.search(r"[A-DＡ-Ｄ][\.．、]\s?", user_message):
-                    contains_mcq_options = True
-            except Exception:
-                contains_mcq_options = False
-
-            if any(kw in user_message for kw in answer_keywords) or contains_mcq_options:
-                if qa_agent:
-                    apply_mode(qa_agent)
-                    if image_path and hasattr(qa_agent, 'process_multimodal_request'):
-                        response_text = qa_agent.process_multimodal_request(user_message, image_path)
-                    else:
-                        response_text = qa_agent.process_request(user_message)
-                else:
-                    response_text = "问答助手未成功加载，无法处理您的请求。"
-            else:
-                exam_keywords = ["出题", "生成题目", "选择题", "判断题", "简答题", "试题", "练习"]
-                if any(kw in user_message for kw in exam_keywords):
-                    if question_agent:
-                        apply_mode(question_agent)
-                        if hasattr(question_agent, 'process_multimodal_request') and image_path:
-                            response_text = question_agent.process_multimodal_request(user_message, image_path)
-                        else:
-                            if image_path:
-                                response_text = "当前版本暂时不支持图片分析，请使用纯文本提问。"
-                            else:
-                                response_text = question_agent.process_request(user_message)
-                    else:
-                        response_text = "出题助手未成功加载，无法处理您的请求。"
-                else:
-                    if qa_agent:
-                        apply_mode(qa_agent)
-                        if image_path and hasattr(qa_agent, 'process_multimodal_request'):
-                            response_text = qa_agent.process_multimodal_request(user_message, image_path)
-                        else:
-                            response_text = qa_agent.process_request(user_message)
-                    else:
-                        response_text = "问答助手未成功加载，无法处理您的请求。"
+        response_text = _respond(route_message(user_message), user_message, image, response_mode, conversation_id)
     except Exception as e:
         response_text = f"处理您的请求时发生内部错误: {e}"
-    finally:
-        try:
-            if image_path and os.path.exists(image_path):
-                os.unlink(image_path)
-        except Exception:
-            pass
 
-    return jsonify({"response": response_text})
+    return jsonify({"response": response_text, "conversation_id": conversation_id})
+
+
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """Same routing as /chat, answered as Server-Sent Events.
+
+    Text-only Q&A requests are streamed token by token; the other agents emit
+    their complete answer as a single `delta` event. The stream always ends
+    with an `event: done` message.
+    """
+    data = request.get_json(silent=True) or {}
+    user_message = (data.get("message") or "").strip()
+    image_data = data.get("image")
+    response_mode = (data.get("response_mode") or "balanced").lower()
+    conversation_id = _conversation_id(data)
+
+    if not user_message and not image_data:
+        return jsonify({"error": "请输入文本或上传图片"}), 400
+
+    image = None
+    if image_data:
+        image = decode_uploaded_image(image_data)
+        if not image:
+            return jsonify({"error": "图片处理失败"}), 400
+
+    if not user_message:
+        user_message = "请结合图片进行分析并回答问题。"
+
+    def generate():
+        try:
+            route = route_message(user_message)
+            if route == "qa" and not image and qa_agent and hasattr(qa_agent, 'stream_request'):
+                params = resolve_response_mode(response_mode)
+                for delta in qa_agent.stream_request(user_message, generation_params=params):
+                    yield _sse({"delta": delta})
+            else:
+                yield _sse({"delta": _respond(route, user_message, image, response_mode, conversation_id)})
+        except Exception as e:
+            yield _sse({"error": f"处理您的请求时发生内部错误: {e}"}, event="error")
+        yield _sse({"conversation_id": conversation_id}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 def run_app():
@@ -1,6 +1,7 @@
 import os
 import sys
-from typing import Optional
+from functools import lru_cache
+from typing import Any, Dict, Optional
 
 """确保将共享代码目录加入 sys.path（作为普通文件夹使用）"""
 try:
@@ -23,6 +24,15 @@ except Exception:
     from common_utils.base_dialogue_agent import BaseDialogueAgent, DialogueGraphState
     from common_utils.multimodal_agent import SocratesMultimodalAgent
 
+from shared_utils.generation_params import generation_scope
+from shared_utils.uploaded_image import ImageInput
+
+
+@lru_cache(maxsize=32)
+def _multimodal_agent_for(character: str, topic: str) -> "SocratesMultimodalAgent":
+    """按（人物, 话题）缓存的多模态 Agent：上下文在构造时确定，之后不再修改，可被并发请求共用。"""
+    return SocratesMultimodalAgent(character=character, topic=topic)
+
 
 class SocratesAgent(BaseDialogueAgent):
     def __init__(self):
@@ -35,19 +45,38 @@ class SocratesAgent(BaseDialogueAgent):
             temperature=0.8,
         )
         try:
-            self.multimodal_agent = SocratesMultimodalAgent(character="习近平", topic="新时代中国特色社会主义思想")
+            self.multimodal_agent = _multimodal_agent_for("习近平", "新时代中国特色社会主义思想")
         except Exception:
             self.multimodal_agent = None
 
-    def process_multimodal_dialogue(self, user_input: str, current_state: Optional[dict] = None, image_path: Optional[str] = None) -> dict:
+    def process_dialogue(
+        self,
+        user_input: str,
+        current_state: Optional[dict] = None,
+        generation_params: Optional[Dict[str, Any]] = None,
+    ) -> dict:
+        # 对话的 LLM 调用在 BaseDialogueAgent 内部，本次请求的参数经 generation_scope 传到 llm.invoke
+        with generation_scope(generation_params):
+            return super().process_dialogue(user_input, current_state)
+
+    def process_multimodal_dialogue(
+        self,
+        user_input: str,
+        current_state: Optional[dict] = None,
+        image_path: Optional[ImageInput] = None,
+        generation_params: Optional[Dict[str, Any]] = None,
+    ) -> dict:
         if not image_path or not self.multimodal_agent:
-            return self.process_dialogue(user_input, current_state)
+            return self.process_dialogue(user_input, current_state, generation_params)
         try:
+            multimodal_agent = self.multimodal_agent
             if current_state:
+                # 不修改共享的 self.multimodal_agent，按会话的人物与话题取对应实例
                 character = current_state.get("simulated_character", "习近平")
                 topic = current_state.get("current_topic", "新时代中国特色社会主义思想")
-                self.multimodal_agent.update_dialogue_context(character, topic)
-            response = self.multimodal_agent.process_multimodal_request(user_input, image_path)
+                multimodal_agent = _multimodal_agent_for(character, topic)
+            with generation_scope(generation_params):
+                response = multimodal_agent.process_multimodal_request(user_input, image_path)
             if not current_state:
                 new_state = {
                     "simulated_character": "习近平",
@@ -67,7 +96,7 @@ class SocratesAgent(BaseDialogueAgent):
             ])
             return {"status": "success", "response": response, "state": current_state}
         except Exception:
-            return self.process_dialogue(user_input, current_state)
+            return self.process_dialogue(user_input, current_state, generation_params)
 
 
 
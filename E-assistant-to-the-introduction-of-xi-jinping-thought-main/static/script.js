@@ -13,6 +13,8 @@ document.addEventListener('DOMContentLoaded', () => {
   const modeSelect = document.getElementById('response-mode');
 
   let selectedImageData = null;
+  // 服务端在首次回复中下发的对话 id，之后每次请求带上（用于取回本对话所出题目的答案解析）
+  let conversationId = null;
 
   try {
     if (window.mermaidMindmap && typeof mermaid.registerExternalDiagrams === 'function') {
@@ -27,6 +29,7 @@ document.addEventListener('DOMContentLoaded', () => {
     chatBox.innerHTML = initialChatHTML;
     userInput.value = '';
     clearSelectedImage();
+    conversationId = null;
     if (endBtn) endBtn.style.display = 'none';
   };
 
@@ -55,12 +58,14 @@ document.addEventListener('DOMContentLoaded', () => {
     const payload = { message: text };
     if (modeSelect && modeSelect.value) payload.response_mode = modeSelect.value;
     if (selectedImageData) payload.image = selectedImageData;
+    if (conversationId) payload.conversation_id = conversationId;
     userInput.value = '';
     clearSelectedImage();
     showLoading(true);
     try {
       const resp = await fetch('./chat', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) });
       const data = await resp.json();
+      if (data.conversation_id) conversationId = data.conversation_id;
       appendMessage(data.response || data.error || '（无回复）', 'bot');
     } catch (e) {
       appendMessage('网络错误，请稍后重试。', 'bot');
@@ -3,7 +3,7 @@
 """
 import os
 import sys
-from typing import Optional
+from typing import Any, Dict, Optional
 
 try:
     _PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -22,6 +22,15 @@ except Exception:
     from common_utils.base_agent import BaseAgent
     from common_utils.multimodal_agent import MayuanMultimodalAgent
 
+from shared_utils.generation_params import generation_scope
+from shared_utils.session_store import get_session_store
+from shared_utils.uploaded_image import ImageInput
+
+# 各对话最近一次出题的完整输出（含答案解析），按对话 id 存放，供随后的“解析/答案”请求取回；
+# Agent 是各请求共享的单例，不在其上保存任何请求结果
+_QUIZ_OUTPUTS = get_session_store("xigai_quiz")
+_NO_QUIZ = "当前没有可供解析的题目，请先提出出题需求。"
+
 
 class XigaiQuestionAgent(BaseAgent):
     """“习近平新时代中国特色社会主义思想概论”课程的智能出题 Agent。"""
@@ -45,33 +54,50 @@ class XigaiQuestionAgent(BaseAgent):
             print(f"[习概Agent] 多模态功能初始化失败: {e}")
             self.multimodal_agent = None
 
-        self._last_full_output: str = ""
-        self._last_question_only_output: str = ""
-
-    def process_request(self, user_input: str) -> str:
+    def process_request(
+        self,
+        user_input: str,
+        generation_params: Optional[Dict[str, Any]] = None,
+        conversation_id: Optional[str] = None,
+    ) -> str:
         if any(kw in user_input for kw in ["解析", "答案", "讲解", "答案解析", "参考答案"]):
-            if self._last_full_output:
-                return self._last_full_output
-            return "当前没有可供解析的题目，请先提出出题需求。"
-        full_output = super().process_request(user_input)
-        self._last_full_output = full_output
-        self._last_question_only_output = self._strip_explanations(full_output)
-        return self._last_question_only_output
-
-    def process_multimodal_request(self, text_input: str, image_path: Optional[str] = None) -> str:
+            return self._last_quiz(conversation_id)
+        # 出题的 LLM 调用在 BaseAgent 内部，本次请求的参数经 generation_scope 传到 llm.invoke
+        with generation_scope(generation_params):
+            full_output = super().process_request(user_input)
+        self._remember_quiz(conversation_id, full_output)
+        return self._strip_explanations(full_output)
+
+    def process_multimodal_request(
+        self,
+        text_input: str,
+        image_path: Optional[ImageInput] = None,
+        generation_params: Optional[Dict[str, Any]] = None,
+        conversation_id: Optional[str] = None,
+    ) -> str:
         if not image_path or not self.multimodal_agent:
-            return self.process_request(text_input)
+            return self.process_request(text_input, generation_params, conversation_id)
         if any(kw in text_input for kw in ["解析", "答案", "讲解", "答案解析", "参考答案"]):
-            return self._last_full_output or "当前没有可供解析的题目，请先提出出题需求。"
+            return self._last_quiz(conversation_id)
         try:
-            full_output = self.multimodal_agent.process_multimodal_request(text_input, image_path)
-            self._last_full_output = full_output
+            with generation_scope(generation_params):
+                full_output = self.multimodal_agent.process_multimodal_request(text_input, image_path)
+            self._remember_quiz(conversation_id, full_output)
             if any(kw in text_input for kw in ["出题", "生成题目", "题目", "选择题", "判断题", "简答题", "试题", "练习"]):
-                self._last_question_only_output = self._strip_explanations(full_output)
-                return self._last_question_only_output
+                return self._strip_explanations(full_output)
             return full_output
         except Exception:
-            return self.process_request(text_input)
+            return self.process_request(text_input, generation_params, conversation_id)
+
+    @staticmethod
+    def _last_quiz(conversation_id: Optional[str]) -> str:
+        full_output = _QUIZ_OUTPUTS.get(conversation_id) if conversation_id else None
+        return full_output or _NO_QUIZ
+
+    @staticmethod
+    def _remember_quiz(conversation_id: Optional[str], full_output: str) -> None:
+        if conversation_id and full_output:
+            _QUIZ_OUTPUTS.set(conversation_id, str(full_output))
 
     def _strip_explanations(self, text: str) -> str:
         import re
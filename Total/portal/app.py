@@ -1,8 +1,8 @@
 import os
 import sys
 import importlib.util
+from functools import partial
 from flask import Flask, render_template
-from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from dotenv import load_dotenv
 
 # Ensure shared_utils (plain folder) is importable without packaging
@@ -14,6 +14,10 @@ _REPO_ROOT = os.path.abspath(os.path.join(_PORTAL_ROOT, os.pardir))
 if _REPO_ROOT not in sys.path:
     sys.path.insert(0, _REPO_ROOT)
 
+from shared_utils.lazy_dispatch import LazyDispatcherMiddleware
+from shared_utils.metrics import collect_stats, register_stats_provider
+from shared_utils import startup_profile
+
 
 def _load_sub_app(module_name: str, file_path: str):
     module_dir = os.path.dirname(file_path)
@@ -24,14 +28,26 @@ def _load_sub_app(module_name: str, file_path: str):
         raise RuntimeError(f"无法加载模块: {module_name} at {file_path}")
     module = importlib.util.module_from_spec(spec)
     sys.modules[module_name] = module
-    spec.loader.exec_module(module)
+    try:
+        with startup_profile.profile_section("subapp", module_name):
+            spec.loader.exec_module(module)
+    except Exception:
+        # 避免按需加载失败后残留半初始化的模块，下一次请求可重新导入
+        sys.modules.pop(module_name, None)
+        raise
     if not hasattr(module, "app"):
         raise RuntimeError(f"模块 {module_name} 未暴露 Flask 变量 'app'")
     return module.app
 
 
-def create_app() -> Flask:
+def create_app(profile: bool = False) -> Flask:
+    """组装门户；profile=True（或 STARTUP_PROFILE=1）时记录启动耗时并输出报告。"""
     load_dotenv()
+    if profile:
+        startup_profile.enable()
+    profiling = startup_profile.is_enabled()
+    if profiling:
+        startup_profile.profile_imports()
     app = Flask(__name__, template_folder="templates", static_folder="static")
 
     @app.route("/")
@@ -69,6 +85,10 @@ def create_app() -> Flask:
     def healthz():
         return {"status": "ok"}
 
+    @app.route("/metrics")
+    def metrics():
+        return collect_stats()
+
     # Mount 3 sub-apps under one process
     # Resolve workspace root robustly (support nested folder named the same)
     candidate_roots = [
@@ -77,7 +97,14 @@ def create_app() -> Flask:
     ]
     base_dir = None
     for root in candidate_roots:
-        if os.path.isdir(os.path.join(root, "A-assistant-to-the-basic-principles-of-Marxism-main")):
+        # 子应用改为按需加载后，缺少某一个子应用目录不应影响其余挂载
+        if any(
+            os.path.isdir(os.path.join(root, name))
+            for name in (
+                "A-assistant-to-the-basic-principles-of-Marxism-main",
+                "B-assistant-to-the-outline-of-modern-chinese-history-main",
+            )
+        ):
             base_dir = root
             break
     if base_dir is None:
@@ -90,22 +117,46 @@ def create_app() -> Flask:
     maogai_path = os.path.join(base_dir, "D-assistant-to-the-introduction-of-mao-zedong-thought-main", "app.py")
     xigai_path = os.path.join(base_dir, "E-assistant-to-the-introduction-of-xi-jinping-thought-main", "app.py")
 
-    mayuan_app = _load_sub_app("mayuan_app", mayuan_path)
-    jindaishi_app = _load_sub_app("jindaishi_app", jindaishi_path)
-    sdfz_app = _load_sub_app("sdfz_app", sdfz_path)
-    maogai_app = _load_sub_app("maogai_app", maogai_path)
-    xigai_app = _load_sub_app("xigai_app", xigai_path)
-
-    app.wsgi_app = DispatcherMiddleware(
+    # 子应用在首个请求到达时才导入；PORTAL_LAZY_MOUNT=0 恢复启动时全部加载，
+    # PORTAL_PREWARM=1（或逗号分隔的挂载名，如 jindaishi,maogai）在后台线程中预热
+    dispatcher = LazyDispatcherMiddleware(
         app.wsgi_app,
         {
-            "/mayuan": mayuan_app,
-            "/jindaishi": jindaishi_app,
-            "/sdfz": sdfz_app,
-            "/maogai": maogai_app,
-            "/xigai": xigai_app,
+            "/mayuan": partial(_load_sub_app, "mayuan_app", mayuan_path),
+            "/jindaishi": partial(_load_sub_app, "jindaishi_app", jindaishi_path),
+            "/sdfz": partial(_load_sub_app, "sdfz_app", sdfz_path),
+            "/maogai": partial(_load_sub_app, "maogai_app", maogai_path),
+            "/xigai": partial(_load_sub_app, "xigai_app", xigai_path),
         },
     )
+    app.wsgi_app = dispatcher
+    register_stats_provider("mounts", dispatcher.report)
+
+    lazy = os.environ.get("PORTAL_LAZY_MOUNT", "1") != "0"
+    prewarm = os.environ.get("PORTAL_PREWARM", "").strip()
+
+    @app.route("/startupz")
+    def startupz():
+        payload = {"lazy": lazy, "mounts": dispatcher.report()}
+        if profiling:
+            payload["profile"] = startup_profile.report()
+        return payload
+
+    if profiling:
+        # 剖析模式下同步加载全部子应用，报告才能覆盖完整的冷启动
+        dispatcher.load_all(trigger="profile")
+        print("[Portal] 启动耗时（按耗时降序）：\n" + startup_profile.format_table())
+        json_path = os.environ.get("STARTUP_PROFILE_JSON")
+        if json_path:
+            startup_profile.dump(json_path)
+            print(f"[Portal] 启动剖析结果已写入 {json_path}")
+    elif not lazy:
+        dispatcher.load_all()
+    elif prewarm and prewarm != "0":
+        if prewarm.lower() in ("1", "all", "true"):
+            dispatcher.prewarm()
+        else:
+            dispatcher.prewarm("/" + name.strip().strip("/") for name in prewarm.split(",") if name.strip())
 
     return app
 
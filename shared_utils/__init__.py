@@ -5,14 +5,38 @@ without extra packaging or installation steps.
 """
 
 __all__ = [
+	"ann_index",
 	"base_agent",
 	"base_dialogue_agent",
 	"base_kg_agent",
 	"base_retrieval_agent",
+	"batch_retrieval",
+	"compact_docstore",
+	"completion_cache",
+	"dashscope_async",
+	"embedding_cache",
+	"fake_dashscope",
+	"generation_params",
+	"image_payload",
+	"index_build",
+	"intent_router",
+	"lazy_dispatch",
+	"lexical_index",
 	"llm_wrapper",
+	"loadtest",
+	"metrics",
 	"multimodal_agent",
+	"multimodal_race",
+	"ocr",
 	"prompts",
+	"rate_limit",
+	"retrieval_cache",
+	"semantic_cache",
+	"session_store",
+	"startup_profile",
+	"uploaded_image",
 	"vector_utils",
+	"vectorstore_registry",
 ]
 
 
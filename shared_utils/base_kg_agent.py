@@ -4,14 +4,23 @@ Reusable BaseKnowledgeGraphAgent for generating Mermaid mindmaps.
 """
 import os
 import re
-from typing import List
+from typing import Any, Dict, List, Optional
 
-from langchain_community.vectorstores import FAISS
-from langchain_dashscope.embeddings import DashScopeEmbeddings
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage
 
+from .generation_params import llm_kwargs, retrieval_k
 from .llm_wrapper import CustomChatDashScope
+from .vectorstore_registry import get_embeddings, get_vectorstore
+
+
+_CONCEPT_SEPARATORS = re.compile(r"[、，,；;/]|\s+(?:和|与|及)\s+")
+
+
+def split_concepts(topic: str) -> List[str]:
+    """按顿号、逗号等拆分并列的子概念，如“遵义会议、古田会议” -> 两个子概念。"""
+    parts = [p.strip() for p in _CONCEPT_SEPARATORS.split(topic)]
+    return [p for p in parts if p] or [topic]
 
 
 class BaseKnowledgeGraphAgent:
@@ -30,17 +39,14 @@ class BaseKnowledgeGraphAgent:
         if "DASHSCOPE_API_KEY" not in os.environ:
             raise EnvironmentError("Please set the DASHSCOPE_API_KEY environment variable.")
 
-        self.embeddings = DashScopeEmbeddings(model="text-embedding-v2")
-        self.llm = CustomChatDashScope(model="qwen-max", temperature=0.5)
+        self.embeddings = get_embeddings("text-embedding-v2")
+        # 同一知识点的图谱请求高度重复，默认启用补全缓存
+        self.llm = CustomChatDashScope(model="qwen-max", temperature=0.5, use_cache=True)
 
-        # 尝试加载向量库；失败则降级为 None
+        # 尝试获取共享向量库（同一路径在进程内只加载一次）；失败则降级为 None
         self.vectorstore = None
         try:
-            self.vectorstore = FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
+            self.vectorstore = get_vectorstore(self.vectorstore_path, "text-embedding-v2")
         except Exception as e:
             print(f"[KG] 警告：向量库未找到或加载失败（{self.vectorstore_path}）。将使用零检索模式。原因: {e}")
 
@@ -67,17 +73,24 @@ mindmap
         )
 
     def _retrieve_docs(self, topic: str, k: int = 5) -> List[str]:
-        query = f"{topic} {self.subject_name}"
         if self.vectorstore is None:
             return []
+        concepts = split_concepts(topic)
         try:
-            docs = self.vectorstore.similarity_search(query, k=k)
+            if len(concepts) > 1:
+                # 多个子概念：一次嵌入、一次检索，合并去重后取前 k 个
+                queries = [f"{concept} {self.subject_name}" for concept in concepts]
+                docs = self.vectorstore.multi_query_search(queries, k=k, limit=k)
+            else:
+                docs = self.vectorstore.similarity_search(f"{topic} {self.subject_name}", k=k)
             return [doc.page_content for doc in docs]
         except Exception as e:
             print(f"[KG] 检索失败，将返回空上下文。原因: {e}")
             return []
 
-    def _generate_mermaid(self, topic: str, context: str) -> str:
+    def _generate_mermaid(
+        self, topic: str, context: str, generation_params: Optional[Dict[str, Any]] = None
+    ) -> str:
         prompt_text = self.graph_prompt.format(
             subject_name=self.subject_name, topic=topic, context=context
         )
@@ -85,7 +98,7 @@ mindmap
             SystemMessage(content="你是一位精通知识图谱构建的学者。"),
             HumanMessage(content=prompt_text),
         ]
-        response = self.llm.invoke(messages)
+        response = self.llm.invoke(messages, **llm_kwargs(generation_params))
         return str(getattr(response, "content", response)).strip()
 
     def _format_mermaid_response(self, raw_output: str) -> str:
@@ -102,8 +115,9 @@ mindmap
             formatted_output += f"\n\n{summary}"
         return formatted_output.strip()
 
-    def build_knowledge_graph(self, topic: str) -> str:
-        docs = self._retrieve_docs(topic, k=5)
+    def build_knowledge_graph(self, topic: str, generation_params: Optional[Dict[str, Any]] = None) -> str:
+        """生成知识图谱；generation_params 为本次请求的参数（见 shared_utils.generation_params）。"""
+        docs = self._retrieve_docs(topic, k=retrieval_k(generation_params))
         context = "\n\n".join(docs)
-        raw_output = self._generate_mermaid(topic, context)
+        raw_output = self._generate_mermaid(topic, context, generation_params)
         return self._format_mermaid_response(raw_output)
\ No newline at end of file
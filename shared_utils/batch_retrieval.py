@@ -0,0 +1,105 @@
+"""
+多查询批量检索。
+
+出题 Agent 的 `parse_input_node` 一次可能识别出多个知识点，知识图谱 Agent 也可以按子
+概念分别检索；逐个调用 `similarity_search` 意味着 N 次嵌入往返与 N 次 FAISS 检索。
+
+本模块把 N 个查询合成一批：一次 `embed_documents` 取得全部查询向量，对堆叠后的查询
+矩阵做一次 `index.search`，再用 NumPy 向量化地按行号去重（同一文本块被多个查询命中时
+保留最高得分）。索引带 BM25 词法索引时，每个查询先与词法结果做 RRF 融合再合并。
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from .lexical_index import LexicalIndex, rrf_scores
+
+
+def _higher_is_better(store: Any) -> bool:
+    strategy = str(getattr(store, "distance_strategy", "EUCLIDEAN_DISTANCE"))
+    return "EUCLIDEAN" not in strategy.upper()
+
+
+def search_rows(
+    store: Any,
+    queries: Sequence[str],
+    k: int,
+    lexical: Optional[LexicalIndex] = None,
+    fetch_k: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """返回形状均为 (len(queries), m) 的 (行号, 得分) 矩阵，每行按得分降序，
+    空位行号为 -1、得分为 -inf；得分越高越相关。"""
+    if not queries:
+        return np.empty((0, 0), dtype=np.int64), np.empty((0, 0), dtype=np.float64)
+    matrix = np.asarray(store.embedding_function.embed_documents(list(queries)), dtype=np.float32)
+    if getattr(store, "_normalize_L2", False):
+        import faiss
+
+        faiss.normalize_L2(matrix)
+    fetch = fetch_k or (max(20, 4 * k) if lexical is not None else k)
+    distances, ids = store.index.search(matrix, fetch)
+    scores = distances.astype(np.float64) if _higher_is_better(store) else -distances.astype(np.float64)
+    scores[ids < 0] = -np.inf
+    if lexical is None:
+        return ids[:, :k], scores[:, :k]
+
+    fused_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    fused_scores = np.full((len(queries), k), -np.inf)
+    for i, query in enumerate(queries):
+        lexical_rows, _ = lexical.search(query, fetch)
+        rows, row_scores = rrf_scores([ids[i], lexical_rows])
+        fused_ids[i, : min(k, len(rows))] = rows[:k]
+        fused_scores[i, : min(k, len(rows))] = row_scores[:k]
+    return fused_ids, fused_scores
+
+
+def dedupe_hits(ids: np.ndarray, scores: np.ndarray, limit: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """合并各查询的命中：同一行号只保留最高得分，结果按得分降序，最多 limit 个。"""
+    flat_ids = ids.ravel()
+    flat_scores = scores.ravel()
+    valid = flat_ids >= 0
+    flat_ids, flat_scores = flat_ids[valid], flat_scores[valid]
+    order = np.argsort(-flat_scores, kind="stable")
+    flat_ids, flat_scores = flat_ids[order], flat_scores[order]
+    _, first = np.unique(flat_ids, return_index=True)
+    first.sort()
+    return flat_ids[first][:limit], flat_scores[first][:limit]
+
+
+def _documents(store: Any, rows: Sequence[int], cache: Dict[int, Document]) -> List[Document]:
+    docs: List[Document] = []
+    for row in rows:
+        row = int(row)
+        if row not in cache:
+            doc = store.docstore.search(store.index_to_docstore_id[row])
+            if not isinstance(doc, Document):
+                continue
+            cache[row] = doc
+        docs.append(cache[row])
+    return docs
+
+
+def batch_similarity_search(
+    store: Any,
+    queries: Sequence[str],
+    k: int = 4,
+    lexical: Optional[LexicalIndex] = None,
+) -> List[List[Document]]:
+    """每个查询各自的前 k 个文档。"""
+    ids, _ = search_rows(store, queries, k, lexical)
+    cache: Dict[int, Document] = {}
+    return [_documents(store, row_ids[row_ids >= 0], cache) for row_ids in ids]
+
+
+def multi_query_search(
+    store: Any,
+    queries: Sequence[str],
+    k: int = 4,
+    limit: Optional[int] = None,
+    lexical: Optional[LexicalIndex] = None,
+) -> List[Document]:
+    """每个查询取前 k 个，合并去重后按得分降序返回（最多 limit 个，默认 k·len(queries)）。"""
+    ids, scores = search_rows(store, queries, k, lexical)
+    rows, _ = dedupe_hits(ids, scores, limit)
+    return _documents(store, rows, {})
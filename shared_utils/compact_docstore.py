@@ -0,0 +1,252 @@
+"""
+紧凑的只读 docstore 格式（不使用 pickle）。
+
+`FAISS.save_local` 写出的 `index.pkl` 是 `InMemoryDocstore` 的 pickle：加载时必须
+`allow_dangerous_deserialization=True`，全部文本块一次性反序列化成 `Document` 常驻内存，
+且 pickle 与生成它的 langchain / pydantic 版本绑定。
+
+本模块把 docstore 写成索引目录下的 `docstore/` 子目录，按 FAISS 向量位置逐行存放：
+
+- `text.bin`：全部 page_content 依次拼接的 UTF-8 字节；
+- `offsets.npy`：int64[n + 1]，第 i 行文本为 text.bin[offsets[i]:offsets[i + 1]]；
+- `ids.npy`：docstore id（定长 ASCII），`sorted_ids.npy` / `sorted_rows.npy` 供按 id 二分查找；
+- `columns.npy`：int32[n, k]，每个元数据字段一列，值为该字段取值表中的下标（-1 表示缺失）；
+- `meta.json`：版本、行数与各字段的取值表（JSON 值）。
+
+加载时各数组与文本都以内存映射方式打开，只有被检索命中的文本块才会解码成 `Document`。
+`load_faiss()` 优先读取该格式，不存在时退回 `FAISS.load_local`（pickle）；
+`python -m shared_utils.compact_docstore <索引目录>...` 把已有的 index.pkl 转换为该格式。
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from .ann_index import apply_search_params, load_ann_config
+
+DOCSTORE_DIR = "docstore"
+FORMAT_VERSION = 1
+
+
+def has_compact_docstore(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, DOCSTORE_DIR, "meta.json"))
+
+
+def write_compact_docstore(directory: str, index_to_docstore_id: Dict[int, str], docstore: Any) -> None:
+    """按向量位置 0..n-1 的顺序写出 docstore；位置必须连续（FAISS.delete 后即是如此）。"""
+    n = len(index_to_docstore_id)
+    if sorted(index_to_docstore_id) != list(range(n)):
+        raise ValueError("index_to_docstore_id 的位置不连续，无法按行写出 docstore")
+    ids = [index_to_docstore_id[i] for i in range(n)]
+    docs = [docstore.search(doc_id) for doc_id in ids]
+    for doc_id, doc in zip(ids, docs):
+        if not isinstance(doc, Document):
+            raise ValueError(f"docstore 中缺少文本块 {doc_id}")
+
+    columns: List[str] = sorted({key for doc in docs for key in doc.metadata})
+    tables: List[List[str]] = [[] for _ in columns]
+    lookup: List[Dict[str, int]] = [{} for _ in columns]
+    codes = np.full((n, len(columns)), -1, dtype=np.int32)
+    for row, doc in enumerate(docs):
+        for col, key in enumerate(columns):
+            if key not in doc.metadata:
+                continue
+            value = json.dumps(doc.metadata[key], ensure_ascii=False, sort_keys=True)
+            code = lookup[col].get(value)
+            if code is None:
+                code = lookup[col][value] = len(tables[col])
+                tables[col].append(value)
+            codes[row, col] = code
+
+    os.makedirs(directory, exist_ok=True)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    with open(os.path.join(directory, "text.bin"), "wb") as f:
+        for row, doc in enumerate(docs):
+            data = doc.page_content.encode("utf-8")
+            f.write(data)
+            offsets[row + 1] = offsets[row] + len(data)
+    width = max([1] + [len(doc_id) for doc_id in ids])
+    id_array = np.array([doc_id.encode("ascii") for doc_id in ids], dtype=f"S{width}")
+    order = np.argsort(id_array, kind="stable")
+    np.save(os.path.join(directory, "offsets.npy"), offsets)
+    np.save(os.path.join(directory, "ids.npy"), id_array)
+    np.save(os.path.join(directory, "sorted_ids.npy"), id_array[order])
+    np.save(os.path.join(directory, "sorted_rows.npy"), order.astype(np.int64))
+    np.save(os.path.join(directory, "columns.npy"), codes)
+    # meta.json 最后写入：存在即表示其余文件已完整
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": FORMAT_VERSION,
+                "count": n,
+                "columns": columns,
+                "values": [[json.loads(v) for v in table] for table in tables],
+            },
+            f,
+            ensure_ascii=False,
+        )
+
+
+class _RowIds(Mapping):
+    """按需解码的 {向量位置: docstore id} 只读映射，替代常驻内存的 dict。"""
+
+    def __init__(self, ids: np.ndarray):
+        self._ids = ids
+
+    def __getitem__(self, position: int) -> str:
+        position = int(position)
+        if not 0 <= position < len(self._ids):
+            raise KeyError(position)
+        return self._ids[position].decode("ascii")
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self._ids)))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class CompactDocstore(Docstore):
+    """内存映射的只读 docstore，接口与 `InMemoryDocstore.search` 一致。"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"不支持的 docstore 版本: {meta.get('version')}")
+        self.count = int(meta["count"])
+        self.columns: List[str] = meta["columns"]
+        self._values: List[List[Any]] = meta["values"]
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, name), mmap_mode="r", allow_pickle=False)
+
+        self._offsets = load("offsets.npy")
+        self._ids = load("ids.npy")
+        self._sorted_ids = load("sorted_ids.npy")
+        self._sorted_rows = load("sorted_rows.npy")
+        self._codes = load("columns.npy")
+        text_path = os.path.join(directory, "text.bin")
+        # 空文件无法映射
+        self._text = np.memmap(text_path, dtype=np.uint8, mode="r") if os.path.getsize(text_path) else b""
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._offsets[-1]) if self.count else 0
+
+    def index_to_docstore_id(self) -> Mapping:
+        return _RowIds(self._ids)
+
+    def row_of(self, doc_id: str) -> Optional[int]:
+        try:
+            key = doc_id.encode("ascii")
+        except UnicodeEncodeError:
+            return None
+        pos = int(np.searchsorted(self._sorted_ids, key))
+        if pos < self.count and self._sorted_ids[pos] == key:
+            return int(self._sorted_rows[pos])
+        return None
+
+    def document(self, row: int) -> Document:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        text = bytes(self._text[start:end]).decode("utf-8")
+        metadata = {}
+        for col, code in enumerate(self._codes[row]):
+            if code >= 0:
+                metadata[self.columns[col]] = self._values[col][code]
+        return Document(page_content=text, metadata=metadata)
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self.row_of(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.document(row)
+
+    def delete(self, ids: List) -> None:
+        # 与共享向量库只读代理的报错一致；构建索引时应以 writable=True 加载
+        raise AttributeError(
+            f"共享向量库为只读（{os.path.dirname(self.directory)}），不支持 delete；如需修改请重新构建索引。"
+        )
+
+    def to_in_memory(self) -> InMemoryDocstore:
+        """完整解码为可修改的 InMemoryDocstore（构建索引时使用）。"""
+        return InMemoryDocstore({self._ids[row].decode("ascii"): self.document(row) for row in range(self.count)})
+
+
+def load_faiss(index_dir: str, embeddings: Embeddings, writable: bool = False) -> FAISS:
+    """加载索引目录：有 `docstore/` 时读取紧凑格式（writable=True 时完整解码为可修改的
+    docstore），否则退回 `FAISS.load_local` 读取 index.pkl；ann.json 中的检索参数
+    （nprobe / efSearch）随后应用到索引上。"""
+    if not has_compact_docstore(index_dir):
+        store = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    else:
+        index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+        docstore = CompactDocstore(os.path.join(index_dir, DOCSTORE_DIR))
+        if docstore.count != index.ntotal:
+            raise ValueError(f"docstore 行数 {docstore.count} 与向量数 {index.ntotal} 不一致: {index_dir}")
+        if writable:
+            store = FAISS(embeddings, index, docstore.to_in_memory(), dict(docstore.index_to_docstore_id()))
+        else:
+            store = FAISS(embeddings, index, docstore, docstore.index_to_docstore_id())
+    apply_search_params(store.index, load_ann_config(index_dir))
+    return store
+
+
+def convert(index_dir: str, remove_pickle: bool = False) -> Dict[str, Any]:
+    """把 index.pkl 转换为紧凑格式（仅用于可信的本地索引）。"""
+    pickle_path = os.path.join(index_dir, "index.pkl")
+    with open(pickle_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    staging = tempfile.mkdtemp(prefix=".docstore-", dir=index_dir)
+    try:
+        write_compact_docstore(staging, index_to_docstore_id, docstore)
+        target = os.path.join(index_dir, DOCSTORE_DIR)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    pickle_bytes = os.path.getsize(pickle_path)
+    if remove_pickle:
+        os.remove(pickle_path)
+    compact_bytes = sum(os.path.getsize(os.path.join(target, name)) for name in os.listdir(target))
+    return {
+        "index_dir": index_dir,
+        "documents": len(index_to_docstore_id),
+        "pickle_bytes": pickle_bytes,
+        "compact_bytes": compact_bytes,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="把索引目录中的 index.pkl 转换为紧凑 docstore 格式")
+    parser.add_argument("index_dirs", nargs="+", help="索引目录（含 index.faiss / index.pkl）")
+    parser.add_argument("--remove-pickle", action="store_true", help="转换后删除 index.pkl")
+    args = parser.parse_args(argv)
+    for index_dir in args.index_dirs:
+        result = convert(index_dir, remove_pickle=args.remove_pickle)
+        print(
+            f"{index_dir}: {result['documents']} 个文本块，"
+            f"index.pkl {result['pickle_bytes']} 字节 -> docstore/ {result['compact_bytes']} 字节"
+        )
+
+
+if __name__ == "__main__":
+    main()
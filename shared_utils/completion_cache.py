@@ -0,0 +1,166 @@
+"""
+LLM 补全结果的精确匹配缓存。
+
+同一班级的学生经常发送几乎相同的请求（同一道选择题、"生成关于长征的知识图谱"等），
+每次都要完整调用一次 qwen-max。本模块以（模型, temperature, max_tokens, 规范化后的消息）
+为键缓存最终文本：
+
+- 内存层：LRU，容量可配；
+- 磁盘层（可选）：sqlite，可跨进程/重启共享；
+- 两层共用同一 TTL，并统计命中/未命中次数。
+
+`CustomChatDashScope(use_cache=True)` 默认启用，单次调用可用 `llm.invoke(..., use_cache=False)` 覆盖。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import register_stats_provider
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize_content(content: Any) -> str:
+    if isinstance(content, str):
+        return _WHITESPACE_RE.sub(" ", content).strip()
+    return json.dumps(content, ensure_ascii=False, sort_keys=True)
+
+
+def make_cache_key(
+    model: str,
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    messages: List[Dict[str, Any]],
+) -> str:
+    """由模型参数与规范化消息（折叠空白）计算缓存键。"""
+    normalized = [(m.get("role", ""), _normalize_content(m.get("content", ""))) for m in messages]
+    raw = json.dumps([model, temperature, max_tokens, normalized], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """内存 LRU + 可选 sqlite 的两级补全缓存，线程安全。"""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_seconds: Optional[float] = 3600,
+        db_path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if not self._expired(item[0], now):
+                    self._memory.move_to_end(key)
+                    self._hits += 1
+                    return item[1]
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM completions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    self._remember(key, row[1], row[0])
+                    self._hits += 1
+                    self._disk_hits += 1
+                    return row[0]
+            self._misses += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, value, now),
+                )
+                if self.ttl_seconds is not None:
+                    self._db.execute(
+                        "DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,)
+                    )
+                self._db.commit()
+
+    def _remember(self, key: str, created_at: float, value: str) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM completions")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "db_path": self.db_path,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_DEFAULT_CACHE: Optional[CompletionCache] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """进程内共享的补全缓存，按环境变量配置：
+
+    - COMPLETION_CACHE_SIZE：内存层条目上限（默认 512）
+    - COMPLETION_CACHE_TTL：过期秒数（默认 3600，0 表示不过期）
+    - COMPLETION_CACHE_DB：sqlite 文件路径（不设置则只用内存层）
+    """
+    global _DEFAULT_CACHE
+    with _DEFAULT_LOCK:
+        if _DEFAULT_CACHE is None:
+            ttl = float(os.environ.get("COMPLETION_CACHE_TTL", "3600"))
+            _DEFAULT_CACHE = CompletionCache(
+                max_entries=int(os.environ.get("COMPLETION_CACHE_SIZE", "512")),
+                ttl_seconds=ttl if ttl > 0 else None,
+                db_path=os.environ.get("COMPLETION_CACHE_DB") or None,
+            )
+        return _DEFAULT_CACHE
+
+
+register_stats_provider("completion_cache", lambda: get_completion_cache().stats())
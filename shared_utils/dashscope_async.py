@@ -0,0 +1,176 @@
+"""
+DashScope HTTP 异步客户端。
+
+`dashscope.Generation.call` / `MultiModalConversation.call` 都是阻塞调用，
+在线程模型下每个进行中的请求都会占住一个线程直到生成结束。本模块直接调用
+DashScope 的 HTTP 接口，基于 aiohttp 的连接池（keep-alive）实现可 await 的
+普通调用与 SSE 流式调用，供 `CustomChatDashScope._agenerate/_astream` 等使用。
+
+aiohttp 的会话与事件循环绑定，因此连接池按事件循环各建一份并复用。
+"""
+import asyncio
+import json
+import os
+import threading
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+import dashscope
+
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/api/v1"
+TEXT_GENERATION_PATH = "/services/aigc/text-generation/generation"
+MULTIMODAL_GENERATION_PATH = "/services/aigc/multimodal-generation/generation"
+
+# 这些参数属于请求本身而非模型参数，不能放进 payload["parameters"]
+_REQUEST_OPTIONS = ("model", "messages", "stream", "timeout", "api_key")
+
+
+class DashScopeAPIError(Exception):
+    def __init__(self, status_code: int, code: str, message: str):
+        super().__init__(f"DashScope API Error: Code {code} , Message {message} (HTTP {status_code})")
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+
+
+def _base_url() -> str:
+    url = (
+        os.environ.get("DASHSCOPE_HTTP_BASE_URL")
+        or getattr(dashscope, "base_http_api_url", None)
+        or DEFAULT_BASE_URL
+    )
+    return url.rstrip("/")
+
+
+def _api_key() -> str:
+    key = getattr(dashscope, "api_key", None) or os.environ.get("DASHSCOPE_API_KEY")
+    if not key:
+        raise EnvironmentError("Please set the DASHSCOPE_API_KEY environment variable.")
+    return key
+
+
+def _parse_event(status: int, event: str, data_lines: List[str]) -> Dict[str, Any]:
+    body = json.loads("\n".join(data_lines))
+    if event == "error" or body.get("code"):
+        raise DashScopeAPIError(status, body.get("code", "unknown"), body.get("message", "unknown"))
+    return body.get("output") or {}
+
+
+class AsyncDashScopeClient:
+    """按事件循环复用 aiohttp 连接池的 DashScope 客户端。"""
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = 200,
+        keepalive_timeout: float = 60.0,
+        default_timeout: float = 60.0,
+    ):
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.default_timeout = default_timeout
+        self._sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def _session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.get(loop)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=300,
+                )
+                session = aiohttp.ClientSession(connector=connector)
+                self._sessions[loop] = session
+            return session
+
+    def _prepare(self, call_kwargs: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+        parameters = {k: v for k, v in call_kwargs.items() if k not in _REQUEST_OPTIONS and v is not None}
+        headers = {
+            "Authorization": f"Bearer {call_kwargs.get('api_key') or _api_key()}",
+            "Content-Type": "application/json",
+        }
+        if stream:
+            headers["Accept"] = "text/event-stream"
+            headers["X-DashScope-SSE"] = "enable"
+        return {
+            "json": {
+                "model": call_kwargs["model"],
+                "input": {"messages": call_kwargs["messages"]},
+                "parameters": parameters,
+            },
+            "headers": headers,
+            "timeout": aiohttp.ClientTimeout(total=call_kwargs.get("timeout") or self.default_timeout),
+        }
+
+    async def call(self, path: str, **call_kwargs: Any) -> Dict[str, Any]:
+        """非流式调用，返回响应中的 `output` 字段。参数与 dashscope SDK 的 call 一致。"""
+        request_kwargs = self._prepare(call_kwargs, stream=False)
+        async with self._session().post(_base_url() + path, **request_kwargs) as resp:
+            body = await resp.json(content_type=None)
+            if resp.status != 200:
+                raise DashScopeAPIError(resp.status, body.get("code", "unknown"), body.get("message", "unknown"))
+            return body.get("output") or {}
+
+    async def stream(self, path: str, **call_kwargs: Any) -> AsyncIterator[Dict[str, Any]]:
+        """SSE 流式调用，逐个产出事件中的 `output` 字段。"""
+        request_kwargs = self._prepare(call_kwargs, stream=True)
+        async with self._session().post(_base_url() + path, **request_kwargs) as resp:
+            if resp.status != 200:
+                body = await resp.json(content_type=None)
+                raise DashScopeAPIError(resp.status, body.get("code", "unknown"), body.get("message", "unknown"))
+            event = ""
+            data_lines: List[str] = []
+            async for raw in resp.content:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if line:
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data_lines.append(line[len("data:"):])
+                    continue
+                if data_lines:
+                    yield _parse_event(resp.status, event, data_lines)
+                    data_lines = []
+            if data_lines:
+                yield _parse_event(resp.status, event, data_lines)
+
+    async def generation(self, **call_kwargs: Any) -> Dict[str, Any]:
+        return await self.call(TEXT_GENERATION_PATH, **call_kwargs)
+
+    def stream_generation(self, **call_kwargs: Any) -> AsyncIterator[Dict[str, Any]]:
+        return self.stream(TEXT_GENERATION_PATH, **call_kwargs)
+
+    async def multimodal_generation(self, **call_kwargs: Any) -> Dict[str, Any]:
+        return await self.call(MULTIMODAL_GENERATION_PATH, **call_kwargs)
+
+    def stream_multimodal_generation(self, **call_kwargs: Any) -> AsyncIterator[Dict[str, Any]]:
+        return self.stream(MULTIMODAL_GENERATION_PATH, **call_kwargs)
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的连接池。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.pop(loop, None)
+        if session is not None and not session.closed:
+            await session.close()
+
+
+_CLIENT: Optional[AsyncDashScopeClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_async_client() -> AsyncDashScopeClient:
+    """进程内共享的异步客户端；连接数上限可通过 DASHSCOPE_MAX_CONNECTIONS 配置。"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = AsyncDashScopeClient(
+                max_connections=int(os.environ.get("DASHSCOPE_MAX_CONNECTIONS", "200")),
+            )
+        return _CLIENT
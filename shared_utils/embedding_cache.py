@@ -0,0 +1,340 @@
+"""
+嵌入向量缓存。
+
+每次检索都要远程调用 `text-embedding-v2` 计算查询向量，而像知识图谱 Agent 的
+`f"{topic} {subject_name}"` 这类查询在不同用户之间高度重复。
+
+- `MmapEmbeddingStore`：按文本哈希寻址的持久化存储，向量以 float32 追加写入
+  `vectors.f32` 并通过内存映射读取，键（sha256）与其向量行号按行写入 `keys.txt`；
+- `CachedEmbeddings`：包装任意 LangChain `Embeddings`，内存 LRU 在前、持久化存储在后，
+  未命中的文本才会真正请求远程接口，并统计命中率。
+
+进程内共享的实例由 `vectorstore_registry.get_embeddings()` 创建；设置
+EMBEDDING_CACHE_DIR 后启用持久化。知识库构建（`index_build`）总是使用持久化存储
+（默认目录见 `default_cache_dir()`），并把每次构建的命中情况追加到 `builds.jsonl`；
+`python -m shared_utils.embedding_cache` 查看缓存大小与最近构建的命中率。
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows：仅保证进程内互斥
+    fcntl = None
+
+
+BUILD_LOG_FILE = "builds.jsonl"
+
+
+def default_cache_dir() -> str:
+    """EMBEDDING_CACHE_DIR，未设置时为项目根目录下的 `.embedding_cache/`。"""
+    return os.environ.get("EMBEDDING_CACHE_DIR") or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".embedding_cache"
+    )
+
+
+def embedding_key(model: str, text: str, kind: str = "document") -> str:
+    """缓存键：sha256(model, text)；查询向量与文档向量的接口参数不同，单独加前缀区分。"""
+    prefix = f"{model}\0" if kind == "document" else f"{model}\0{kind}\0"
+    return hashlib.sha256((prefix + text).encode("utf-8")).hexdigest()
+
+
+class MmapEmbeddingStore:
+    """追加写入、内存映射读取的 float32 向量存储（按 sha256 键寻址）。"""
+
+    VECTORS_FILE = "vectors.f32"
+    KEYS_FILE = "keys.txt"
+    META_FILE = "meta.json"
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._row_count = 0
+        self._lines = 0
+        self._dim: Optional[int] = None
+        self._mmap: Optional[np.memmap] = None
+        self._keys_offset = 0
+        self._refresh()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _refresh(self) -> None:
+        """读取其他进程追加的新键，并在需要时重新映射向量文件。"""
+        meta_path = self._path(self.META_FILE)
+        if self._dim is None and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self._dim = int(json.load(f)["dim"])
+        keys_path = self._path(self.KEYS_FILE)
+        if os.path.exists(keys_path):
+            with open(keys_path, "r", encoding="ascii") as f:
+                f.seek(self._keys_offset)
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # 另一个进程尚未写完这一行
+                    self._keys_offset += len(line)
+                    # 每行为 "key\t行号"；旧格式只有键，行号即行序号
+                    key, _, row = line.rstrip("\n").partition("\t")
+                    row_index = int(row) if row else self._lines
+                    self._lines += 1
+                    self._rows.setdefault(key, row_index)
+                    self._row_count = max(self._row_count, row_index + 1)
+        if self._dim and self._row_count:
+            if self._mmap is None or self._mmap.shape[0] < self._row_count:
+                self._mmap = np.memmap(
+                    self._path(self.VECTORS_FILE), dtype="float32", mode="r", shape=(self._row_count, self._dim)
+                )
+
+    def _truncate_uncommitted(self, vec_file: Any) -> int:
+        """截掉向量文件末尾没有键引用的行（写入向量后、写入键前进程中断留下的），返回下一个行号。
+
+        调用方须持有 keys.txt 的排他锁并已 `_refresh()`。
+        """
+        row_bytes = self._dim * 4
+        committed = self._row_count * row_bytes
+        vec_file.seek(0, os.SEEK_END)
+        if vec_file.tell() > committed:
+            print(f"[EmbeddingCache] 丢弃 {self.directory} 中未提交的向量尾部（{vec_file.tell() - committed} 字节）")
+            vec_file.truncate(committed)
+        vec_file.seek(committed)
+        return self._row_count
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._dim
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        with self._lock:
+            if any(k not in self._rows for k in keys):
+                self._refresh()
+            result: List[Optional[List[float]]] = []
+            for key in keys:
+                row = self._rows.get(key)
+                result.append(None if row is None else self._mmap[row].tolist())
+            return result
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self.get_many([key])[0]
+
+    def put_many(self, items: List[tuple]) -> None:
+        """写入 (key, vector) 列表；已存在的键跳过。"""
+        if not items:
+            return
+        with self._lock:
+            self._refresh()
+            fresh = [(k, v) for k, v in items if k not in self._rows]
+            if not fresh:
+                return
+            matrix = np.asarray([v for _, v in fresh], dtype="float32")
+            if self._dim is None:
+                self._dim = int(matrix.shape[1])
+                with open(self._path(self.META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"dim": self._dim}, f)
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(f"向量维度不一致：期望 {self._dim}，实际 {matrix.shape[1]}")
+            with open(self._path(self.KEYS_FILE), "a", encoding="ascii") as keys_file:
+                if fcntl is not None:
+                    fcntl.flock(keys_file, fcntl.LOCK_EX)
+                try:
+                    # 加锁后再同步一次，避免与其他进程重复写入同一键
+                    self._refresh()
+                    keep = [i for i, (k, _) in enumerate(fresh) if k not in self._rows]
+                    if not keep:
+                        return
+                    vectors_path = self._path(self.VECTORS_FILE)
+                    with open(vectors_path, "r+b" if os.path.exists(vectors_path) else "w+b") as vec_file:
+                        first_row = self._truncate_uncommitted(vec_file)
+                        vec_file.write(matrix[keep].tobytes())
+                    # 先写向量再写键：键可见即意味着对应向量已落盘；键行记录显式行号，
+                    # 即使中途中断留下孤立向量，也不会让之后的键错位
+                    keys_file.write("".join(f"{fresh[i][0]}\t{first_row + n}\n" for n, i in enumerate(keep)))
+                    keys_file.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(keys_file, fcntl.LOCK_UN)
+            self._refresh()
+
+    def size_bytes(self) -> int:
+        total = 0
+        for name in (self.VECTORS_FILE, self.KEYS_FILE, self.META_FILE):
+            try:
+                total += os.path.getsize(self._path(name))
+            except OSError:
+                pass
+        return total
+
+
+class CachedEmbeddings(Embeddings):
+    """带内存 LRU 与可选持久化存储的嵌入包装器，线程安全。"""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model: str,
+        max_entries: int = 4096,
+        store: Optional[MmapEmbeddingStore] = None,
+    ):
+        self.underlying = underlying
+        self.model = model
+        self.max_entries = max_entries
+        self.store = store
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._store_hits = 0
+        self._misses = 0
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> List[Optional[List[float]]]:
+        found: List[Optional[List[float]]] = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                found.append(vector)
+        missing = [i for i, v in enumerate(found) if v is None]
+        stored_hits = 0
+        if missing and self.store is not None:
+            for i, vector in zip(missing, self.store.get_many([keys[i] for i in missing])):
+                if vector is not None:
+                    found[i] = vector
+                    stored_hits += 1
+        with self._lock:
+            self._store_hits += stored_hits
+            for key, vector in zip(keys, found):
+                if vector is not None:
+                    self._remember(key, vector)
+        return found
+
+    def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys = [embedding_key(self.model, t, kind) for t in texts]
+        found = self._lookup(keys)
+        missing = [i for i, v in enumerate(found) if v is None]
+        if missing:
+            # 同一批次内的重复文本只请求一次
+            unique: Dict[str, str] = {}
+            for i in missing:
+                unique.setdefault(keys[i], texts[i])
+            miss_texts = list(unique.values())
+            if kind == "query":
+                fresh = [self.underlying.embed_query(t) for t in miss_texts]
+            else:
+                fresh = self.underlying.embed_documents(miss_texts)
+            vectors = {key: list(map(float, v)) for key, v in zip(unique, fresh)}
+            for i in missing:
+                found[i] = vectors[keys[i]]
+            if self.store is not None:
+                self.store.put_many(list(vectors.items()))
+            with self._lock:
+                for key, vector in vectors.items():
+                    self._remember(key, vector)
+        with self._lock:
+            self._hits += len(texts) - len(missing)
+            self._misses += len(missing)
+        return found  # type: ignore[return-value]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query")[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts), "document")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "model": self.model,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "store_hits": self._store_hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "store_dir": self.store.directory if self.store is not None else None,
+                "store_entries": len(self.store) if self.store is not None else 0,
+            }
+
+
+def log_build(cache_dir: str, record: Dict[str, Any]) -> None:
+    """追加一条构建记录（模型、索引目录、命中数等）到缓存目录的 builds.jsonl。"""
+    os.makedirs(cache_dir, exist_ok=True)
+    line = json.dumps(dict(record, finished_at=time.time()), ensure_ascii=False)
+    with open(os.path.join(cache_dir, BUILD_LOG_FILE), "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def read_build_log(cache_dir: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    try:
+        with open(os.path.join(cache_dir, BUILD_LOG_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        return []
+    return records[-limit:] if limit else records
+
+
+def cache_report(cache_dir: str, builds: int = 10) -> Dict[str, Any]:
+    """各模型子目录的条目数、维度与占用空间，以及最近 builds 次构建的命中情况。"""
+    models = []
+    if os.path.isdir(cache_dir):
+        for name in sorted(os.listdir(cache_dir)):
+            path = os.path.join(cache_dir, name)
+            if os.path.exists(os.path.join(path, MmapEmbeddingStore.KEYS_FILE)):
+                store = MmapEmbeddingStore(path)
+                models.append(
+                    {"model": name, "entries": len(store), "dim": store.dim, "bytes": store.size_bytes()}
+                )
+    return {"cache_dir": os.path.abspath(cache_dir), "models": models, "builds": read_build_log(cache_dir, builds)}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="查看嵌入缓存大小与构建命中率")
+    parser.add_argument("--dir", default=default_cache_dir(), help="缓存目录（默认 EMBEDDING_CACHE_DIR 或 .embedding_cache/）")
+    parser.add_argument("--builds", type=int, default=10, help="显示最近几次构建")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args(argv)
+    report = cache_report(args.dir, args.builds)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"缓存目录: {report['cache_dir']}")
+    if not report["models"]:
+        print("  （空）")
+    for m in report["models"]:
+        print(f"  {m['model']}: {m['entries']} 条, dim={m['dim']}, {m['bytes'] / (1024 * 1024):.1f} MB")
+    if report["builds"]:
+        print("最近构建:")
+    for b in report["builds"]:
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(b.get("finished_at", 0)))
+        print(
+            f"  {when}  {b.get('db_dir')}  查找 {b.get('lookups', 0)}，命中 {b.get('hits', 0)}，"
+            f"命中率 {b.get('hit_rate', 0.0):.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+"""
+本地 DashScope 替身服务（离线压测 / 基准测试用）。
+
+实现 DashScope HTTP 接口中本项目用到的三个端点，响应格式与官方一致，
+`dashscope` SDK、`langchain_dashscope.DashScopeEmbeddings` 与 `dashscope_async`
+无需任何改动即可直接调用：
+
+- 文本生成 `Generation.call`：/services/aigc/text-generation/generation
+- 多模态 `MultiModalConversation.call`：/services/aigc/multimodal-generation/generation
+- 文本向量：/services/embeddings/text-embedding/text-embedding
+
+均支持普通调用与 SSE 流式（`X-DashScope-SSE: enable`）。可配置首 token 延迟分布、
+生成速率（token/s）、输出长度分布，以及限流（429）/ 服务错误（500）/ 流中断的注入概率。
+向量由文本哈希确定性生成（已归一化），同一文本始终得到同一向量。
+
+用法（独立进程）：
+
+    python -m shared_utils.fake_dashscope --port 8089 --ttft lognormal:0.6,0.4 --tps 40 --error-rate 0.01
+    export DASHSCOPE_HTTP_BASE_URL=http://127.0.0.1:8089/api/v1 DASHSCOPE_API_KEY=sk-fake
+
+或在进程内：`server = start_fake_dashscope(FakeDashScopeConfig(...))`，会同时把当前进程的
+SDK 指向该服务；`server.stop()` 关闭。`GET /stats` 返回各端点调用与注入错误计数。
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+TEXT_GENERATION_SUFFIX = "/services/aigc/text-generation/generation"
+MULTIMODAL_GENERATION_SUFFIX = "/services/aigc/multimodal-generation/generation"
+EMBEDDING_SUFFIX = "/services/embeddings/text-embedding/text-embedding"
+
+_FILLER = (
+    "这一问题需要从历史背景、理论依据和实践意义三个方面来理解。"
+    "首先，要结合当时的社会条件分析其产生的原因；其次，要把握其核心内容与基本特征；"
+    "最后，要认识它对今天的现实启示，做到理论联系实际。"
+)
+_MINDMAP_TEMPLATE = """```mermaid
+mindmap
+  root(({topic}))
+    历史背景
+      社会条件
+    核心内容
+      基本观点
+      主要特征
+    意义
+      理论意义
+      实践意义
+```
+围绕“{topic}”梳理了历史背景、核心内容与意义三个方面。"""
+
+
+class Distribution:
+    """由字符串描述的随机分布，单位由使用方决定（秒或 token 数）。
+
+    - "fixed:0.5"
+    - "uniform:0.2,1.0"
+    - "normal:0.6,0.1"（均值, 标准差；截断为非负）
+    - "lognormal:0.6,0.4"（中位数, sigma）
+    """
+
+    def __init__(self, spec: str):
+        kind, _, args = spec.partition(":")
+        self.spec = spec
+        self.kind = kind.strip().lower()
+        self.args = [float(x) for x in args.split(",") if x.strip()]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}.get(self.kind)
+        if expected is None or len(self.args) != expected:
+            raise ValueError(f"无法解析分布: {spec!r}")
+
+    def sample(self, rng: random.Random) -> float:
+        a = self.args
+        if self.kind == "fixed":
+            value = a[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(a[0], a[1])
+        elif self.kind == "normal":
+            value = rng.gauss(a[0], a[1])
+        else:
+            value = rng.lognormvariate(np.log(a[0]), a[1]) if a[0] > 0 else 0.0
+        return max(0.0, value)
+
+
+class FakeDashScopeConfig:
+    """替身服务的行为参数。"""
+
+    def __init__(
+        self,
+        ttft: str = "lognormal:0.6,0.4",
+        tokens_per_second: float = 40.0,
+        output_tokens: str = "uniform:120,400",
+        multimodal_extra: str = "lognormal:0.8,0.3",
+        embedding_latency: str = "lognormal:0.08,0.3",
+        embedding_dim: int = 1536,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        stream_abort_rate: float = 0.0,
+        chunk_tokens: int = 4,
+        seed: Optional[int] = None,
+    ):
+        self.ttft = Distribution(ttft)
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = Distribution(output_tokens)
+        self.multimodal_extra = Distribution(multimodal_extra)
+        self.embedding_latency = Distribution(embedding_latency)
+        self.embedding_dim = embedding_dim
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.stream_abort_rate = stream_abort_rate
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.seed = seed
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "ttft": self.ttft.spec,
+            "tokens_per_second": self.tokens_per_second,
+            "output_tokens": self.output_tokens.spec,
+            "multimodal_extra": self.multimodal_extra.spec,
+            "embedding_latency": self.embedding_latency.spec,
+            "embedding_dim": self.embedding_dim,
+            "throttle_rate": self.throttle_rate,
+            "error_rate": self.error_rate,
+            "stream_abort_rate": self.stream_abort_rate,
+        }
+
+
+class _Injected(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _message_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(str(part.get("text", "")) for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def embedding_vector(text: str, dim: int) -> List[float]:
+    """文本哈希决定的确定性单位向量。"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype("float32")
+    vector /= np.linalg.norm(vector) or 1.0
+    return vector.tolist()
+
+
+class _FakeState:
+    def __init__(self, config: FakeDashScopeConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+
+    def rand(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def sample(self, distribution: Distribution) -> float:
+        with self._lock:
+            return distribution.sample(self._rng)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def maybe_fail(self, endpoint: str) -> None:
+        roll = self.rand()
+        if roll < self.config.throttle_rate:
+            self.count(f"{endpoint}.throttled")
+            raise _Injected(429, "Throttling.RateQuota", "Requests rate limit exceeded, please try again later.")
+        if roll < self.config.throttle_rate + self.config.error_rate:
+            self.count(f"{endpoint}.errors")
+            raise _Injected(500, "InternalError", "An internal error has occured, please try again later.")
+
+    def completion_text(self, messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> str:
+        prompt = "\n".join(_message_text(m.get("content")) for m in messages)
+        if "mindmap" in prompt:
+            match = re.search(r'知识点"([^"]+)"', prompt)
+            return _MINDMAP_TEMPLATE.format(topic=match.group(1) if match else "主题")
+        n = max(1, int(self.sample(self.config.output_tokens)))
+        if max_tokens:
+            n = min(n, int(max_tokens))
+        return (_FILLER * (n // len(_FILLER) + 1))[:n]
+
+
+def _chunks(text: str, size: int) -> Iterator[str]:
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeDashScope/1.0"
+    state: _FakeState  # 由 start_fake_dashscope 绑定到子类上
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - 与基类签名一致
+        pass
+
+    # -- 发送工具 ---------------------------------------------------------
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error_body(self, status: int, code: str, message: str, request_id: str) -> None:
+        self._send_json(status, {"code": code, "message": message, "request_id": request_id})
+
+    def _start_stream(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream;charset=UTF-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _write_event(self, event_id: int, payload: Dict[str, Any], event: str = "result", status: int = 200) -> None:
+        self._write_chunk(
+            f"id:{event_id}\nevent:{event}\n:HTTP_STATUS/{status}\n"
+            f"data:{json.dumps(payload, ensure_ascii=False)}\n\n"
+        )
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # -- 路由 -------------------------------------------------------------
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.state._lock:
+                counters = dict(self.state.counters)
+            self._send_json(200, {"config": self.state.config.describe(), "counters": counters})
+        else:
+            self._send_error_body(404, "NotFound", f"unknown path {self.path}", uuid.uuid4().hex)
+
+    def do_POST(self) -> None:
+        request_id = uuid.uuid4().hex
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error_body(400, "InvalidParameter", "request body is not valid JSON", request_id)
+            return
+        path = self.path.split("?", 1)[0].rstrip("/")
+        try:
+            if path.endswith(EMBEDDING_SUFFIX):
+                self._embeddings(body, request_id)
+            elif path.endswith(TEXT_GENERATION_SUFFIX):
+                self._generation(body, request_id, multimodal=False)
+            elif path.endswith(MULTIMODAL_GENERATION_SUFFIX):
+                self._generation(body, request_id, multimodal=True)
+            else:
+                self._send_error_body(404, "NotFound", f"unknown path {self.path}", request_id)
+        except _Injected as e:
+            self._send_error_body(e.status, e.code, e.message, request_id)
+        except (BrokenPipeError, ConnectionResetError):
+            self.state.count("client_disconnects")
+
+    def _embeddings(self, body: Dict[str, Any], request_id: str) -> None:
+        state = self.state
+        state.count("embeddings.requests")
+        state.maybe_fail("embeddings")
+        texts = (body.get("input") or {}).get("texts") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        time.sleep(state.sample(state.config.embedding_latency))
+        state.count("embeddings.texts", len(texts))
+        self._send_json(200, {
+            "output": {
+                "embeddings": [
+                    {"text_index": i, "embedding": embedding_vector(t, state.config.embedding_dim)}
+                    for i, t in enumerate(texts)
+                ]
+            },
+            "usage": {"total_tokens": sum(len(t) for t in texts)},
+            "request_id": request_id,
+        })
+
+    def _generation(self, body: Dict[str, Any], request_id: str, multimodal: bool) -> None:
+        state = self.state
+        config = state.config
+        endpoint = "multimodal" if multimodal else "generation"
+        state.count(f"{endpoint}.requests")
+        messages = (body.get("input") or {}).get("messages") or []
+        parameters = body.get("parameters") or {}
+        stream = (
+            self.headers.get("X-DashScope-SSE", "").lower() == "enable"
+            or "text/event-stream" in self.headers.get("Accept", "")
+        )
+        delay = state.sample(config.ttft)
+        if multimodal:
+            delay += state.sample(config.multimodal_extra)
+        time.sleep(delay)
+        state.maybe_fail(endpoint)
+
+        text = state.completion_text(messages, parameters.get("max_tokens"))
+        input_tokens = sum(len(_message_text(m.get("content"))) for m in messages)
+        as_message = multimodal or parameters.get("result_format") == "message"
+
+        def output(content: str, finish_reason: str) -> Dict[str, Any]:
+            if not as_message:
+                return {"text": content, "finish_reason": finish_reason}
+            message_content: Any = [{"text": content}] if multimodal else content
+            return {"choices": [{"finish_reason": finish_reason, "message": {"role": "assistant", "content": message_content}}]}
+
+        def usage(output_tokens: int) -> Dict[str, int]:
+            return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+        if not stream:
+            time.sleep(len(text) / config.tokens_per_second if config.tokens_per_second > 0 else 0)
+            state.count(f"{endpoint}.output_tokens", len(text))
+            self._send_json(200, {"output": output(text, "stop"), "usage": usage(len(text)), "request_id": request_id})
+            return
+
+        incremental = bool(parameters.get("incremental_output"))
+        abort_at = None
+        if state.rand() < config.stream_abort_rate:
+            abort_at = max(1, len(text) // 2)
+            state.count(f"{endpoint}.stream_aborts")
+        self._start_stream()
+        sent = 0
+        interval = config.chunk_tokens / config.tokens_per_second if config.tokens_per_second > 0 else 0
+        pieces = list(_chunks(text, config.chunk_tokens))
+        for event_id, piece in enumerate(pieces, start=1):
+            if event_id > 1:
+                time.sleep(interval)
+            if abort_at is not None and sent >= abort_at:
+                self._write_event(event_id, {
+                    "code": "InternalError", "message": "stream interrupted (injected)", "request_id": request_id,
+                }, event="error", status=500)
+                self._end_stream()
+                return
+            sent += len(piece)
+            finish = "stop" if event_id == len(pieces) else "null"
+            content = piece if incremental else text[:sent]
+            self._write_event(event_id, {"output": output(content, finish), "usage": usage(sent), "request_id": request_id})
+        state.count(f"{endpoint}.output_tokens", sent)
+        self._end_stream()
+
+
+class FakeDashScopeServer:
+    """在后台线程中运行的替身服务。"""
+
+    def __init__(self, httpd: ThreadingHTTPServer, state: _FakeState):
+        self.httpd = httpd
+        self.state = state
+        self._thread = threading.Thread(target=httpd.serve_forever, name="fake-dashscope", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def stats(self) -> Dict[str, int]:
+        with self.state._lock:
+            return dict(self.state.counters)
+
+    def start(self) -> "FakeDashScopeServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def configure_sdk(base_url: str, api_key: str = "sk-fake") -> None:
+    """让当前进程内的 dashscope SDK 与异步客户端请求 base_url；子进程通过环境变量继承。"""
+    import dashscope
+
+    os.environ["DASHSCOPE_HTTP_BASE_URL"] = base_url
+    dashscope.base_http_api_url = base_url
+    if not os.environ.get("DASHSCOPE_API_KEY"):
+        os.environ["DASHSCOPE_API_KEY"] = api_key
+    if not getattr(dashscope, "api_key", None):
+        dashscope.api_key = os.environ["DASHSCOPE_API_KEY"]
+
+
+def start_fake_dashscope(
+    config: Optional[FakeDashScopeConfig] = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    configure: bool = True,
+) -> FakeDashScopeServer:
+    """启动替身服务（port=0 时随机端口）；configure=True 时把当前进程的 SDK 指向它。"""
+    state = _FakeState(config or FakeDashScopeConfig())
+    handler = type("FakeDashScopeHandler", (_Handler,), {"state": state})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    server = FakeDashScopeServer(httpd, state).start()
+    if configure:
+        configure_sdk(server.base_url)
+    return server
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> Tuple[argparse.Namespace, FakeDashScopeConfig]:
+    parser = argparse.ArgumentParser(description="本地 DashScope 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ttft", default="lognormal:0.6,0.4", help="首 token 延迟分布（秒）")
+    parser.add_argument("--tps", type=float, default=40.0, help="生成速率 token/s")
+    parser.add_argument("--output-tokens", default="uniform:120,400", help="输出长度分布（token）")
+    parser.add_argument("--multimodal-extra", default="lognormal:0.8,0.3", help="多模态额外延迟（秒）")
+    parser.add_argument("--embedding-latency", default="lognormal:0.08,0.3", help="向量接口延迟（秒）")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="429 限流注入概率")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500 错误注入概率")
+    parser.add_argument("--stream-abort-rate", type=float, default=0.0, help="流式中途报错的概率")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    config = FakeDashScopeConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tps,
+        output_tokens=args.output_tokens,
+        multimodal_extra=args.multimodal_extra,
+        embedding_latency=args.embedding_latency,
+        embedding_dim=args.embedding_dim,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        stream_abort_rate=args.stream_abort_rate,
+        seed=args.seed,
+    )
+    return args, config
+
+
+if __name__ == "__main__":
+    cli_args, cli_config = _parse_args()
+    fake = start_fake_dashscope(cli_config, host=cli_args.host, port=cli_args.port, configure=False)
+    print(f"[FakeDashScope] 已启动：{fake.base_url}")
+    print(f"  export DASHSCOPE_HTTP_BASE_URL={fake.base_url} DASHSCOPE_API_KEY=sk-fake")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,123 @@
+"""
+按请求传递的生成参数。
+
+各子应用的 `response_mode`（fast / balanced / detailed）原先通过
+`agent.set_generation_params(...)` 写到全局单例 Agent 上，多线程下会串到其他学生的请求里。
+现在由路由层把参数解析为一个字典，作为 `generation_params=` 随调用一路传到
+检索（retrieval_k）与 `llm.invoke`（max_tokens / timeout），Agent 本身不再保存请求状态。
+
+LLM 调用发生在基类（`BaseAgent` / `BaseDialogueAgent`）或多模态 Agent 内部、无法逐层传参时，
+调用方用 `generation_scope(generation_params)` 包住这次调用：参数存放在 contextvar 中，
+只对当前线程（协程）可见，`llm_wrapper` 的模型封装在组装请求时合并进去（显式传入的
+kwargs 优先）。不加锁、不写共享对象，并发请求互不影响。
+
+同样以 contextvar 传递的还有取消令牌：`cancellation_scope(event)` 内 event 被置位后，
+`llm_wrapper` 的同步调用在发起下一次 HTTP 请求前（以及流式响应的每个分片之间）抛出 `RequestCancelled`，
+已在进行中的非流式请求最迟在其 timeout 后结束。
+"""
+import contextvars
+import inspect
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+RESPONSE_MODES: Dict[str, Dict[str, int]] = {
+    "fast": {"max_tokens": 400, "timeout": 15, "retrieval_k": 3},
+    "balanced": {"max_tokens": 1000, "timeout": 30, "retrieval_k": 5},
+    "detailed": {"max_tokens": 1600, "timeout": 45, "retrieval_k": 7},
+}
+
+# 只有这些键会传给 llm.invoke；retrieval_k 仅用于检索
+_LLM_KEYS = ("max_tokens", "timeout")
+
+_CURRENT: "contextvars.ContextVar[Optional[Dict[str, Any]]]" = contextvars.ContextVar(
+    "generation_params", default=None
+)
+_CANCEL: "contextvars.ContextVar[Optional[threading.Event]]" = contextvars.ContextVar(
+    "request_cancel", default=None
+)
+
+
+class RequestCancelled(Exception):
+    """调用方已放弃本次请求（如并发竞争中其他任务已胜出）。"""
+
+
+def resolve_response_mode(response_mode: Optional[str]) -> Dict[str, int]:
+    """把前端的 response_mode 解析为参数字典；未知取值按 balanced 处理。"""
+    mode = (response_mode or "balanced").lower()
+    return dict(RESPONSE_MODES.get(mode, RESPONSE_MODES["balanced"]))
+
+
+def llm_kwargs(generation_params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """从参数字典中取出可直接传给 `llm.invoke(..., **kwargs)` 的部分。"""
+    if not generation_params:
+        return {}
+    return {k: generation_params[k] for k in _LLM_KEYS if generation_params.get(k) is not None}
+
+
+def retrieval_k(generation_params: Optional[Dict[str, Any]], default: int = 5) -> int:
+    if not generation_params:
+        return default
+    return int(generation_params.get("retrieval_k") or default)
+
+
+@contextmanager
+def generation_scope(generation_params: Optional[Dict[str, Any]]) -> Iterator[None]:
+    """在 with 块内把本次请求的生成参数设为当前参数（仅当前线程/协程可见）。"""
+    token = _CURRENT.set(generation_params or None)
+    try:
+        yield
+    finally:
+        _CURRENT.reset(token)
+
+
+def current_generation_params() -> Optional[Dict[str, Any]]:
+    return _CURRENT.get()
+
+
+def scoped_llm_kwargs() -> Dict[str, Any]:
+    """当前 `generation_scope` 中可传给 LLM 的参数，供模型封装合并进请求。"""
+    return llm_kwargs(_CURRENT.get())
+
+
+@contextmanager
+def cancellation_scope(event: Optional[threading.Event]) -> Iterator[None]:
+    """在 with 块内以 event 作为取消令牌（仅当前线程/协程可见）。"""
+    token = _CANCEL.set(event)
+    try:
+        yield
+    finally:
+        _CANCEL.reset(token)
+
+
+def raise_if_cancelled() -> None:
+    """当前取消令牌已置位时抛出 `RequestCancelled`；模型封装在每次发起请求前调用。"""
+    event = _CANCEL.get()
+    if event is not None and event.is_set():
+        raise RequestCancelled()
+
+
+def _accepts_generation_params(method: Callable) -> bool:
+    try:
+        return "generation_params" in inspect.signature(method).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def call_with_generation_params(
+    agent: Any,
+    method_name: str,
+    *args: Any,
+    generation_params: Optional[Dict[str, Any]] = None,
+    **kwargs: Any,
+) -> Any:
+    """调用 `agent.<method_name>(*args, **kwargs)` 并带上本次请求的生成参数。
+
+    方法签名含 `generation_params` 时直接按参数传入；否则在 `generation_scope` 内调用，
+    由模型封装读取。两种方式都可重入、可并发。
+    """
+    method = getattr(agent, method_name)
+    if _accepts_generation_params(method):
+        return method(*args, generation_params=generation_params, **kwargs)
+    with generation_scope(generation_params):
+        return method(*args, **kwargs)
@@ -0,0 +1,577 @@
+"""
+知识库（FAISS 索引）构建。
+
+各学科的 `generate_database.py` 只负责声明原始资料目录与索引目录，实际构建由本模块完成。
+默认采用增量构建：
+
+- 在索引目录中维护 `build_manifest.json`，记录每个 PDF 的 sha256 与其切分出的
+  文本块（docstore id + 文本哈希）；
+- 重新运行时只解析新增或内容变化的 PDF，其中文本未变的块直接复用旧向量，
+  只有新文本块才会请求嵌入接口；
+- 已删除 / 已变化文件的旧向量通过 `FAISS.delete` 移除；
+- 新索引先写入临时目录，再与正式目录整体换名，读取方不会读到写了一半的文件。
+- `--index ivf|hnsw|ivfpq` 时保存为对应的 ANN 索引（见 `ann_index`），构建过程本身
+  始终在扁平索引上增删向量；
+- 同时生成 BM25 词法倒排索引 `lexical/`（见 `lexical_index`），供混合检索使用；
+- docstore 默认写成紧凑的非 pickle 格式（`docstore/`，见 `compact_docstore`），
+  `--docstore pickle` 时仍写出 `index.pkl`。
+
+需要处理的 PDF 在进程池中并行解析，页面逐页送入切分器，文本块按 batch_size 攒批后
+嵌入并立即写入索引：内存中只保留正在解析的少量文件与一个嵌入批次，峰值内存不再随
+资料总量增长（FAISS 索引本身除外）。
+
+所有新向量都写入持久化嵌入缓存（按 sha256(model, text) 寻址），修改切分参数后全量重建
+或构建中断后重跑时，文本相同的块直接从缓存取回。
+
+模型或切分参数变化、缺少清单（旧版全量构建产物）或指定 `--full` 时执行全量构建。
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import faiss
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .ann_index import INDEX_TYPES, build_ann_index, load_ann_config, save_ann_config, to_flat
+from .compact_docstore import DOCSTORE_DIR, load_faiss, write_compact_docstore
+from .embedding_cache import MmapEmbeddingStore, default_cache_dir, embedding_key, log_build
+from .lexical_index import LEXICAL_DIR, build_lexical_index
+from .rate_limit import RateLimiter
+
+MANIFEST_FILE = "build_manifest.json"
+MANIFEST_VERSION = 1
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def list_pdfs(raw_dir: str) -> Dict[str, str]:
+    """返回 {相对路径: 绝对路径}，与 PyPDFDirectoryLoader 一样递归查找并跳过隐藏文件。"""
+    found: Dict[str, str] = {}
+    for root, dirs, files in os.walk(raw_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.startswith(".") or not name.lower().endswith(".pdf"):
+                continue
+            path = os.path.join(root, name)
+            found[os.path.relpath(path, raw_dir).replace(os.sep, "/")] = path
+    return found
+
+
+def load_pdf(path: str) -> List[Document]:
+    """解析单个 PDF 并过滤空页；pypdf 解析不出文本时尝试 PyMuPDF。"""
+    pages = [d for d in PyPDFLoader(path).load() if d.page_content and d.page_content.strip()]
+    if pages:
+        return pages
+    try:
+        from langchain_community.document_loaders import PyMuPDFLoader
+
+        pages = [d for d in PyMuPDFLoader(path).load() if d.page_content and d.page_content.strip()]
+    except Exception as e:
+        print(f"PyMuPDF 解析失败: {path} -> {e}")
+    return pages
+
+
+def chunk_id(rel_path: str, ordinal: int, text_hash: str) -> str:
+    return hashlib.sha256(f"{rel_path}\0{ordinal}\0{text_hash}".encode("utf-8")).hexdigest()[:32]
+
+
+class BuildManifest:
+    """索引目录中的构建清单。"""
+
+    def __init__(self, settings: Dict[str, Any], files: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.settings = settings
+        self.files: Dict[str, Dict[str, Any]] = files or {}
+
+    @classmethod
+    def load(cls, db_dir: str) -> Optional["BuildManifest"]:
+        path = os.path.join(db_dir, MANIFEST_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(data.get("settings") or {}, data.get("files") or {})
+
+    def save(self, directory: str) -> None:
+        with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": MANIFEST_VERSION, "settings": self.settings, "files": self.files},
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+
+    def chunk_ids(self, rel_paths: Iterable[str]) -> List[str]:
+        return [c["id"] for rel in rel_paths for c in self.files.get(rel, {}).get("chunks", [])]
+
+
+def _write_faiss_index(index: Any, directory: str, fallback_name: str) -> None:
+    path = os.path.join(directory, "index.faiss")
+    try:
+        faiss.write_index(index, path)
+    except Exception as e:
+        print(f"直接保存到 '{directory}' 失败，尝试使用临时 ASCII 目录回退。错误: {e}")
+        fallback_dir = os.path.join(tempfile.gettempdir(), fallback_name)
+        os.makedirs(fallback_dir, exist_ok=True)
+        faiss.write_index(index, os.path.join(fallback_dir, "index.faiss"))
+        shutil.copy2(os.path.join(fallback_dir, "index.faiss"), path)
+
+
+def save_index(
+    store: FAISS,
+    directory: str,
+    fallback_name: str,
+    docstore_format: str = "compact",
+    index_type: str = "flat",
+) -> Dict[str, Any]:
+    """写出 index.faiss（按 index_type 由扁平索引转换）、ann.json、docstore
+    （compact：`docstore/` 目录；pickle：与 `FAISS.save_local` 相同的 index.pkl）与 BM25
+    词法索引 `lexical/`，返回 ANN 配置。"""
+    index, ann_config = build_ann_index(store.index, index_type)
+    _write_faiss_index(index, directory, fallback_name)
+    save_ann_config(directory, ann_config)
+    if docstore_format == "pickle":
+        with open(os.path.join(directory, "index.pkl"), "wb") as f:
+            pickle.dump((store.docstore, store.index_to_docstore_id), f)
+    else:
+        write_compact_docstore(os.path.join(directory, DOCSTORE_DIR), store.index_to_docstore_id, store.docstore)
+    ids = store.index_to_docstore_id
+    texts = (store.docstore.search(ids[row]).page_content for row in range(len(ids)))
+    build_lexical_index(os.path.join(directory, LEXICAL_DIR), texts)
+    return ann_config
+
+
+def install_directory(staging_dir: str, db_dir: str) -> None:
+    """用 staging_dir 整体替换 db_dir（两次换名），并保留原目录中的 .gitkeep。"""
+    keep = os.path.join(db_dir, ".gitkeep")
+    if os.path.exists(keep):
+        shutil.copy2(keep, os.path.join(staging_dir, ".gitkeep"))
+    backup = db_dir.rstrip("/\\") + ".old"
+    if os.path.exists(backup):
+        shutil.rmtree(backup)
+    if os.path.exists(db_dir):
+        os.replace(db_dir, backup)
+    os.replace(staging_dir, db_dir)
+    shutil.rmtree(backup, ignore_errors=True)
+
+
+def _vectors_by_hash(store: FAISS, manifest: BuildManifest, rel_paths: Iterable[str]) -> Dict[str, List[float]]:
+    """取出指定文件旧文本块的向量（按文本哈希），供内容未变的块复用。"""
+    position = {doc_id: pos for pos, doc_id in store.index_to_docstore_id.items()}
+    vectors: Dict[str, List[float]] = {}
+    for rel in rel_paths:
+        for chunk in manifest.files.get(rel, {}).get("chunks", []):
+            pos = position.get(chunk["id"])
+            if pos is not None and chunk["hash"] not in vectors:
+                vectors[chunk["hash"]] = store.index.reconstruct(int(pos)).tolist()
+    return vectors
+
+
+def iter_parsed_pdfs(items: List[Tuple[str, str]], workers: int) -> Iterator[Tuple[str, List[Document]]]:
+    """按给定顺序产出 (相对路径, 页面列表)。
+
+    workers > 1 时在进程池中解析，最多提前提交 2×workers 个文件，解析结果不会在内存中堆积。
+    """
+    if workers <= 1 or len(items) <= 1:
+        for rel, path in items:
+            yield rel, load_pdf(path)
+        return
+    remaining = iter(items)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: Deque[Tuple[str, Future]] = deque(
+            (rel, pool.submit(load_pdf, path)) for rel, path in itertools.islice(remaining, workers * 2)
+        )
+        while pending:
+            rel, future = pending.popleft()
+            following = next(remaining, None)
+            if following is not None:
+                pending.append((following[0], pool.submit(load_pdf, following[1])))
+            yield rel, future.result()
+
+
+def iter_chunks(pages: Iterable[Document], splitter: RecursiveCharacterTextSplitter) -> Iterator[Document]:
+    """逐页切分并过滤空块；与对整份文档列表调用 split_documents 的结果相同。"""
+    for page in pages:
+        for chunk in splitter.split_documents([page]):
+            if chunk.page_content and chunk.page_content.strip():
+                yield chunk
+
+
+class _IndexWriter:
+    """把文本块攒成固定大小的批次，补齐向量后按提交顺序写入索引。
+
+    缺失向量的批次交给线程池嵌入，最多 concurrency 个批次同时在途（受 limiter 限速）；
+    提交前先在 vector_store（持久化嵌入缓存或构建检查点）中查找，每个完成的批次先写入
+    vector_store 再返回，构建中断后重跑时直接取回已完成的向量。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int,
+        store: Optional[FAISS],
+        reusable: Dict[str, List[float]],
+        model: str,
+        vector_store: Optional[MmapEmbeddingStore] = None,
+        concurrency: int = 1,
+        limiter: Optional[RateLimiter] = None,
+        retries: int = 3,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.store = store
+        self.reusable = reusable
+        self.model = model
+        self.vector_store = vector_store
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter
+        self.retries = retries
+        self.embedded = 0
+        self.reused = 0
+        self.stored_hits = 0
+        self._submitted = 0
+        self._batch: List[Tuple[str, dict, str, Optional[List[float]]]] = []
+        self._to_embed = 0
+        self._in_flight: Deque[Tuple[list, List[int], Optional[Future]]] = deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+
+    def add(self, text: str, metadata: dict, doc_id: str, text_hash: str) -> None:
+        vector = self.reusable.get(text_hash)
+        self._batch.append((text, metadata, doc_id, vector))
+        if vector is None:
+            self._to_embed += 1
+        if self._to_embed >= self.batch_size or len(self._batch) >= self.batch_size * 4:
+            self._submit()
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire(sum(len(t) for t in texts))
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = 2.0 ** attempt
+                print(f"嵌入请求失败（{e}），{delay:.0f}s 后第 {attempt + 1} 次重试...")
+                time.sleep(delay)
+        if self.vector_store is not None:
+            self.vector_store.put_many([(embedding_key(self.model, t), v) for t, v in zip(texts, vectors)])
+        return vectors
+
+    def _submit(self) -> None:
+        if not self._batch:
+            return
+        batch, self._batch, self._to_embed = self._batch, [], 0
+        missing = [i for i, item in enumerate(batch) if item[3] is None]
+        if missing and self.vector_store is not None:
+            saved = self.vector_store.get_many([embedding_key(self.model, batch[i][0]) for i in missing])
+            for i, vector in zip(missing, saved):
+                if vector is not None:
+                    batch[i] = batch[i][:3] + (vector,)
+                    self.stored_hits += 1
+            missing = [i for i in missing if batch[i][3] is None]
+        future = None
+        if missing:
+            print(f"正在嵌入第 {self._submitted + 1} 到 {self._submitted + len(missing)} 个新文本块...")
+            self._submitted += len(missing)
+            future = self._pool.submit(self._embed, [batch[i][0] for i in missing])
+        self._in_flight.append((batch, missing, future))
+        while len(self._in_flight) > self.concurrency:
+            self._write_oldest()
+
+    def _write_oldest(self) -> None:
+        batch, missing, future = self._in_flight.popleft()
+        vectors = [item[3] for item in batch]
+        if future is not None:
+            for i, vector in zip(missing, future.result()):
+                vectors[i] = vector
+        pairs = [(item[0], vector) for item, vector in zip(batch, vectors)]
+        metadatas = [item[1] for item in batch]
+        ids = [item[2] for item in batch]
+        if self.store is None:
+            self.store = FAISS.from_embeddings(pairs, self.embeddings, metadatas=metadatas, ids=ids)
+        else:
+            self.store.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+        self.embedded += len(missing)
+        self.reused += len(batch) - len(missing)
+
+    def flush(self) -> None:
+        self._submit()
+        while self._in_flight:
+            self._write_oldest()
+
+    def close(self) -> None:
+        # 出错时丢弃尚未开始的批次；已在途的批次完成后照常写入 vector_store
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def build_index(
+    raw_dir: str,
+    db_dir: str,
+    embeddings: Optional[Embeddings] = None,
+    embedding_model: str = "text-embedding-v2",
+    chunk_size: int = 1000,
+    chunk_overlap: int = 100,
+    batch_size: int = 20,
+    full: bool = False,
+    workers: Optional[int] = None,
+    concurrency: int = 4,
+    qps: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    use_cache: bool = True,
+    docstore_format: str = "compact",
+    index_type: str = "flat",
+) -> Dict[str, Any]:
+    """（增量）构建 raw_dir 下全部 PDF 的 FAISS 索引并安装到 db_dir，返回构建统计。
+
+    流水线：进程池并行解析 PDF → 逐页切分 → 按 batch_size 分批嵌入并写入索引；
+    workers 默认取 CPU 核数（最多 8），设为 1 时在当前进程内串行解析。嵌入阶段最多
+    concurrency 个批次同时在途，qps / tokens_per_minute 限制请求速率（token 数按字符数估算）。
+    嵌入前先查持久化嵌入缓存（`cache_dir`，默认见 `embedding_cache.default_cache_dir()`），
+    内容相同的文本块无论来自哪次构建、何种切分参数都不会重复请求；新向量写回缓存，因此
+    中断后重跑也会从中断处继续。`use_cache=False` 时改用 `<db_dir>.checkpoint/` 作为
+    仅本次构建有效的检查点，安装成功后删除。index_type 为 ivf / hnsw / ivfpq 时保存为
+    对应的 ANN 索引；资料未变但 index_type 变化时只重建索引文件，不请求嵌入接口。
+    """
+    started = time.perf_counter()
+    settings = {"embedding_model": embedding_model, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    if embeddings is None:
+        from langchain_dashscope.embeddings import DashScopeEmbeddings
+
+        embeddings = DashScopeEmbeddings(model=embedding_model)
+
+    pdfs = list_pdfs(raw_dir)
+    hashes = {rel: file_sha256(path) for rel, path in pdfs.items()}
+
+    old_manifest = None if full else BuildManifest.load(db_dir)
+    store: Optional[FAISS] = None
+    if old_manifest is not None and old_manifest.settings != settings:
+        print("嵌入模型或切分参数已变化，执行全量构建。")
+        old_manifest = None
+    if old_manifest is not None:
+        try:
+            store = load_faiss(db_dir, embeddings, writable=True)
+        except Exception as e:
+            print(f"读取已有索引失败，执行全量构建: {e}")
+            old_manifest = None
+    if store is not None:
+        # 增删向量在扁平索引上进行，保存时再按 index_type 转换
+        flat = to_flat(store.index)
+        if flat is None:
+            print("已有索引为有损压缩（IVF-PQ），无法复用旧向量，执行全量构建（嵌入缓存中的文本不会重新请求）。")
+            old_manifest = None
+        else:
+            store.index = flat
+    if old_manifest is None:
+        old_manifest = BuildManifest(settings)
+        store = None
+
+    unchanged = [rel for rel in pdfs if old_manifest.files.get(rel, {}).get("sha256") == hashes[rel]]
+    changed = [rel for rel in pdfs if rel in old_manifest.files and rel not in unchanged]
+    added = [rel for rel in pdfs if rel not in old_manifest.files]
+    deleted = [rel for rel in old_manifest.files if rel not in pdfs]
+    stats: Dict[str, Any] = {
+        "files_unchanged": len(unchanged),
+        "files_changed": len(changed),
+        "files_added": len(added),
+        "files_deleted": len(deleted),
+        "chunks_reused": 0,
+        "chunks_embedded": 0,
+        "chunks_cached": 0,
+        "chunks_removed": 0,
+    }
+    print(f"文件：未变 {len(unchanged)}，变化 {len(changed)}，新增 {len(added)}，删除 {len(deleted)}。")
+    current = load_ann_config(db_dir)
+    same_index_type = (current.get("requested") or current.get("type") or "flat") == index_type
+    if store is not None and not (changed or added or deleted) and same_index_type:
+        print("资料未发生变化，索引无需更新。")
+        stats["seconds"] = round(time.perf_counter() - started, 2)
+        return stats
+
+    reusable: Dict[str, List[float]] = {}
+    if store is not None and (changed or deleted):
+        reusable = _vectors_by_hash(store, old_manifest, changed)
+        stale_ids = old_manifest.chunk_ids(changed + deleted)
+        if stale_ids:
+            store.delete(stale_ids)
+        stats["chunks_removed"] = len(stale_ids)
+
+    manifest = BuildManifest(settings, {rel: old_manifest.files[rel] for rel in unchanged})
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    checkpoint_dir: Optional[str] = None
+    if use_cache:
+        cache_dir = cache_dir or default_cache_dir()
+        vector_store = MmapEmbeddingStore(os.path.join(cache_dir, embedding_model))
+        print(f"使用嵌入缓存: {vector_store.directory}（{len(vector_store)} 个向量）")
+    else:
+        checkpoint_dir = os.path.abspath(db_dir) + CHECKPOINT_SUFFIX
+        vector_store = MmapEmbeddingStore(checkpoint_dir)
+        if len(vector_store):
+            print(f"发现上次中断的构建检查点（{len(vector_store)} 个向量），继续构建。")
+    limiter = RateLimiter(qps, tokens_per_minute) if (qps or tokens_per_minute) else None
+    writer = _IndexWriter(
+        embeddings,
+        batch_size,
+        store,
+        reusable,
+        model=embedding_model,
+        vector_store=vector_store,
+        concurrency=concurrency,
+        limiter=limiter,
+    )
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    todo = [(rel, pdfs[rel]) for rel in changed + added]
+    try:
+        for rel, pages in iter_parsed_pdfs(todo, workers):
+            print(f"正在分割: {rel}（{len(pages)} 页）")
+            records: List[Dict[str, str]] = []
+            for ordinal, doc in enumerate(iter_chunks(pages, splitter)):
+                digest = text_sha256(doc.page_content)
+                records.append({"id": chunk_id(rel, ordinal, digest), "hash": digest})
+                writer.add(doc.page_content, doc.metadata, records[-1]["id"], digest)
+            manifest.files[rel] = {"sha256": hashes[rel], "chunks": records}
+        writer.flush()
+    finally:
+        writer.close()
+    store = writer.store
+    stats["chunks_embedded"] = writer.embedded
+    stats["chunks_cached"] = writer.stored_hits
+    stats["chunks_reused"] = writer.reused - writer.stored_hits
+    lookups = writer.embedded + writer.stored_hits
+    stats["cache_hit_rate"] = round(writer.stored_hits / lookups, 4) if lookups else 0.0
+    if limiter is not None:
+        stats["rate_limit"] = limiter.stats()
+
+    if store is None:
+        if checkpoint_dir:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        raise SystemExit("❌ 分割后无文本块，无法构建向量库：PDF 可能是纯图片，请先做 OCR 后再生成向量库。")
+
+    parent = os.path.dirname(os.path.abspath(db_dir))
+    os.makedirs(parent, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=".build-", dir=parent)
+    try:
+        ann_config = save_index(
+            store,
+            staging_dir,
+            f"faiss_tmp_{os.path.basename(os.path.abspath(db_dir))}",
+            docstore_format=docstore_format,
+            index_type=index_type,
+        )
+        manifest.save(staging_dir)
+        install_directory(staging_dir, db_dir)
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    if checkpoint_dir:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    else:
+        log_build(
+            cache_dir,
+            {
+                "model": embedding_model,
+                "db_dir": os.path.abspath(db_dir),
+                "lookups": lookups,
+                "hits": writer.stored_hits,
+                "embedded": writer.embedded,
+                "hit_rate": stats["cache_hit_rate"],
+            },
+        )
+    stats["vectors"] = int(store.index.ntotal)
+    stats["index"] = ann_config
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def main(
+    raw_dir: str,
+    db_dir: str,
+    subject: str,
+    batch_size: int = 20,
+    argv: Optional[List[str]] = None,
+) -> None:
+    """各学科 generate_database.py 的命令行入口。"""
+    parser = argparse.ArgumentParser(description=f"构建{subject}知识库（默认增量）")
+    parser.add_argument("--full", action="store_true", help="忽略构建清单，全量重建")
+    parser.add_argument("--batch-size", type=int, default=batch_size, help="每次嵌入请求的文本块数")
+    parser.add_argument("--workers", type=int, default=None, help="并行解析 PDF 的进程数（默认 CPU 核数，最多 8）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时在途的嵌入批次数")
+    parser.add_argument("--qps", type=float, default=None, help="嵌入请求每秒上限（默认不限）")
+    parser.add_argument("--tpm", type=float, default=None, help="嵌入每分钟 token 上限（按字符数估算，默认不限）")
+    parser.add_argument("--cache-dir", default=None, help="持久化嵌入缓存目录（默认 EMBEDDING_CACHE_DIR 或 .embedding_cache/）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用持久化嵌入缓存")
+    parser.add_argument(
+        "--docstore",
+        choices=("compact", "pickle"),
+        default="compact",
+        help="docstore 格式：compact（内存映射、非 pickle，默认）或 pickle（index.pkl）",
+    )
+    parser.add_argument(
+        "--index",
+        choices=INDEX_TYPES,
+        default="flat",
+        help="向量索引类型：flat（暴力检索，默认）/ ivf / hnsw / ivfpq，检索参数按目标召回率自动调优",
+    )
+    args = parser.parse_args(argv)
+
+    if not os.environ.get("DASHSCOPE_API_KEY"):
+        raise EnvironmentError("未设置 DASHSCOPE_API_KEY 环境变量")
+    if not os.path.isdir(raw_dir):
+        os.makedirs(raw_dir, exist_ok=True)
+        print(f"已创建原始资料目录: {raw_dir} (请放入{subject} PDF 资料)")
+    print(f"正在从 '{raw_dir}' 文件夹加载文档...")
+    if not list_pdfs(raw_dir) and BuildManifest.load(db_dir) is None:
+        print("未检测到 PDF 文档，请将资料放入该目录后重试。")
+        raise SystemExit(0)
+
+    stats = build_index(
+        raw_dir,
+        db_dir,
+        batch_size=args.batch_size,
+        full=args.full,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        qps=args.qps,
+        tokens_per_minute=args.tpm,
+        cache_dir=args.cache_dir,
+        use_cache=not args.no_cache,
+        docstore_format=args.docstore,
+        index_type=args.index,
+    )
+    print(
+        f"新嵌入 {stats['chunks_embedded']} 个文本块，缓存命中 {stats['chunks_cached']} 个"
+        f"（命中率 {stats['cache_hit_rate']:.1%}），"
+        f"复用 {stats['chunks_reused']} 个，"
+        f"移除 {stats['chunks_removed']} 个，耗时 {stats['seconds']}s。"
+    )
+    print(f"知识库构建完成，并已保存到本地 '{db_dir}' 文件夹。")
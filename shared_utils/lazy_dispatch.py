@@ -0,0 +1,118 @@
+"""
+按需挂载的子应用分发。
+
+门户原先在 `create_app` 中依次导入全部子应用的 `app.py`，每个子应用导入时就会构造
+全部 Agent（加载 FAISS、编译 LangGraph、初始化多模态客户端），门户冷启动耗时是所有
+子应用之和。
+
+`LazyDispatcherMiddleware` 与 werkzeug 的 `DispatcherMiddleware` 用法相同，只是挂载项
+是返回 WSGI 应用的加载函数：子应用在收到第一个请求时才导入（并发的首个请求只会导入
+一次），也可以调用 `prewarm()` 在后台线程中提前加载。每个挂载点记录加载状态与耗时，
+通过 `report()` 输出。
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+WSGIApp = Callable[[Dict[str, Any], Callable], Iterable[bytes]]
+
+
+class LazyMount:
+    """首次调用时才执行 loader 的 WSGI 应用代理，线程安全。"""
+
+    def __init__(self, prefix: str, loader: Callable[[], WSGIApp]):
+        self.prefix = prefix
+        self.loader = loader
+        self._app: Optional[WSGIApp] = None
+        self._lock = threading.Lock()
+        self.status = "pending"
+        self.trigger: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def load(self, trigger: str = "request") -> WSGIApp:
+        if self._app is not None:
+            return self._app
+        with self._lock:
+            if self._app is None:
+                self.status = "loading"
+                self.trigger = trigger
+                start = time.perf_counter()
+                try:
+                    app = self.loader()
+                except Exception as e:
+                    # 不缓存失败结果，下一个请求会重新尝试
+                    self.status = "failed"
+                    self.error = str(e)
+                    self.load_seconds = round(time.perf_counter() - start, 3)
+                    print(f"[Portal] 挂载 {self.prefix} 失败（{self.load_seconds}s）：{e}")
+                    raise
+                self.load_seconds = round(time.perf_counter() - start, 3)
+                self.loaded_at = time.time()
+                self.status = "ready"
+                self.error = None
+                self._app = app
+                print(f"[Portal] 已挂载 {self.prefix}（{trigger}，{self.load_seconds}s）")
+        return self._app
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        try:
+            app = self.load()
+        except Exception as e:
+            body = f"子应用 {self.prefix} 加载失败：{e}".encode("utf-8")
+            start_response(
+                "503 Service Unavailable",
+                [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body)))],
+            )
+            return [body]
+        return app(environ, start_response)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "prefix": self.prefix,
+            "status": self.status,
+            "trigger": self.trigger,
+            "load_seconds": self.load_seconds,
+            "loaded_at": self.loaded_at,
+            "error": self.error,
+        }
+
+
+class LazyDispatcherMiddleware(DispatcherMiddleware):
+    """`DispatcherMiddleware` 的按需加载版本：mounts 的值是无参加载函数。"""
+
+    def __init__(self, app: WSGIApp, loaders: Dict[str, Callable[[], WSGIApp]]):
+        self.lazy_mounts: Dict[str, LazyMount] = {
+            prefix: LazyMount(prefix, loader) for prefix, loader in loaders.items()
+        }
+        super().__init__(app, dict(self.lazy_mounts))
+        self._prewarm_thread: Optional[threading.Thread] = None
+
+    def load_all(self, prefixes: Optional[Iterable[str]] = None, trigger: str = "eager") -> None:
+        """同步加载指定（默认全部）挂载点；单个失败不影响其余。"""
+        for prefix in prefixes or list(self.lazy_mounts):
+            mount = self.lazy_mounts.get(prefix)
+            if mount is None:
+                continue
+            try:
+                mount.load(trigger)
+            except Exception:
+                pass
+
+    def prewarm(self, prefixes: Optional[Iterable[str]] = None) -> threading.Thread:
+        """在后台守护线程中依次加载子应用，不阻塞门户启动。"""
+        targets = list(prefixes or self.lazy_mounts)
+        thread = threading.Thread(
+            target=self.load_all, args=(targets, "prewarm"), name="portal-prewarm", daemon=True
+        )
+        thread.start()
+        self._prewarm_thread = thread
+        return thread
+
+    def report(self) -> List[Dict[str, Any]]:
+        """各挂载点的加载状态与耗时，已加载的按耗时降序排列。"""
+        rows = [mount.stats() for mount in self.lazy_mounts.values()]
+        return sorted(rows, key=lambda row: -(row["load_seconds"] or 0.0))
@@ -1,19 +1,28 @@
+import asyncio
 import os
-from typing import Any, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
 import base64
 
 import dashscope
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
 )
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 
 import logging
 
+from .completion_cache import CompletionCache, get_completion_cache, make_cache_key
+from .dashscope_async import get_async_client
+from .generation_params import RequestCancelled, raise_if_cancelled, scoped_llm_kwargs
+from .image_payload import encode_for_vision
+from .uploaded_image import ImageInput, UploadedImage
+
 # Set up API key for DashScope SDK
 api_key = os.environ.get("DASHSCOPE_API_KEY")
 if api_key:
@@ -22,6 +31,27 @@ if api_key:
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+_VISION_FALLBACK_NOTICE = "[注意：图片分析功能暂时不可用，以下是基于文本的回复]"
+
+
+def _join_content_parts(ai_content: Any) -> str:
+    """Flattens multimodal `content` (a list of {"text": ...} parts) into plain text."""
+    if not isinstance(ai_content, list):
+        return ai_content
+    try:
+        text_parts: List[str] = []
+        for part in ai_content:
+            if isinstance(part, dict):
+                if "text" in part and isinstance(part["text"], str):
+                    text_parts.append(part["text"])
+                else:
+                    text_parts.append(str(part))
+            else:
+                text_parts.append(str(part))
+        return " ".join([t for t in text_parts if t])
+    except Exception:
+        return str(ai_content)
+
 
 class CustomChatDashScope(BaseChatModel):
     """A stable DashScope chat model wrapper implementing LangChain's BaseChatModel.
@@ -34,15 +64,27 @@ class CustomChatDashScope(BaseChatModel):
     temperature: float = 0.7
     # 默认提升输出长度，避免回答过短
     max_tokens: Optional[int] = 1200
+    # 精确匹配补全缓存：单次调用可用 invoke(..., use_cache=True/False) 覆盖
+    use_cache: bool = False
+    # 为 None 时使用进程共享的 get_completion_cache()
+    completion_cache: Optional[Any] = None
+
+    def _resolve_cache(self, kwargs: Dict[str, Any]) -> Optional[CompletionCache]:
+        """Pops the per-call `use_cache` flag and returns the cache to consult, if any."""
+        if not kwargs.pop("use_cache", self.use_cache):
+            return None
+        return self.completion_cache or get_completion_cache()
+
+    @staticmethod
+    def _cache_key(call_kwargs: Dict[str, Any]) -> str:
+        return make_cache_key(
+            call_kwargs["model"],
+            call_kwargs.get("temperature"),
+            call_kwargs.get("max_tokens"),
+            call_kwargs["messages"],
+        )
 
-    def _call(
-        self,
-        messages: List[BaseMessage],
-        stop: Optional[List[str]] = None,
-        **kwargs: Any,
-    ) -> AIMessage:
-        """Sends messages to DashScope and returns the response as AIMessage."""
-
+    def _build_call_kwargs(self, messages: List[BaseMessage], **kwargs: Any) -> Dict[str, Any]:
         prompt_messages = []
         for msg in messages:
             if isinstance(msg, SystemMessage):
@@ -61,13 +103,36 @@ class CustomChatDashScope(BaseChatModel):
         )
         if self.max_tokens:
             call_kwargs["max_tokens"] = self.max_tokens
+        # 当前请求的 generation_scope（若有）覆盖默认值，显式传入的 kwargs 优先
+        call_kwargs.update(scoped_llm_kwargs())
         call_kwargs.update(kwargs)
+        return call_kwargs
+
+    def _call(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AIMessage:
+        """Sends messages to DashScope and returns the response as AIMessage."""
+
+        cache = self._resolve_cache(kwargs)
+        call_kwargs = self._build_call_kwargs(messages, **kwargs)
+        cache_key = self._cache_key(call_kwargs) if cache is not None else None
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return AIMessage(content=cached)
+
+        raise_if_cancelled()
         response = dashscope.Generation.call(**call_kwargs)
 
         # Non-streaming mode -> GenerationResponse with status_code / output
         if hasattr(response, "status_code"):
             if response.status_code == 200:  # type: ignore[attr-defined]
                 ai_content = response.output.choices[0]["message"]["content"]  # type: ignore[attr-defined]
+                if cache_key is not None:
+                    cache.set(cache_key, ai_content)
                 return AIMessage(content=ai_content)
         raise Exception(
             "DashScope API Error: Code {} , Message {}".format(  # type: ignore[attr-defined]
@@ -84,6 +149,109 @@ class CustomChatDashScope(BaseChatModel):
         ai_msg = self._call(messages, stop=stop, **kwargs)
         return ChatResult(generations=[ChatGeneration(message=ai_msg)])
 
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        """Streams incremental deltas from DashScope (used by `llm.stream(...)`)."""
+
+        cache = self._resolve_cache(kwargs)
+        call_kwargs = self._build_call_kwargs(messages, **kwargs)
+        cache_key = self._cache_key(call_kwargs) if cache is not None else None
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=cached))
+                if run_manager:
+                    run_manager.on_llm_new_token(cached, chunk=chunk)
+                yield chunk
+                return
+
+        call_kwargs["stream"] = True
+        # incremental_output=True -> each event carries only the new delta
+        call_kwargs["incremental_output"] = True
+        raise_if_cancelled()
+        responses = dashscope.Generation.call(**call_kwargs)
+
+        parts: List[str] = []
+        for response in responses:
+            # 调用方已放弃时停止读取，关闭生成器即断开连接
+            raise_if_cancelled()
+            if getattr(response, "status_code", None) != 200:
+                raise Exception(
+                    "DashScope API Error: Code {} , Message {}".format(
+                        getattr(response, "code", "unknown"), getattr(response, "message", "unknown")
+                    )
+                )
+            delta = response.output.choices[0]["message"]["content"]  # type: ignore[attr-defined]
+            if not delta:
+                continue
+            parts.append(delta)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=delta))
+            if run_manager:
+                run_manager.on_llm_new_token(delta, chunk=chunk)
+            yield chunk
+        if cache_key is not None:
+            cache.set(cache_key, "".join(parts))
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Awaitable counterpart of `_generate` on the pooled aiohttp client (`llm.ainvoke`)."""
+
+        cache = self._resolve_cache(kwargs)
+        call_kwargs = self._build_call_kwargs(messages, **kwargs)
+        cache_key = self._cache_key(call_kwargs) if cache is not None else None
+        ai_content = cache.get(cache_key) if cache_key is not None else None
+        if ai_content is None:
+            output = await get_async_client().generation(**call_kwargs)
+            ai_content = output["choices"][0]["message"]["content"]
+            if cache_key is not None:
+                cache.set(cache_key, ai_content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=ai_content))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Awaitable counterpart of `_stream` (`llm.astream`)."""
+
+        cache = self._resolve_cache(kwargs)
+        call_kwargs = self._build_call_kwargs(messages, **kwargs)
+        cache_key = self._cache_key(call_kwargs) if cache is not None else None
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=cached))
+                if run_manager:
+                    await run_manager.on_llm_new_token(cached, chunk=chunk)
+                yield chunk
+                return
+
+        call_kwargs["incremental_output"] = True
+        parts: List[str] = []
+        async for output in get_async_client().stream_generation(**call_kwargs):
+            delta = output["choices"][0]["message"]["content"]
+            if not delta:
+                continue
+            parts.append(delta)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=delta))
+            if run_manager:
+                await run_manager.on_llm_new_token(delta, chunk=chunk)
+            yield chunk
+        if cache_key is not None:
+            cache.set(cache_key, "".join(parts))
+
     @property
     def _llm_type(self) -> str:  # noqa: D401 – keeping LangChain naming convention
         return "custom_chat_dashscope_wrapper"
@@ -104,43 +272,33 @@ class CustomVisionChatDashScope(BaseChatModel):
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode('utf-8')
 
-    def _prepare_multimodal_content(self, text: str, image_path: Optional[str] = None) -> List[dict]:
+    def _prepare_multimodal_content(self, text: str, image_path: Optional[ImageInput] = None) -> List[dict]:
         content: List[dict] = []
         if text:
             content.append({"text": text})
         if not image_path:
             return content
+        if isinstance(image_path, UploadedImage):
+            # 内存中的上传图片：data URL 在首次使用时生成并缓存，无需读盘
+            try:
+                content.append({"image": image_path.data_url()})
+            except Exception as e:
+                logging.error(f"Error processing image: {e}")
+                content.append({"text": f"[图片加载失败: {str(e)}]"})
+            return content
         if image_path.startswith("data:image"):
             content.append({"image": image_path})
             return content
         try:
-            import mimetypes
             import io
             from PIL import Image
 
-            mime_type, _ = mimetypes.guess_type(image_path)
-            if mime_type is None:
-                mime_type = "image/jpeg"
-
-            with Image.open(image_path) as img:
-                max_dim = 1024
-                if max(img.size) > max_dim:
-                    ratio = max_dim / float(max(img.size))
-                    new_size = (int(img.width * ratio), int(img.height * ratio))
-                    img = img.resize(new_size, Image.LANCZOS)
-
-                buffered = io.BytesIO()
-                save_format = mime_type.split("/")[-1].upper()
-                if save_format == "JPG":
-                    save_format = "JPEG"
-                try:
-                    img.save(buffered, format=save_format)
-                except Exception:
-                    buffered = io.BytesIO()
-                    img = img.convert('RGB')
-                    img.save(buffered, format='JPEG')
-                    mime_type = 'image/jpeg'
-                encoded_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
+            with open(image_path, "rb") as image_file:
+                data = image_file.read()
+            with Image.open(io.BytesIO(data)) as img:
+                img.load()
+                mime_type, payload = encode_for_vision(img, data, img.format)
+            encoded_image = base64.b64encode(payload).decode("utf-8")
 
             content.append({"image": f"data:{mime_type};base64,{encoded_image}"})
         except Exception as e:
@@ -149,13 +307,9 @@ class CustomVisionChatDashScope(BaseChatModel):
 
         return content
 
-    def _call(
-        self,
-        messages: List[BaseMessage],
-        stop: Optional[List[str]] = None,
-        image_path: Optional[str] = None,
-        **kwargs: Any,
-    ) -> AIMessage:
+    def _build_prompt_messages(
+        self, messages: List[BaseMessage], image_path: Optional[ImageInput] = None
+    ) -> List[dict]:
         prompt_messages = []
         image_added = False
         for msg in messages:
@@ -171,37 +325,63 @@ class CustomVisionChatDashScope(BaseChatModel):
                     prompt_messages.append({"role": "user", "content": content})
             elif isinstance(msg, AIMessage):
                 prompt_messages.append({"role": "assistant", "content": msg.content})
+        return prompt_messages
+
+    def _build_mm_kwargs(self, prompt_messages: List[dict], **kwargs: Any) -> Dict[str, Any]:
+        mm_kwargs = dict(
+            model=self.model,
+            messages=prompt_messages,
+            temperature=self.temperature,
+            timeout=30,
+        )
+        if self.max_tokens:
+            mm_kwargs["max_tokens"] = self.max_tokens
+        mm_kwargs.update(scoped_llm_kwargs())
+        mm_kwargs.update(kwargs)
+        return mm_kwargs
+
+    def _build_fallback_kwargs(self, prompt_messages: List[dict], **kwargs: Any) -> Dict[str, Any]:
+        text_messages = []
+        for msg_data in prompt_messages:
+            if isinstance(msg_data.get("content"), list):
+                text_parts = [item.get("text", "") for item in msg_data["content"] if "text" in item]
+                text_content = " ".join(text_parts)
+                text_messages.append({"role": msg_data["role"], "content": text_content})
+            else:
+                text_messages.append(msg_data)
+
+        fallback_kwargs = dict(
+            model="qwen-turbo",
+            messages=text_messages,
+            result_format="message",
+            temperature=self.temperature,
+            stream=False,
+            timeout=30,
+        )
+        if self.max_tokens:
+            fallback_kwargs["max_tokens"] = self.max_tokens
+        fallback_kwargs.update(scoped_llm_kwargs())
+        fallback_kwargs.update(kwargs)
+        return fallback_kwargs
+
+    def _call(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        image_path: Optional[ImageInput] = None,
+        **kwargs: Any,
+    ) -> AIMessage:
+        prompt_messages = self._build_prompt_messages(messages, image_path)
 
         try:
-            mm_kwargs = dict(
-                model=self.model,
-                messages=prompt_messages,
-                temperature=self.temperature,
-                timeout=30,
-            )
-            if self.max_tokens:
-                mm_kwargs["max_tokens"] = self.max_tokens
-            mm_kwargs.update(kwargs)
+            mm_kwargs = self._build_mm_kwargs(prompt_messages, **kwargs)
+            raise_if_cancelled()
             response = dashscope.MultiModalConversation.call(**mm_kwargs)
 
             if hasattr(response, "status_code"):
                 if response.status_code == 200:
                     ai_content = response.output.choices[0]["message"]["content"]
-                    if isinstance(ai_content, list):
-                        try:
-                            text_parts: List[str] = []
-                            for part in ai_content:
-                                if isinstance(part, dict):
-                                    if "text" in part and isinstance(part["text"], str):
-                                        text_parts.append(part["text"])
-                                    else:
-                                        text_parts.append(str(part))
-                                else:
-                                    text_parts.append(str(part))
-                            ai_content = " ".join([t for t in text_parts if t])
-                        except Exception:
-                            ai_content = str(ai_content)
-                    return AIMessage(content=ai_content)
+                    return AIMessage(content=_join_content_parts(ai_content))
                 else:
                     error_msg = f"DashScope Vision API Error: Code {response.status_code}"
                     if hasattr(response, 'message'):
@@ -210,34 +390,18 @@ class CustomVisionChatDashScope(BaseChatModel):
             else:
                 raise Exception("DashScope Vision API returned unexpected response format")
 
+        except RequestCancelled:
+            raise
         except Exception as e:
             logging.error(f"视觉API调用失败: {e}")
-            text_messages = []
-            for msg_data in prompt_messages:
-                if isinstance(msg_data.get("content"), list):
-                    text_parts = [item.get("text", "") for item in msg_data["content"] if "text" in item]
-                    text_content = " ".join(text_parts)
-                    text_messages.append({"role": msg_data["role"], "content": text_content})
-                else:
-                    text_messages.append(msg_data)
-
-            fallback_kwargs = dict(
-                model="qwen-turbo",
-                messages=text_messages,
-                result_format="message",
-                temperature=self.temperature,
-                stream=False,
-                timeout=30,
-            )
-            if self.max_tokens:
-                fallback_kwargs["max_tokens"] = self.max_tokens
-            fallback_kwargs.update(kwargs)
+            raise_if_cancelled()
+            fallback_kwargs = self._build_fallback_kwargs(prompt_messages, **kwargs)
             response = dashscope.Generation.call(**fallback_kwargs)
 
             if hasattr(response, "status_code") and response.status_code == 200:
                 ai_content = response.output.choices[0]["message"]["content"]
                 logging.info("回退到文本模式成功")
-                return AIMessage(content=f"[注意：图片分析功能暂时不可用，以下是基于文本的回复]\n\n{ai_content}")
+                return AIMessage(content=f"{_VISION_FALLBACK_NOTICE}\n\n{ai_content}")
             else:
                 raise Exception("文本模式API调用也失败了")
 
@@ -245,16 +409,81 @@ class CustomVisionChatDashScope(BaseChatModel):
         self,
         messages: List[BaseMessage],
         stop: Optional[List[str]] = None,
-        image_path: Optional[str] = None,
+        image_path: Optional[ImageInput] = None,
         **kwargs: Any,
     ) -> ChatResult:
         ai_msg = self._call(messages, stop=stop, image_path=image_path, **kwargs)
         return ChatResult(generations=[ChatGeneration(message=ai_msg)])
 
+    async def _afallback(self, prompt_messages: List[dict], **kwargs: Any) -> str:
+        fallback_kwargs = self._build_fallback_kwargs(prompt_messages, **kwargs)
+        try:
+            output = await get_async_client().generation(**fallback_kwargs)
+        except Exception as e:
+            raise Exception("文本模式API调用也失败了") from e
+        logging.info("回退到文本模式成功")
+        return f"{_VISION_FALLBACK_NOTICE}\n\n{output['choices'][0]['message']['content']}"
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        image_path: Optional[ImageInput] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Awaitable counterpart of `_generate`, with the same text-only fallback."""
+
+        # 图片缩放与编码是 CPU 工作，放到线程中执行以免阻塞事件循环
+        prompt_messages = await asyncio.to_thread(self._build_prompt_messages, messages, image_path)
+        try:
+            output = await get_async_client().multimodal_generation(
+                **self._build_mm_kwargs(prompt_messages, **kwargs)
+            )
+            ai_content = _join_content_parts(output["choices"][0]["message"]["content"])
+        except Exception as e:
+            logging.error(f"视觉API调用失败: {e}")
+            ai_content = await self._afallback(prompt_messages, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=ai_content))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        image_path: Optional[ImageInput] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Streams vision deltas; falls back to a single text-only chunk if nothing was streamed."""
+
+        prompt_messages = await asyncio.to_thread(self._build_prompt_messages, messages, image_path)
+        mm_kwargs = self._build_mm_kwargs(prompt_messages, **kwargs)
+        mm_kwargs["incremental_output"] = True
+        started = False
+        try:
+            async for output in get_async_client().stream_multimodal_generation(**mm_kwargs):
+                delta = _join_content_parts(output["choices"][0]["message"]["content"])
+                if not delta:
+                    continue
+                started = True
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=delta))
+                if run_manager:
+                    await run_manager.on_llm_new_token(delta, chunk=chunk)
+                yield chunk
+        except Exception as e:
+            if started:
+                raise
+            logging.error(f"视觉API调用失败: {e}")
+            ai_content = await self._afallback(prompt_messages, **kwargs)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=ai_content))
+            if run_manager:
+                await run_manager.on_llm_new_token(ai_content, chunk=chunk)
+            yield chunk
+
     def call_with_image(
         self,
         text: str,
-        image_path: Optional[str] = None,
+        image_path: Optional[ImageInput] = None,
         system_prompt: Optional[str] = None
     ) -> str:
         messages = []
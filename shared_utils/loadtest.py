@@ -0,0 +1,292 @@
+"""
+门户压测工具。
+
+以固定并发驱动子应用的 `/chat`、`/start_dialogue` 与 `/continue_dialogue`，
+统计各端点的 p50/p95/p99 延迟、错误数与吞吐量。配合 `fake_dashscope` 可完全离线运行：
+
+    # 1) 对已启动的门户压测（门户需指向真实或替身 DashScope）
+    python -m shared_utils.loadtest --base-url http://127.0.0.1:5000 --concurrency 16 --duration 30
+
+    # 2) 一键离线：进程内启动替身 DashScope 与门户，再压测
+    python -m shared_utils.loadtest --serve-portal --concurrency 16 --duration 30 --fake-ttft lognormal:0.6,0.4
+
+`--json` 输出机器可读结果，便于与历史基线对比。
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+
+DEFAULT_CHAT_PREFIXES = ("/jindaishi", "/sdfz", "/maogai", "/xigai")
+DEFAULT_DIALOGUE_PREFIXES = ("/maogai", "/xigai")
+RESPONSE_MODES = ("fast", "balanced", "detailed")
+
+DEFAULT_MESSAGES = (
+    "为什么说中国共产党的成立是开天辟地的大事变？",
+    "请帮我生成关于新民主主义革命的知识图谱",
+    "帮我出几道关于改革开放的选择题",
+    "下列哪一项是正确的？A. 遵义会议 B. 古田会议 C. 八七会议 D. 洛川会议",
+    "社会主义核心价值观的基本内容是什么？",
+    "如何理解全面依法治国的总目标？",
+)
+DEFAULT_DIALOGUE_TOPICS = ("实事求是", "群众路线", "新发展理念", "人民民主专政")
+DEFAULT_DIALOGUE_REPLIES = ("我认为关键在于结合实际。", "能再举一个例子吗？", "这和今天有什么联系？")
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """线性插值百分位；sorted_values 需已升序。"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+class LatencyRecorder:
+    """按端点记录请求耗时与错误。"""
+
+    def __init__(self):
+        self._latencies: Dict[str, List[float]] = {}
+        self._errors: Dict[str, Dict[str, int]] = {}
+
+    def record(self, endpoint: str, seconds: float, error: Optional[str] = None) -> None:
+        if error is None:
+            self._latencies.setdefault(endpoint, []).append(seconds)
+        else:
+            errors = self._errors.setdefault(endpoint, {})
+            errors[error] = errors.get(error, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        endpoints: Dict[str, Any] = {}
+        total_ok = total_err = 0
+        for endpoint in sorted(set(self._latencies) | set(self._errors)):
+            values = sorted(self._latencies.get(endpoint, []))
+            errors = self._errors.get(endpoint, {})
+            n_err = sum(errors.values())
+            total_ok += len(values)
+            total_err += n_err
+            endpoints[endpoint] = {
+                "ok": len(values),
+                "errors": n_err,
+                "error_kinds": errors,
+                "p50": round(percentile(values, 0.50), 4),
+                "p95": round(percentile(values, 0.95), 4),
+                "p99": round(percentile(values, 0.99), 4),
+                "mean": round(sum(values) / len(values), 4) if values else 0.0,
+                "max": round(values[-1], 4) if values else 0.0,
+                "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            }
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_ok": total_ok,
+            "requests_failed": total_err,
+            "throughput_rps": round(total_ok / elapsed, 2) if elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+class LoadTest:
+    def __init__(
+        self,
+        base_url: str,
+        chat_prefixes: Sequence[str] = DEFAULT_CHAT_PREFIXES,
+        dialogue_prefixes: Sequence[str] = DEFAULT_DIALOGUE_PREFIXES,
+        concurrency: int = 8,
+        duration: float = 30.0,
+        max_requests: Optional[int] = None,
+        dialogue_ratio: float = 0.3,
+        dialogue_turns: int = 3,
+        messages: Sequence[str] = DEFAULT_MESSAGES,
+        timeout: float = 120.0,
+        seed: Optional[int] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.chat_prefixes = list(chat_prefixes)
+        self.dialogue_prefixes = list(dialogue_prefixes)
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.dialogue_ratio = dialogue_ratio if self.dialogue_prefixes else 0.0
+        self.dialogue_turns = dialogue_turns
+        self.messages = list(messages)
+        self.timeout = timeout
+        self.seed = seed
+        self.recorder = LatencyRecorder()
+        self._issued = 0
+
+    def _take_slot(self) -> bool:
+        # 单线程事件循环内调用，无需加锁
+        if self.max_requests is not None and self._issued >= self.max_requests:
+            return False
+        self._issued += 1
+        return True
+
+    async def _post(self, session: aiohttp.ClientSession, endpoint: str, path: str, payload: Dict[str, Any]):
+        start = time.perf_counter()
+        try:
+            async with session.post(self.base_url + path, json=payload) as resp:
+                text = await resp.text()
+                elapsed = time.perf_counter() - start
+                if resp.status != 200:
+                    self.recorder.record(endpoint, elapsed, f"HTTP {resp.status}")
+                    return None
+                body = json.loads(text)
+                if isinstance(body, dict) and body.get("error"):
+                    self.recorder.record(endpoint, elapsed, "error body")
+                    return None
+                self.recorder.record(endpoint, elapsed)
+                return body
+        except asyncio.TimeoutError:
+            self.recorder.record(endpoint, time.perf_counter() - start, "timeout")
+        except (aiohttp.ClientError, ValueError) as e:
+            self.recorder.record(endpoint, time.perf_counter() - start, type(e).__name__)
+        return None
+
+    async def _chat(self, session: aiohttp.ClientSession, rng: random.Random) -> None:
+        await self._post(session, "/chat", rng.choice(self.chat_prefixes) + "/chat", {
+            "message": rng.choice(self.messages),
+            "response_mode": rng.choice(RESPONSE_MODES),
+        })
+
+    async def _dialogue(self, session: aiohttp.ClientSession, rng: random.Random, deadline: float) -> None:
+        prefix = rng.choice(self.dialogue_prefixes)
+        mode = rng.choice(RESPONSE_MODES)
+        started = await self._post(session, "/start_dialogue", prefix + "/start_dialogue", {
+            "message": f"我们来讨论一下{rng.choice(DEFAULT_DIALOGUE_TOPICS)}",
+            "response_mode": mode,
+        })
+        session_id = (started or {}).get("session_id")
+        if not session_id:
+            return
+        for _ in range(self.dialogue_turns):
+            if time.perf_counter() >= deadline or not self._take_slot():
+                break
+            await self._post(session, "/continue_dialogue", prefix + "/continue_dialogue", {
+                "session_id": session_id,
+                "message": rng.choice(DEFAULT_DIALOGUE_REPLIES),
+                "response_mode": mode,
+            })
+        # 结束会话不计入统计，避免服务端会话堆积
+        try:
+            async with session.post(self.base_url + prefix + "/end_dialogue", json={"session_id": session_id}):
+                pass
+        except aiohttp.ClientError:
+            pass
+
+    async def _worker(self, session: aiohttp.ClientSession, worker_id: int, deadline: float) -> None:
+        rng = random.Random(None if self.seed is None else self.seed + worker_id)
+        while time.perf_counter() < deadline and self._take_slot():
+            if rng.random() < self.dialogue_ratio:
+                await self._dialogue(session, rng, deadline)
+            else:
+                await self._chat(session, rng)
+
+    async def run(self) -> Dict[str, Any]:
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            start = time.perf_counter()
+            deadline = start + self.duration
+            await asyncio.gather(*(self._worker(session, i, deadline) for i in range(self.concurrency)))
+            elapsed = time.perf_counter() - start
+        report = self.recorder.summary(elapsed)
+        report["concurrency"] = self.concurrency
+        return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"并发 {report['concurrency']}，耗时 {report['elapsed_seconds']}s，"
+        f"成功 {report['requests_ok']}，失败 {report['requests_failed']}，吞吐 {report['throughput_rps']} req/s",
+        f"{'endpoint':<20}{'ok':>7}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'rps':>8}",
+    ]
+    for endpoint, s in report["endpoints"].items():
+        lines.append(
+            f"{endpoint:<20}{s['ok']:>7}{s['errors']:>6}{s['p50']:>9.3f}{s['p95']:>9.3f}"
+            f"{s['p99']:>9.3f}{s['max']:>9.3f}{s['throughput_rps']:>8.2f}"
+        )
+        if s["error_kinds"]:
+            lines.append(f"{'':<20}错误: {s['error_kinds']}")
+    return "\n".join(lines)
+
+
+def serve_portal_in_process(host: str = "127.0.0.1", port: int = 0) -> str:
+    """在后台线程中启动门户（Total/portal/app.py），返回其根地址。"""
+    from werkzeug.serving import make_server
+
+    portal_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Total", "portal", "app.py")
+    spec = importlib.util.spec_from_file_location("portal_app", portal_path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"无法加载门户: {portal_path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    server = make_server(host, port, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="portal", daemon=True).start()
+    return f"http://{host}:{server.server_port}"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="门户压测：/chat、/start_dialogue、/continue_dialogue")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--chat-prefixes", default=",".join(DEFAULT_CHAT_PREFIXES))
+    parser.add_argument("--dialogue-prefixes", default=",".join(DEFAULT_DIALOGUE_PREFIXES))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, default=None, help="总请求数上限")
+    parser.add_argument("--dialogue-ratio", type=float, default=0.3, help="发起对话会话的比例")
+    parser.add_argument("--dialogue-turns", type=int, default=3, help="每个会话的 continue 轮数")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单请求超时（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--serve-portal", action="store_true", help="进程内启动替身 DashScope 与门户后再压测")
+    parser.add_argument("--fake-ttft", default="lognormal:0.6,0.4")
+    parser.add_argument("--fake-tps", type=float, default=40.0)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--fake-throttle-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    base_url = args.base_url
+    fake = None
+    if args.serve_portal:
+        from .fake_dashscope import FakeDashScopeConfig, start_fake_dashscope
+
+        fake = start_fake_dashscope(FakeDashScopeConfig(
+            ttft=args.fake_ttft,
+            tokens_per_second=args.fake_tps,
+            error_rate=args.fake_error_rate,
+            throttle_rate=args.fake_throttle_rate,
+            seed=args.seed,
+        ))
+        base_url = serve_portal_in_process()
+        print(f"[LoadTest] 替身 DashScope: {fake.base_url}，门户: {base_url}")
+
+    def _split(value: str) -> List[str]:
+        return ["/" + p.strip().strip("/") for p in value.split(",") if p.strip()]
+
+    report = asyncio.run(LoadTest(
+        base_url,
+        chat_prefixes=_split(args.chat_prefixes),
+        dialogue_prefixes=_split(args.dialogue_prefixes),
+        concurrency=args.concurrency,
+        duration=args.duration,
+        max_requests=args.requests,
+        dialogue_ratio=args.dialogue_ratio,
+        dialogue_turns=args.dialogue_turns,
+        timeout=args.timeout,
+        seed=args.seed,
+    ).run())
+    if fake is not None:
+        report["fake_dashscope"] = fake.stats()
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+进程级指标汇总。
+
+各共享组件（向量库注册表、缓存等）通过 `register_stats_provider` 登记一个
+返回 JSON 可序列化数据的回调；门户与子应用统一通过 `collect_stats()` 读取，
+避免每个组件各自暴露一套接口。
+"""
+import threading
+from typing import Any, Callable, Dict
+
+_LOCK = threading.Lock()
+_PROVIDERS: Dict[str, Callable[[], Any]] = {}
+
+
+def register_stats_provider(name: str, provider: Callable[[], Any]) -> None:
+    """登记（或覆盖）名为 name 的指标回调。"""
+    with _LOCK:
+        _PROVIDERS[name] = provider
+
+
+def unregister_stats_provider(name: str) -> None:
+    with _LOCK:
+        _PROVIDERS.pop(name, None)
+
+
+def collect_stats() -> Dict[str, Any]:
+    """调用全部已登记的回调；单个回调失败不影响其他指标。"""
+    with _LOCK:
+        providers = list(_PROVIDERS.items())
+    stats: Dict[str, Any] = {}
+    for name, provider in providers:
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {"error": str(e)}
+    return stats
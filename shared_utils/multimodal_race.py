@@ -0,0 +1,214 @@
+"""
+图片问答的并发执行。
+
+问答 Agent 原先的图片路径是串行的：OCR 完成后才发起视觉模型请求，视觉请求失败时再
+做一次纯文本回答，端到端延迟是三者之和。`race_image_answer()` 让 OCR 与视觉任务同时
+开始：视觉任务先等待 OCR 至多 `MULTIMODAL_OCR_WAIT` 秒（默认 3），OCR 在此期间完成时
+视觉模型与原串行流程一样同时收到识别文字，否则只带用户输入的文字发起请求，不再等待。
+OCR 命中缓存或图片较小时几乎不增加延迟；`collect_stats()` 中的 `vision_with_ocr` /
+`vision_without_ocr` 记录两种提问各发生了多少次。
+
+可选地在 OCR 结果出来后立刻以识别文字发起一次“推测性”的纯文本回答
+（`MULTIMODAL_SPECULATIVE_TEXT=1` 开启，默认关闭，因为每张图片会多一次 LLM 调用）。
+先得到可用结果的一方胜出，其余任务随即取消：尚未开始的直接撤销；已开始的任务在
+`cancellation_scope` 中运行，模型封装在下一次 HTTP 请求前（如视觉失败后的纯文本回退、
+检索后的 LLM 调用）或流式分片之间停止，已发出的非流式请求最迟在其 timeout 后结束。
+败者在胜者返回后又运行了多久记录在 `avg_loser_overrun_seconds`。
+
+视觉模型回退到纯文本（回答以 `_VISION_FALLBACK_NOTICE` 开头，即模型没看到图片）不算
+可用结果；此时若 OCR 识别出文字，改用基于识别文字的文本回答。
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .generation_params import RequestCancelled, cancellation_scope, raise_if_cancelled
+from .llm_wrapper import _VISION_FALLBACK_NOTICE
+from .metrics import register_stats_provider
+from .uploaded_image import ImageInput
+
+OCR_TEXT_PROMPT = "\n\n以下是 OCR 自动识别的图片文字，请据此解答：\n"
+DEFAULT_IMAGE_QUESTION = "请根据图片中的题目进行解答。"
+OCR_TEXT_LIMIT = 1500
+# process_request 出错时返回的提示语，不视为可用回答
+_ANSWER_FAILURE_PREFIX = "抱歉，回答过程中出现问题"
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_LOCK = threading.Lock()
+_STATS: Dict[str, Any] = {
+    "requests": 0,
+    "wins": {},
+    "cancelled": 0,
+    "seconds": 0.0,
+    "vision_with_ocr": 0,
+    "vision_without_ocr": 0,
+    "loser_overruns": 0,
+    "loser_overrun_seconds": 0.0,
+}
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    with _LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(
+                max_workers=int(os.environ.get("MULTIMODAL_RACE_WORKERS", "32")),
+                thread_name_prefix="multimodal-race",
+            )
+        return _EXECUTOR
+
+
+def with_ocr_text(text_input: str, extracted_text: str) -> str:
+    """把 OCR 识别文字附加到问题之后（问题为空时使用默认提问）。"""
+    return (text_input or DEFAULT_IMAGE_QUESTION) + OCR_TEXT_PROMPT + extracted_text[:OCR_TEXT_LIMIT]
+
+
+def _vision_acceptable(answer: Any) -> bool:
+    return bool(answer) and not str(answer).startswith(_VISION_FALLBACK_NOTICE)
+
+
+def _text_acceptable(answer: Any) -> bool:
+    return bool(answer) and not str(answer).startswith(_ANSWER_FAILURE_PREFIX)
+
+
+def _count(name: str) -> None:
+    with _LOCK:
+        _STATS[name] += 1
+
+
+def _record_overrun(seconds: float) -> None:
+    with _LOCK:
+        _STATS["loser_overruns"] += 1
+        _STATS["loser_overrun_seconds"] += seconds
+
+
+def _record(source: str, start: float, cancelled: int) -> None:
+    with _LOCK:
+        _STATS["requests"] += 1
+        _STATS["wins"][source] = _STATS["wins"].get(source, 0) + 1
+        _STATS["cancelled"] += cancelled
+        _STATS["seconds"] += time.perf_counter() - start
+
+
+def race_image_answer(
+    text_input: str,
+    image: ImageInput,
+    extract_text: Callable[[ImageInput], str],
+    vision: Callable[[str, ImageInput], str],
+    answer_text: Callable[[str], str],
+    speculative: Optional[bool] = None,
+    ocr_wait: Optional[float] = None,
+) -> str:
+    """并发执行 OCR、视觉请求（及可选的推测性文本回答），返回最先得到的可用回答。
+
+    - extract_text(image)：OCR，失败时应返回空字符串；
+    - vision(text, image)：视觉模型回答，OCR 在 ocr_wait 秒内完成时 text 中附有识别文字；
+    - answer_text(text)：纯文本回答（检索 + LLM）。
+    """
+    if speculative is None:
+        speculative = os.environ.get("MULTIMODAL_SPECULATIVE_TEXT", "0") == "1"
+    if ocr_wait is None:
+        ocr_wait = float(os.environ.get("MULTIMODAL_OCR_WAIT", "3"))
+    start = time.perf_counter()
+    pool = _executor()
+    results: "queue.Queue[Tuple[str, Any, Optional[BaseException]]]" = queue.Queue()
+    futures: Dict[str, Future] = {}
+    # stop 为各任务共用的取消令牌；stopped_at 记录胜者返回的时刻
+    stop = threading.Event()
+    stopped_at = [0.0]
+    ocr_done = threading.Event()
+    ocr_text = [""]
+
+    def submit(name: str, fn: Callable[..., Any], *args: Any) -> None:
+        def task() -> None:
+            with cancellation_scope(stop):
+                try:
+                    raise_if_cancelled()
+                    results.put((name, fn(*args), None))
+                except RequestCancelled:
+                    results.put((name, None, None))
+                except BaseException as e:
+                    results.put((name, None, e))
+            if stop.is_set() and stopped_at[0]:
+                _record_overrun(time.perf_counter() - stopped_at[0])
+
+        futures[name] = pool.submit(task)
+
+    def run_ocr(img: ImageInput) -> str:
+        try:
+            ocr_text[0] = extract_text(img) or ""
+            return ocr_text[0]
+        finally:
+            ocr_done.set()
+
+    def run_vision(img: ImageInput) -> str:
+        ocr_done.wait(ocr_wait)
+        extracted = ocr_text[0]
+        _count("vision_with_ocr" if extracted else "vision_without_ocr")
+        return vision(with_ocr_text(text_input, extracted) if extracted else text_input, img)
+
+    def finish(source: str, answer: Any) -> str:
+        stopped_at[0] = time.perf_counter()
+        stop.set()
+        cancelled = sum(1 for name, f in futures.items() if name != source and f.cancel())
+        _record(source, start, cancelled)
+        return str(answer).strip()
+
+    submit("ocr", run_ocr, image)
+    submit("vision", run_vision, image)
+    outstanding = 2
+    extracted_text = ""
+    vision_answer: Any = None
+    text_answer: Any = None
+    while outstanding:
+        name, value, error = results.get()
+        outstanding -= 1
+        if error is not None:
+            print(f"[MultimodalRace] {name} 失败: {error}")
+            continue
+        if name == "ocr":
+            extracted_text = value or ""
+            if speculative and extracted_text:
+                submit("text", answer_text, with_ocr_text(text_input, extracted_text))
+                outstanding += 1
+        elif name == "vision":
+            if _vision_acceptable(value):
+                return finish("vision", value)
+            vision_answer = value
+        elif name == "text":
+            if _text_acceptable(value):
+                return finish("text", value)
+            text_answer = value
+
+    # 没有可用结果：优先基于 OCR 文字作答，其次采用视觉模型的纯文本回退，最后只按文字提问作答
+    if extracted_text and text_answer is None:
+        text_answer = answer_text(with_ocr_text(text_input, extracted_text))
+    if extracted_text and _text_acceptable(text_answer):
+        return finish("fallback", text_answer)
+    if vision_answer:
+        return finish("fallback", vision_answer)
+    return finish("fallback", answer_text(text_input))
+
+
+def race_stats() -> Dict[str, Any]:
+    with _LOCK:
+        requests = _STATS["requests"]
+        overruns = _STATS["loser_overruns"]
+        return {
+            "requests": requests,
+            "wins": dict(_STATS["wins"]),
+            "cancelled": _STATS["cancelled"],
+            "avg_seconds": round(_STATS["seconds"] / requests, 3) if requests else 0.0,
+            "vision_with_ocr": _STATS["vision_with_ocr"],
+            "vision_without_ocr": _STATS["vision_without_ocr"],
+            "loser_overruns": overruns,
+            "avg_loser_overrun_seconds": (
+                round(_STATS["loser_overrun_seconds"] / overruns, 3) if overruns else 0.0
+            ),
+        }
+
+
+register_stats_provider("multimodal_race", race_stats)
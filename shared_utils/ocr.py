@@ -0,0 +1,294 @@
+"""
+图片文字识别（OCR）服务。
+
+各问答 Agent 原先在请求线程中直接调用 `pytesseract.image_to_string`：每次都同步派生一个
+tesseract 进程，且学生反复上传同一张教材截图时也要重新识别。`OcrService`：
+
+- 在有界的进程池中执行识别（`OCR_WORKERS`，默认 min(2, CPU 数)），排队超过
+  `OCR_MAX_PENDING` 时直接放弃本次 OCR，不让请求越积越多；
+- 以图片内容的 SHA-256 + 语言为键做 LRU 结果缓存（`OCR_CACHE_SIZE`，默认 256），
+  同一图片的并发请求共享同一次识别；
+- 单次识别超时（`OCR_TIMEOUT`，默认 15 秒）后返回空字符串，tesseract 进程由 pytesseract
+  的超时机制结束；工作进程崩溃使进程池损坏时丢弃该进程池，下次识别时重建；
+- 识别前预处理（`OCR_PREPROCESS=0` 关闭）：按 EXIF 方向摆正、转灰度、把长边归一到
+  约 300 DPI 对应的像素范围，并以局部均值自适应二值化，适合光照不均的手机照片。
+
+识别失败时一律返回空字符串，与原先的降级行为一致。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from .metrics import register_stats_provider
+from .uploaded_image import ImageInput, UploadedImage
+
+DEFAULT_LANG = "chi_sim+eng"
+# 长边归一化范围：过小的截图放大（最多 2 倍），过大的照片缩小，使字高接近 tesseract 偏好的 ~300 DPI
+OCR_MIN_SIDE = 1600
+OCR_MAX_SIDE = 2800
+OCR_MAX_UPSCALE = 2.0
+# 自适应二值化：像素比邻域均值暗 OFFSET 以上视为文字
+THRESHOLD_RADIUS = 16
+THRESHOLD_OFFSET = 12
+
+_COMMON_TESSERACT_PATHS = (
+    r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe",
+    r"C:\\Program Files (x86)\\Tesseract-OCR\\tesseract.exe",
+)
+
+
+def _configure_tesseract(pytesseract: Any) -> None:
+    custom_cmd = os.environ.get("TESSERACT_CMD")
+    if custom_cmd and os.path.exists(custom_cmd):
+        pytesseract.pytesseract.tesseract_cmd = custom_cmd
+        return
+    for path in _COMMON_TESSERACT_PATHS:
+        if os.path.exists(path):
+            pytesseract.pytesseract.tesseract_cmd = path
+            return
+
+
+def preprocess(image: Image.Image) -> Image.Image:
+    """摆正、灰度化、长边归一化并自适应二值化，返回 "L" 模式图像。"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        # 透明背景的截图先铺白底，否则透明区域会变成黑色
+        rgba = image.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, rgba)
+    gray = ImageOps.grayscale(image)
+
+    longest = max(gray.size)
+    scale = 1.0
+    if longest < OCR_MIN_SIDE:
+        scale = min(OCR_MAX_UPSCALE, OCR_MIN_SIDE / longest)
+    elif longest > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / longest
+    if scale != 1.0:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.BICUBIC if scale > 1 else Image.LANCZOS)
+
+    gray = ImageOps.autocontrast(gray, cutoff=1)
+    pixels = np.asarray(gray, dtype=np.int16)
+    local_mean = np.asarray(gray.filter(ImageFilter.BoxBlur(THRESHOLD_RADIUS)), dtype=np.int16)
+    binary = np.where(pixels < local_mean - THRESHOLD_OFFSET, 0, 255).astype(np.uint8)
+    return Image.fromarray(binary, mode="L")
+
+
+def _recognize(data: bytes, lang: str, timeout: float, do_preprocess: bool) -> str:
+    """进程池中执行：解码、预处理并调用 tesseract。"""
+    import io
+
+    import pytesseract
+
+    _configure_tesseract(pytesseract)
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        prepared = preprocess(image) if do_preprocess else image
+        config = "--dpi 300" if do_preprocess else ""
+        text = pytesseract.image_to_string(prepared, lang=lang, config=config, timeout=timeout)
+    return text.strip()
+
+
+def _is_tesseract_timeout(error: BaseException) -> bool:
+    # pytesseract 超时时抛出 RuntimeError("Tesseract process timeout")
+    return "timeout" in str(error).lower()
+
+
+class OcrService:
+    """进程池 OCR + 按内容哈希的 LRU 结果缓存，线程安全。"""
+
+    def __init__(
+        self,
+        workers: int = 2,
+        cache_size: int = 256,
+        timeout: float = 15.0,
+        max_pending: Optional[int] = None,
+        lang: str = DEFAULT_LANG,
+        do_preprocess: bool = True,
+    ):
+        self.workers = max(1, workers)
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.max_pending = max_pending if max_pending is not None else self.workers * 4
+        self.lang = lang
+        self.do_preprocess = do_preprocess
+        # 回调可能在提交线程中同步执行（future 已完成时），因此用可重入锁
+        self._lock = threading.RLock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._available: Optional[bool] = None
+        self._hits = 0
+        self._misses = 0
+        self._shared = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._errors = 0
+        self._seconds = 0.0
+
+    def available(self) -> bool:
+        """pytesseract 可导入时为 True（只检查一次）。"""
+        if self._available is None:
+            try:
+                import pytesseract  # noqa: F401
+
+                self._available = True
+            except Exception:
+                self._available = False
+        return self._available
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def extract_text(self, image: ImageInput, lang: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """识别图片中的文字；缓存命中时直接返回，失败、超时或排队已满时返回空字符串。"""
+        if not self.available():
+            return ""
+        lang = lang or self.lang
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            if isinstance(image, UploadedImage):
+                data, digest = image.data, image.digest
+            else:
+                with open(image, "rb") as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+        except Exception as e:
+            print(f"[OCR] 读取图片失败: {e}")
+            return ""
+        key = f"{digest}:{lang}:{int(self.do_preprocess)}"
+
+        with self._lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return text
+            future = self._inflight.get(key)
+            if future is not None:
+                self._shared += 1
+            elif len(self._inflight) >= self.max_pending:
+                self._rejected += 1
+                print(f"[OCR] 排队请求已达上限（{self.max_pending}），跳过本次识别")
+                return ""
+            else:
+                self._misses += 1
+                try:
+                    future = self._get_pool().submit(_recognize, data, lang, timeout, self.do_preprocess)
+                except BrokenProcessPool as e:
+                    # 工作进程崩溃后进程池永久不可用：丢弃它，下次调用时重建
+                    self._errors += 1
+                    self._discard_pool()
+                    print(f"[OCR] 进程池已损坏，将在下次识别时重建: {e}")
+                    return ""
+                self._inflight[key] = future
+                future.add_done_callback(lambda done, key=key: self._finish(key, done))
+
+        start = time.perf_counter()
+        try:
+            # 进程内 tesseract 超时后还需返回结果，这里多留 1 秒
+            return future.result(timeout=timeout + 1.0)
+        except FutureTimeoutError:
+            self._count_timeout()
+            print(f"[OCR] 识别超时（{timeout:.0f}s），跳过 OCR 结果")
+            return ""
+        except Exception as e:
+            if _is_tesseract_timeout(e):
+                self._count_timeout()
+            print(f"[OCR] 识别失败: {e}")
+            return ""
+        finally:
+            with self._lock:
+                self._seconds += time.perf_counter() - start
+
+    def _finish(self, key: str, future: Future) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                # 超时由等待结果的调用方计数，这里只记其他错误
+                if not _is_tesseract_timeout(error):
+                    self._errors += 1
+                return
+            if self.cache_size > 0:
+                self._cache[key] = future.result()
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def _count_timeout(self) -> None:
+        with self._lock:
+            self._timeouts += 1
+
+    def _discard_pool(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        self._discard_pool()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses + self._shared
+            waits = self._misses + self._shared
+            return {
+                "available": self._available,
+                "workers": self.workers,
+                "entries": len(self._cache),
+                "inflight": len(self._inflight),
+                "hits": self._hits,
+                "misses": self._misses,
+                "shared": self._shared,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "timeouts": self._timeouts,
+                "rejected": self._rejected,
+                "errors": self._errors,
+                "avg_wait_seconds": round(self._seconds / waits, 3) if waits else 0.0,
+            }
+
+
+_SERVICE: Optional[OcrService] = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_ocr_service() -> OcrService:
+    """进程内共享的 OCR 服务，按环境变量配置：
+
+    - OCR_WORKERS：进程池大小（默认 min(2, CPU 数)）
+    - OCR_MAX_PENDING：同时排队/执行的识别上限（默认 4×OCR_WORKERS）
+    - OCR_CACHE_SIZE：结果缓存条目上限（默认 256，0 表示不缓存）
+    - OCR_TIMEOUT：单次识别超时秒数（默认 15）
+    - OCR_PREPROCESS：设为 0 关闭预处理
+    """
+    global _SERVICE
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            workers = int(os.environ.get("OCR_WORKERS", str(min(2, os.cpu_count() or 1))))
+            max_pending = os.environ.get("OCR_MAX_PENDING")
+            _SERVICE = OcrService(
+                workers=workers,
+                cache_size=int(os.environ.get("OCR_CACHE_SIZE", "256")),
+                timeout=float(os.environ.get("OCR_TIMEOUT", "15")),
+                max_pending=int(max_pending) if max_pending else None,
+                do_preprocess=os.environ.get("OCR_PREPROCESS", "1") != "0",
+            )
+        return _SERVICE
+
+
+register_stats_provider("ocr", lambda: get_ocr_service().stats())
@@ -0,0 +1,68 @@
+"""
+请求速率限制。
+
+DashScope 对每个模型同时限制 QPS 与每分钟 token 数（TPM）。`RateLimiter` 用两个令牌桶
+分别约束这两项，多个线程共享同一个实例：`acquire(tokens)` 先预占额度，再在锁外睡眠到
+额度可用为止，因此等待中的线程不会阻塞其他线程预占。参数为 0 / None 表示不限。
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class _Bucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, cost: float, now: float) -> float:
+        """扣除 cost（允许透支），返回需要等待的秒数。"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= cost
+        return max(0.0, -self.level / self.rate)
+
+
+class RateLimiter:
+    """线程安全的 QPS + TPM 限速器。"""
+
+    def __init__(self, qps: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.qps = qps or None
+        self.tokens_per_minute = tokens_per_minute or None
+        self._requests = _Bucket(self.qps, max(1.0, self.qps)) if self.qps else None
+        self._tokens = (
+            _Bucket(self.tokens_per_minute / 60.0, self.tokens_per_minute) if self.tokens_per_minute else None
+        )
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """预占一次请求和 tokens 个 token 的额度，必要时睡眠；返回等待秒数。"""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens is not None and tokens:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+            self.calls += 1
+            if wait > 0:
+                self.throttled += 1
+                self.waited_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "qps": self.qps,
+                "tokens_per_minute": self.tokens_per_minute,
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "waited_seconds": round(self.waited_seconds, 3),
+            }
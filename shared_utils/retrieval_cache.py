@@ -0,0 +1,81 @@
+"""
+检索结果缓存。
+
+问答与知识图谱 Agent 对热门知识点反复以相同的 `(query, k)` 检索（如
+`f"{topic} {self.subject_name}"`），每次都要嵌入查询并检索 FAISS / BM25。本模块为每个
+共享向量库（即每个学科）维护一个小型 LRU，以（查询, k, 是否混合检索）为键缓存检索到的
+文档列表。
+
+每个条目都按写入时所用索引的加载代数（`vectorstore_registry` 每次重新加载索引时加一）
+标记：出现更新的代数时整体清空，仍在使用旧索引的请求既不会命中新结果，也不会写入旧结果。
+
+环境变量：
+- RETRIEVAL_CACHE_SIZE：每个向量库的条目上限（默认 256，0 表示关闭）
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from langchain_core.documents import Document
+
+
+class RetrievalCache:
+    """单个向量库的检索结果 LRU，线程安全。generation 为检索所用索引的加载代数。"""
+
+    def __init__(self, path: str, max_entries: int = 256):
+        self.path = path
+        self.max_entries = max_entries
+        self._generation = 0
+        self._entries: "OrderedDict[Hashable, List[Document]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _advance(self, generation: int) -> None:
+        if generation > self._generation:
+            self._generation = generation
+            self._entries.clear()
+            self._invalidations += 1
+
+    def get(self, key: Hashable, generation: int = 0) -> Optional[List[Document]]:
+        with self._lock:
+            self._advance(generation)
+            docs = self._entries.get(key) if generation == self._generation else None
+            if docs is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            # 返回新列表，调用方增删元素不会影响缓存
+            return list(docs)
+
+    def set(self, key: Hashable, docs: List[Document], generation: int = 0) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._advance(generation)
+            if generation != self._generation:
+                return  # 旧索引上的检索结果
+            self._entries[key] = list(docs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "path": self.path,
+                "generation": self._generation,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self._invalidations,
+            }
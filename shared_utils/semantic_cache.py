@@ -0,0 +1,206 @@
+"""
+问答结果的语义缓存（按学科）。
+
+换一种说法提出的同一问题，精确匹配缓存无法命中，仍要重新调用一次 qwen-max。
+本模块把问题向量与最终答案一起存入一个小型 FAISS 内积索引（向量已归一化，
+内积即余弦相似度），相似度超过阈值时直接返回已有答案。查询在全部超过阈值的
+条目中挑选同一 variant 的最相似者；写入时同一 variant 下已有相似问题则替换其答案，
+不会堆积重复条目。
+
+缓存记录所依据的知识库版本（向量库注册表中已加载索引的版本戳），知识库重建并重新
+加载后自动清空。
+
+余弦相似度分不清只差几个字的问题：同一题干配不同选项的选择题，或“是/不是”之类的
+否定改写，嵌入几乎相同，答案却不同。`answer_variant()` 因此把选项文字的哈希并入
+variant；含否定词的问题以整句哈希作为 variant，只有完全相同的问题才会命中。
+
+环境变量：
+- SEMANTIC_CACHE_ENABLED：设为 0 关闭（默认开启）
+- SEMANTIC_CACHE_THRESHOLD：命中所需的余弦相似度（默认 0.95）
+- SEMANTIC_CACHE_SIZE：每个学科保留的条目上限（默认 1000）
+"""
+import hashlib
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from .metrics import register_stats_provider
+from .vectorstore_registry import DEFAULT_EMBEDDING_MODEL, get_embeddings, loaded_index_version
+
+# 选项标记：A. / B、/ (C) / D： 等，至少出现两个不同字母才视为选择题
+_OPTION_MARK = re.compile(r"(?<![A-Za-z])[(（]?([A-H])\s*[\.．、:：)）]")
+_NEGATIONS = ("不是", "不正确", "不属于", "不包括", "不符合", "不能", "不对", "错误的是", "除外", "并非", "没有")
+
+_LOCK = threading.Lock()
+_CACHES: Dict[Tuple[str, str], "SemanticAnswerCache"] = {}
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()[:16]
+
+
+def answer_variant(question: str, variant: str = "") -> str:
+    """在回答规格 variant 上叠加问题中语义相似度无法区分的部分（选项文字、否定改写）。"""
+    if any(word in question for word in _NEGATIONS):
+        return f"{variant}|q:{_digest(question)}"
+    marks = list(_OPTION_MARK.finditer(question))
+    if len({m.group(1) for m in marks}) >= 2:
+        return f"{variant}|o:{_digest(question[marks[0].start():])}"
+    return variant
+
+
+def clean_answer(text: str) -> str:
+    """去掉模型偶尔包在回答首尾的反引号；直接返回与流式返回的答案都先经过它再写入缓存。"""
+    return re.sub(r"^`+|`+$", "", str(text).strip()).strip()
+
+
+class SemanticAnswerCache:
+    """以问题向量为键的答案缓存，线程安全。"""
+
+    def __init__(
+        self,
+        vectorstore_path: str,
+        embeddings: Any,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+    ):
+        self.vectorstore_path = os.path.abspath(vectorstore_path)
+        self.embedding_model = embedding_model
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._index: Optional[faiss.IndexFlatIP] = None
+        self._vectors: List[np.ndarray] = []
+        self._answers: List[Tuple[str, str]] = []
+        self._version = self._index_version()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(question), dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _find(self, vector: np.ndarray, variant: str) -> Optional[int]:
+        """相似度不低于阈值的全部条目中，与 variant 相同且最相似的一条的位置。"""
+        if self._index is None or not self._index.ntotal:
+            return None
+        lims, scores, ids = self._index.range_search(vector, self.threshold)
+        best: Optional[int] = None
+        best_score = -1.0
+        for score, idx in zip(scores[lims[0]:lims[1]], ids[lims[0]:lims[1]]):
+            if score > best_score and self._answers[idx][0] == variant:
+                best, best_score = int(idx), float(score)
+        return best
+
+    def _index_version(self) -> str:
+        return loaded_index_version(self.vectorstore_path, self.embedding_model)
+
+    def _check_version(self) -> None:
+        version = self._index_version()
+        if version != self._version:
+            self._version = version
+            self._index = None
+            self._vectors = []
+            self._answers = []
+            self._invalidations += 1
+
+    def lookup(self, question: str, variant: str = "") -> Tuple[Optional[str], Optional[Tuple[np.ndarray, str]]]:
+        """返回（命中的答案或 None, 写入凭据）；凭据为问题向量与当前知识库版本，直接传给 `store`，
+        避免重复嵌入，也避免把旧知识库上生成的答案写进重建后的缓存。
+
+        variant 区分同一问题的不同回答规格（如 fast/detailed 对应的 max_tokens），只在同规格内命中；
+        调用方应先经 `answer_variant()` 叠加选项与否定信息。
+        """
+        try:
+            vector = self._embed(question)
+        except Exception as e:
+            print(f"[SemanticCache] 问题嵌入失败，跳过缓存: {e}")
+            return None, None
+        with self._lock:
+            self._check_version()
+            version = self._version
+            idx = self._find(vector, variant)
+            if idx is not None:
+                self._hits += 1
+                return self._answers[idx][1], (vector, version)
+            self._misses += 1
+        return None, (vector, version)
+
+    def store(self, ticket: Optional[Tuple[np.ndarray, str]], answer: str, variant: str = "") -> None:
+        if ticket is None or not answer:
+            return
+        vector, version = ticket
+        with self._lock:
+            self._check_version()
+            if version != self._version:
+                return  # 答案基于重建前的知识库
+            if self._index is None:
+                self._index = faiss.IndexFlatIP(vector.shape[1])
+            idx = self._find(vector, variant)
+            if idx is not None:
+                # 同一规格下已有相似问题（如并发的同题请求都未命中）：替换其答案，不重复添加
+                self._answers[idx] = (variant, answer)
+                return
+            if len(self._answers) >= self.max_entries:
+                # 超出上限时丢弃较早的一半条目并重建索引
+                keep = self.max_entries // 2
+                self._vectors = self._vectors[-keep:]
+                self._answers = self._answers[-keep:]
+                self._index.reset()
+                if self._vectors:
+                    self._index.add(np.vstack(self._vectors))
+            self._vectors.append(vector)
+            self._answers.append((variant, answer))
+            self._index.add(vector)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "path": self.vectorstore_path,
+                "entries": len(self._answers),
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self._invalidations,
+            }
+
+
+def get_semantic_cache(
+    vectorstore_path: str,
+    embedding_model: str = "text-embedding-v2",
+) -> Optional[SemanticAnswerCache]:
+    """返回该学科共享的语义缓存；通过 SEMANTIC_CACHE_ENABLED=0 关闭时返回 None。"""
+    if os.environ.get("SEMANTIC_CACHE_ENABLED", "1") == "0":
+        return None
+    key = (os.path.abspath(vectorstore_path), embedding_model)
+    with _LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            cache = SemanticAnswerCache(
+                vectorstore_path,
+                get_embeddings(embedding_model),
+                threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+                max_entries=int(os.environ.get("SEMANTIC_CACHE_SIZE", "1000")),
+                embedding_model=embedding_model,
+            )
+            _CACHES[key] = cache
+        return cache
+
+
+def semantic_cache_stats() -> List[Dict[str, Any]]:
+    with _LOCK:
+        caches = list(_CACHES.values())
+    return [cache.stats() for cache in caches]
+
+
+register_stats_provider("semantic_cache", semantic_cache_stats)
@@ -0,0 +1,302 @@
+"""
+苏格拉底对话的会话存储。
+
+D、E 子应用原先把会话状态放在模块级 dict 中：只有客户端调用 `/end_dialogue` 才会删除，
+放弃的会话永远占着内存，且多个 worker 进程之间无法共享。本模块提供统一的会话存储接口
+（`get` / `set` / `delete`），两种实现：
+
+- `MemorySessionStore`：进程内 LRU + 空闲 TTL，超过条目上限时淘汰最久未访问的会话；
+- `SqliteSessionStore`：sqlite 文件（WAL），多个 worker 进程可共享同一文件；状态只以 JSON
+  存储，读取时也只做 JSON 解析（不使用 pickle）。会话状态应只含 dict / list / 字符串 / 数字；
+  无法 JSON 序列化的状态不保存（打印错误并删除该会话，下一轮按新会话处理），不做有损转换。
+
+`get_session_store(namespace)` 按环境变量选择实现：
+
+- SESSION_DB：sqlite 文件路径；设置后使用 `SqliteSessionStore`，否则使用内存实现
+- SESSION_TTL：会话空闲过期秒数（默认 7200，0 表示不过期）
+- SESSION_MAX：每个命名空间保留的会话上限（默认 1000）
+
+存活会话数与占用字节数通过 `collect_stats()` 的 `sessions` 查看；内存实现的字节数为遍历状态
+得到的估算值（不做序列化），sqlite 实现为实际存储的 JSON 字节数。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import register_stats_provider
+
+
+def _encode(state: Any) -> Optional[bytes]:
+    try:
+        return json.dumps(state, ensure_ascii=False).encode("utf-8")
+    except (TypeError, ValueError) as e:
+        print(f"[SessionStore] 错误：会话状态无法 JSON 序列化，未保存: {e}")
+        return None
+
+
+def _estimate_size(state: Any) -> int:
+    """粗略估算状态占用的字节数：字符串按长度、数字按 8 字节，容器逐层累加；不序列化、不抛异常。"""
+    total = 0
+    seen = set()
+    stack = [state]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            total += len(value)
+        elif isinstance(value, (bytes, bytearray)):
+            total += len(value)
+        elif isinstance(value, (dict, list, tuple, set)):
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            if isinstance(value, dict):
+                stack.extend(value.keys())
+                stack.extend(value.values())
+            else:
+                stack.extend(value)
+            total += 8 * len(value)
+        else:
+            total += 8
+    return total
+
+
+class SessionStore:
+    """会话存储接口：状态按会话 id 存取，空闲超过 ttl_seconds 的会话视为不存在。"""
+
+    backend = "base"
+
+    def __init__(self, namespace: str, ttl_seconds: Optional[float] = 7200, max_sessions: int = 1000):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evicted = 0
+
+    def get(self, session_id: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, session_id: str, state: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        """删除会话；会话存在时返回 True。"""
+        raise NotImplementedError
+
+    def _expired_before(self, now: float) -> float:
+        return now - self.ttl_seconds if self.ttl_seconds else float("-inf")
+
+    def _usage(self) -> Tuple[int, int]:
+        """返回（存活会话数, 占用字节数）。"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        live, nbytes = self._usage()
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "namespace": self.namespace,
+                "backend": self.backend,
+                "live_sessions": live,
+                "bytes": nbytes,
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "expired": self._expired,
+                "evicted": self._evicted,
+            }
+
+
+class MemorySessionStore(SessionStore):
+    """进程内 LRU + TTL 会话存储，线程安全。"""
+
+    backend = "memory"
+
+    def __init__(self, namespace: str, ttl_seconds: Optional[float] = 7200, max_sessions: int = 1000):
+        super().__init__(namespace, ttl_seconds, max_sessions)
+        # 会话 id -> (最近访问时间, 估算字节数, 状态)
+        self._sessions: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+
+    def _drop(self, session_id: str) -> None:
+        _, size, _ = self._sessions.pop(session_id)
+        self._bytes -= size
+
+    def _purge(self, now: float) -> None:
+        # 按最近访问时间排列，最旧的在前
+        cutoff = self._expired_before(now)
+        while self._sessions:
+            session_id, (touched, _, _) = next(iter(self._sessions.items()))
+            if touched >= cutoff:
+                break
+            self._drop(session_id)
+            self._expired += 1
+
+    def get(self, session_id: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            item = self._sessions.get(session_id)
+            if item is None:
+                self._misses += 1
+                return None
+            self._sessions[session_id] = (now, item[1], item[2])
+            self._sessions.move_to_end(session_id)
+            self._hits += 1
+            return item[2]
+
+    def set(self, session_id: str, state: Any) -> None:
+        now = time.time()
+        size = _estimate_size(state)
+        with self._lock:
+            self._purge(now)
+            if session_id in self._sessions:
+                self._drop(session_id)
+            self._sessions[session_id] = (now, size, state)
+            self._bytes += size
+            while len(self._sessions) > self.max_sessions:
+                self._drop(next(iter(self._sessions)))
+                self._evicted += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._drop(session_id)
+            return True
+
+    def _usage(self) -> Tuple[int, int]:
+        with self._lock:
+            self._purge(time.time())
+            return len(self._sessions), self._bytes
+
+
+class SqliteSessionStore(SessionStore):
+    """sqlite 会话存储，可供多个 worker 进程共享；同一文件中按命名空间区分。"""
+
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        namespace: str,
+        db_path: str,
+        ttl_seconds: Optional[float] = 7200,
+        max_sessions: int = 1000,
+    ):
+        super().__init__(namespace, ttl_seconds, max_sessions)
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dialogue_sessions ("
+            "namespace TEXT NOT NULL, session_id TEXT NOT NULL, state BLOB NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, session_id))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS dialogue_sessions_updated ON dialogue_sessions (namespace, updated_at)"
+        )
+        self._db.commit()
+
+    def _purge(self, now: float) -> None:
+        cursor = self._db.execute(
+            "DELETE FROM dialogue_sessions WHERE namespace = ? AND updated_at < ?",
+            (self.namespace, self._expired_before(now)),
+        )
+        self._expired += max(cursor.rowcount, 0)
+
+    def get(self, session_id: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state, updated_at FROM dialogue_sessions WHERE namespace = ? AND session_id = ?",
+                (self.namespace, session_id),
+            ).fetchone()
+            if row is None or row[1] < self._expired_before(now):
+                self._misses += 1
+                return None
+            self._db.execute(
+                "UPDATE dialogue_sessions SET updated_at = ? WHERE namespace = ? AND session_id = ?",
+                (now, self.namespace, session_id),
+            )
+            self._db.commit()
+            self._hits += 1
+        return json.loads(bytes(row[0]).decode("utf-8"))
+
+    def set(self, session_id: str, state: Any) -> None:
+        now = time.time()
+        data = _encode(state)
+        if data is None:
+            self.delete(session_id)
+            return
+        with self._lock:
+            self._purge(now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO dialogue_sessions "
+                "(namespace, session_id, state, updated_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, session_id, sqlite3.Binary(data), now),
+            )
+            # 超出上限时删除最久未访问的会话
+            cursor = self._db.execute(
+                "DELETE FROM dialogue_sessions WHERE namespace = ? AND session_id IN ("
+                "SELECT session_id FROM dialogue_sessions WHERE namespace = ? "
+                "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_sessions),
+            )
+            self._evicted += max(cursor.rowcount, 0)
+            self._db.commit()
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM dialogue_sessions WHERE namespace = ? AND session_id = ?",
+                (self.namespace, session_id),
+            )
+            self._db.commit()
+            return cursor.rowcount > 0
+
+    def _usage(self) -> Tuple[int, int]:
+        with self._lock:
+            count, nbytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(state)), 0) FROM dialogue_sessions "
+                "WHERE namespace = ? AND updated_at >= ?",
+                (self.namespace, self._expired_before(time.time())),
+            ).fetchone()
+        return int(count), int(nbytes)
+
+
+_STORES: Dict[str, SessionStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_session_store(namespace: str) -> SessionStore:
+    """返回命名空间（如子应用名）对应的进程内共享会话存储，按环境变量选择实现。"""
+    with _STORES_LOCK:
+        store = _STORES.get(namespace)
+        if store is None:
+            ttl = float(os.environ.get("SESSION_TTL", "7200"))
+            max_sessions = int(os.environ.get("SESSION_MAX", "1000"))
+            db_path = os.environ.get("SESSION_DB")
+            if db_path:
+                store = SqliteSessionStore(namespace, db_path, ttl if ttl > 0 else None, max_sessions)
+            else:
+                store = MemorySessionStore(namespace, ttl if ttl > 0 else None, max_sessions)
+            _STORES[namespace] = store
+        return store
+
+
+def session_stats() -> List[Dict[str, Any]]:
+    with _STORES_LOCK:
+        stores = list(_STORES.values())
+    return [store.stats() for store in stores]
+
+
+register_stats_provider("sessions", session_stats)
@@ -0,0 +1,147 @@
+"""
+启动耗时剖析（默认关闭）。
+
+门户启动慢的原因分散在各处：langchain / langgraph / dashscope 的导入、各学科
+`FAISS.load_local` 反序列化、每个 Agent 构造时编译 StateGraph 等。本模块提供
+`profile_section(kind, name)` 上下文管理器，开启后记录每一段的墙钟耗时与常驻内存
+（RSS）增量；未开启时是空操作，可以常驻在启动路径上。
+
+开启方式：设置环境变量 STARTUP_PROFILE=1，或由门户 `create_app(profile=True)` 调用
+`enable()`。`report()` 按耗时降序返回记录，`format_table()` 生成文本表格，
+`dump(path)` 写出 JSON 作为回归对比的基线。
+"""
+import contextlib
+import importlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_RECORDS: List[Dict[str, Any]] = []
+_ENABLED = os.environ.get("STARTUP_PROFILE", "0") not in ("", "0")
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+# 门户启动时单独计时的重量级依赖（按导入先后顺序）
+HEAVY_IMPORTS = (
+    "numpy",
+    "faiss",
+    "dashscope",
+    "langchain_core",
+    "langchain_community.vectorstores",
+    "langchain_dashscope",
+    "langgraph.graph",
+)
+
+
+def _rss_bytes() -> Optional[int]:
+    """当前进程常驻内存；Linux 读取 /proc，其他平台退回峰值 RSS。"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except Exception:
+        return None
+
+
+def enable() -> None:
+    global _ENABLED
+    _ENABLED = True
+
+
+def is_enabled() -> bool:
+    return _ENABLED
+
+
+def reset() -> None:
+    with _LOCK:
+        _RECORDS.clear()
+
+
+@contextlib.contextmanager
+def profile_section(kind: str, name: str) -> Iterator[None]:
+    """记录一段启动代码的耗时与 RSS 增量；kind 如 "import" / "subapp" / "agent" / "faiss"。"""
+    if not _ENABLED:
+        yield
+        return
+    stack = getattr(_LOCAL, "stack", None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(f"{kind}:{name}")
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        rss_after = _rss_bytes()
+        stack.pop()
+        record = {
+            "kind": kind,
+            "name": name,
+            "parent": parent,
+            "seconds": round(seconds, 4),
+            "rss_delta_mb": (
+                round((rss_after - rss_before) / (1024 * 1024), 2)
+                if rss_before is not None and rss_after is not None
+                else None
+            ),
+            "rss_mb": round(rss_after / (1024 * 1024), 1) if rss_after is not None else None,
+            "error": error,
+        }
+        with _LOCK:
+            _RECORDS.append(record)
+
+
+def profile_imports(modules: Iterable[str] = HEAVY_IMPORTS) -> None:
+    """依次导入并计时；已导入或未安装的模块同样记录（耗时接近 0 / 带 error）。"""
+    for module in modules:
+        try:
+            with profile_section("import", module):
+                importlib.import_module(module)
+        except Exception:
+            pass
+
+
+def report() -> List[Dict[str, Any]]:
+    with _LOCK:
+        records = list(_RECORDS)
+    return sorted(records, key=lambda r: r["seconds"], reverse=True)
+
+
+def format_table(records: Optional[List[Dict[str, Any]]] = None) -> str:
+    records = report() if records is None else records
+    lines = [f"{'seconds':>9}  {'rss_delta_mb':>12}  {'kind':<8}  name"]
+    for r in records:
+        delta = "-" if r["rss_delta_mb"] is None else f"{r['rss_delta_mb']:.2f}"
+        name = r["name"] + (f"  (in {r['parent']})" if r["parent"] else "")
+        if r["error"]:
+            name += f"  [失败: {r['error']}]"
+        lines.append(f"{r['seconds']:>9.3f}  {delta:>12}  {r['kind']:<8}  {name}")
+    return "\n".join(lines)
+
+
+def dump(path: str) -> None:
+    """以 JSON 写出全部记录（按耗时降序），便于与历史基线对比。"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": time.time(), "sections": report()}, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,103 @@
+"""
+内存中的上传图片。
+
+原流程中一张上传图片要经过三次解码与两次磁盘往返：`save_uploaded_image` 解码 base64 并
+用 PIL `verify()` 后写入临时文件，视觉模型封装再从磁盘打开、缩放、重新编码为 base64，
+OCR 又从磁盘打开一次。
+
+`UploadedImage` 在每个请求中只构建一次：持有解码后的原始字节与校验过的格式/尺寸，
+PIL 图像与发送给视觉模型的 data URL（经 `image_payload.encode_for_vision` 选择尺寸、格式
+与质量）均在首次使用时生成并缓存，视觉调用与 OCR 共用同一对象，不再落盘。
+"""
+import base64
+import hashlib
+import io
+import threading
+from typing import Optional, Tuple, Union
+
+from PIL import Image
+
+from .image_payload import encode_for_vision
+
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+MAX_UPLOAD_SIDE = 4096
+
+
+class UploadedImage:
+    """一次请求内共享的图片：原始字节 + 惰性解码的 PIL 图像 + 惰性生成的 data URL。"""
+
+    def __init__(self, data: bytes, declared_mime: Optional[str] = None):
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise ValueError("图片文件过大：超过16MB限制")
+        try:
+            with Image.open(io.BytesIO(data)) as probe:
+                probe.verify()
+                self.format: str = (probe.format or "").upper()
+                self.size: Tuple[int, int] = probe.size
+        except Exception as e:
+            raise ValueError(f"无效的图像文件: {e}") from e
+        if max(self.size) > MAX_UPLOAD_SIDE:
+            raise ValueError("图片分辨率过高：超过 4K 限制，拒绝处理")
+        self.data = data
+        self.declared_mime = declared_mime
+        self._lock = threading.Lock()
+        self._image: Optional[Image.Image] = None
+        self._data_url: Optional[str] = None
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_base64(cls, image_data: str) -> "UploadedImage":
+        """解析前端上传的 base64（可带 `data:image/...;base64,` 前缀）。"""
+        declared_mime = None
+        if image_data.startswith("data:image"):
+            header, image_data = image_data.split(",", 1)
+            declared_mime = header.split(";")[0].split(":", 1)[1] or None
+        return cls(base64.b64decode(image_data), declared_mime)
+
+    @property
+    def mime_type(self) -> str:
+        return Image.MIME.get(self.format) or self.declared_mime or "image/jpeg"
+
+    @property
+    def digest(self) -> str:
+        """原始字节的 SHA-256（十六进制），用作 OCR 等结果缓存的键。"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    @property
+    def image(self) -> Image.Image:
+        """完整解码后的 PIL 图像（只解码一次；调用方不应原地修改）。"""
+        with self._lock:
+            if self._image is None:
+                image = Image.open(io.BytesIO(self.data))
+                image.load()
+                self._image = image
+            return self._image
+
+    def data_url(self) -> str:
+        """发送给视觉模型的 data URL（只编码一次）。"""
+        with self._lock:
+            cached = self._data_url
+        if cached is not None:
+            return cached
+        mime_type, payload = encode_for_vision(self.image, self.data, self.format)
+        url = f"data:{mime_type};base64,{base64.b64encode(payload).decode('ascii')}"
+        with self._lock:
+            self._data_url = url
+        return url
+
+    def __repr__(self) -> str:
+        return f"UploadedImage(format={self.format!r}, size={self.size}, bytes={len(self.data)})"
+
+
+ImageInput = Union[str, UploadedImage]
+
+
+def decode_uploaded_image(image_data: str) -> Optional[UploadedImage]:
+    """构建请求内共享的 `UploadedImage`；数据无效或超出限制时打印原因并返回 None。"""
+    try:
+        return UploadedImage.from_base64(image_data)
+    except Exception as e:
+        print(f"图片处理失败: {e}")
+        return None
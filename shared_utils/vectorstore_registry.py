@@ -0,0 +1,332 @@
+"""
+进程级共享的 FAISS 向量库注册表。
+
+同一子应用中的出题/问答/知识图谱/对话 Agent 指向同一个 `database_agent_*` 目录，
+门户又会把多个子应用挂载到同一进程。若每个 Agent 各自 `FAISS.load_local`，
+索引与反序列化后的 docstore 会在内存中重复多份。
+
+本模块以（向量库绝对路径, 嵌入模型）为键，每个索引只加载一次（索引目录含紧凑
+docstore 时以内存映射方式加载，否则读取 index.pkl），对外只发放只读代理（索引目录
+含 BM25 词法索引时 `similarity_search` 为混合检索，结果经按索引版本失效的 LRU 缓存），
+并可通过 `registry_stats()` 查看各索引的内存占用。
+
+每次加载记录当时 `index.faiss` 的版本戳；代理每次访问时比对磁盘上的版本，索引重建后
+由首个发现变化的请求线程原地重新加载（其余请求在新索引就绪前继续使用旧索引），
+已发放的代理随之切换到新索引。
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_dashscope.embeddings import DashScopeEmbeddings
+
+from .batch_retrieval import batch_similarity_search, multi_query_search
+from .compact_docstore import CompactDocstore, load_faiss
+from .embedding_cache import CachedEmbeddings, MmapEmbeddingStore
+from .lexical_index import LexicalIndex, hybrid_search
+from .metrics import register_stats_provider
+from .retrieval_cache import RetrievalCache
+from .startup_profile import profile_section
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-v2"
+
+_LOCK = threading.Lock()
+_EMBEDDINGS: Dict[str, Any] = {}
+_ENTRIES: Dict[Tuple[str, str], "_RegistryEntry"] = {}
+_KEY_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+class ReadOnlyVectorStore:
+    """共享向量库的只读代理：检索接口转发到当前加载的索引，写入类方法一律拒绝。"""
+
+    _MUTATING_METHODS = frozenset({
+        "add_texts",
+        "add_documents",
+        "add_embeddings",
+        "aadd_texts",
+        "aadd_documents",
+        "delete",
+        "adelete",
+        "merge_from",
+    })
+
+    def __init__(self, entry: "_RegistryEntry"):
+        object.__setattr__(self, "_entry", entry)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        """索引目录带 BM25 词法索引时做向量 + BM25 的 RRF 混合检索（HYBRID_RETRIEVAL=0 关闭）。
+
+        带 filter 等额外参数的调用仍走纯向量检索，且不经过检索结果缓存。
+        """
+        loaded = self._entry.current()
+        if kwargs:
+            return loaded.store.similarity_search(query, k=k, **kwargs)
+        lexical = _lexical_if_enabled(loaded)
+        cache = self._entry.cache
+        cache_key = (query, k, lexical is not None)
+        if cache is not None:
+            docs = cache.get(cache_key, loaded.generation)
+            if docs is not None:
+                return docs
+        if lexical is not None:
+            docs = hybrid_search(loaded.store, lexical, query, k=k)
+        else:
+            docs = loaded.store.similarity_search(query, k=k)
+        if cache is not None:
+            cache.set(cache_key, docs, loaded.generation)
+        return docs
+
+    def batch_similarity_search(self, queries: Sequence[str], k: int = 4) -> List[List[Document]]:
+        """多个查询一次嵌入、一次检索，返回每个查询各自的前 k 个文档。"""
+        loaded = self._entry.current()
+        return batch_similarity_search(loaded.store, queries, k, _lexical_if_enabled(loaded))
+
+    def multi_query_search(self, queries: Sequence[str], k: int = 4, limit: Optional[int] = None) -> List[Document]:
+        """多个查询一次嵌入、一次检索，合并去重后按相关度返回。"""
+        loaded = self._entry.current()
+        return multi_query_search(loaded.store, queries, k, limit, _lexical_if_enabled(loaded))
+
+    def __getattr__(self, name: str) -> Any:
+        if name in self._MUTATING_METHODS:
+            raise AttributeError(
+                f"共享向量库为只读（{self._entry.key[0]}），不支持 {name}；如需修改请重新构建索引。"
+            )
+        return getattr(self._entry.current().store, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"共享向量库为只读（{self._entry.key[0]}），不能设置属性 {name}")
+
+    def __repr__(self) -> str:
+        return f"ReadOnlyVectorStore(path={self._entry.key[0]!r}, embedding_model={self._entry.key[1]!r})"
+
+
+class _LoadedIndex:
+    """一次加载得到的索引：FAISS 库、词法索引、加载前读取的版本戳与加载代数。"""
+
+    def __init__(
+        self,
+        store: FAISS,
+        lexical: Optional[LexicalIndex],
+        version: str,
+        generation: int,
+        load_seconds: float,
+    ):
+        self.store = store
+        self.lexical = lexical
+        self.version = version
+        self.generation = generation
+        self.load_seconds = load_seconds
+
+
+def _lexical_if_enabled(loaded: _LoadedIndex) -> Optional[LexicalIndex]:
+    return loaded.lexical if os.environ.get("HYBRID_RETRIEVAL", "1") != "0" else None
+
+
+class _RegistryEntry:
+    def __init__(self, key: Tuple[str, str], embeddings: Any):
+        self.key = key
+        self.embeddings = embeddings
+        max_entries = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "256"))
+        self.cache = RetrievalCache(key[0], max_entries) if max_entries > 0 else None
+        self._reload_lock = threading.Lock()
+        self._failed_version: Optional[str] = None
+        self.reloads = 0
+        self.handles = 0
+        self.loaded = self._load(0)
+        self.proxy = ReadOnlyVectorStore(self)
+
+    def _load(self, generation: int) -> _LoadedIndex:
+        # 先读版本戳再加载：加载期间若索引再次被重建，下次访问时版本不一致会再加载一次
+        version = index_version(self.key[0])
+        start = time.perf_counter()
+        with profile_section("faiss", self.key[0]):
+            store = load_faiss(self.key[0], self.embeddings)
+            lexical = None
+            try:
+                lexical = LexicalIndex.load(self.key[0])
+            except Exception as e:
+                print(f"[VectorStore] 词法索引加载失败，仅使用向量检索（{self.key[0]}）：{e}")
+        return _LoadedIndex(store, lexical, version, generation, time.perf_counter() - start)
+
+    def current(self) -> _LoadedIndex:
+        """返回当前加载的索引；磁盘上的版本已变化时先重新加载。
+
+        只有一个线程执行重新加载，其他线程在新索引就绪前继续使用旧索引；
+        加载失败时保留旧索引，同一版本不再重试。
+        """
+        loaded = self.loaded
+        version = index_version(self.key[0])
+        # 换名安装新索引的瞬间 index.faiss 可能短暂不存在，此时不重新加载
+        if version in (loaded.version, self._failed_version, "missing"):
+            return loaded
+        if not self._reload_lock.acquire(blocking=False):
+            return loaded
+        try:
+            loaded = self.loaded
+            if index_version(self.key[0]) == loaded.version:
+                return loaded
+            try:
+                fresh = self._load(loaded.generation + 1)
+            except Exception as e:
+                self._failed_version = version
+                print(f"[VectorStore] 索引已变化但重新加载失败，继续使用旧索引（{self.key[0]}）：{e}")
+                return loaded
+            self.loaded = fresh
+            self.reloads += 1
+            print(f"[VectorStore] 检测到索引重建，已重新加载 {self.key[0]}（{fresh.load_seconds:.2f}s）")
+            return fresh
+        finally:
+            self._reload_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        loaded = self.loaded
+        index = loaded.store.index
+        ntotal = int(getattr(index, "ntotal", 0))
+        dim = int(getattr(index, "d", 0))
+        # 扁平索引常驻内存约为 ntotal * d * 4 字节；其他索引类型以磁盘文件大小近似
+        index_bytes = ntotal * dim * 4
+        index_file = os.path.join(self.key[0], "index.faiss")
+        if type(index).__name__ not in ("IndexFlat", "IndexFlatL2", "IndexFlatIP"):
+            try:
+                index_bytes = os.path.getsize(index_file)
+            except OSError:
+                pass
+        docstore = loaded.store.docstore
+        if isinstance(docstore, CompactDocstore):
+            # 紧凑格式按需解码，这里是映射文件中的文本字节数，并非常驻内存
+            docs_count = len(docstore)
+            docstore_bytes = docstore.nbytes
+        else:
+            docs = getattr(docstore, "_dict", {})
+            docs_count = len(docs)
+            docstore_bytes = 0
+            for doc in docs.values():
+                docstore_bytes += len(getattr(doc, "page_content", "").encode("utf-8"))
+        return {
+            "path": self.key[0],
+            "embedding_model": self.key[1],
+            "vectors": ntotal,
+            "dim": dim,
+            "documents": docs_count,
+            "docstore_format": "compact" if isinstance(docstore, CompactDocstore) else "pickle",
+            "lexical_terms": int(loaded.lexical.meta["terms"]) if loaded.lexical is not None else 0,
+            "index_bytes": index_bytes,
+            "docstore_bytes": docstore_bytes,
+            "version": loaded.version,
+            "reloads": self.reloads,
+            "load_seconds": round(loaded.load_seconds, 4),
+            "handles": self.handles,
+        }
+
+
+def get_embeddings(model: str = DEFAULT_EMBEDDING_MODEL) -> Any:
+    """返回进程内共享、带缓存的嵌入模型实例。
+
+    - EMBEDDING_CACHE_SIZE：内存 LRU 条目上限（默认 4096）
+    - EMBEDDING_CACHE_DIR：设置后向量同时持久化到该目录（按模型分子目录）
+    """
+    with _LOCK:
+        embeddings = _EMBEDDINGS.get(model)
+        if embeddings is None:
+            store = None
+            cache_dir = os.environ.get("EMBEDDING_CACHE_DIR")
+            if cache_dir:
+                store = MmapEmbeddingStore(os.path.join(cache_dir, model))
+            embeddings = CachedEmbeddings(
+                DashScopeEmbeddings(model=model),
+                model,
+                max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096")),
+                store=store,
+            )
+            _EMBEDDINGS[model] = embeddings
+        return embeddings
+
+
+def get_vectorstore(
+    vectorstore_path: str,
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+    embeddings: Optional[Any] = None,
+) -> ReadOnlyVectorStore:
+    """加载（或复用已加载的）向量库，返回只读代理。
+
+    路径按调用时的工作目录解析为绝对路径，与原先 `FAISS.load_local` 的行为一致。
+    加载失败时直接抛出异常且不缓存，调用方可自行降级。
+    """
+    key = (os.path.abspath(vectorstore_path), embedding_model)
+    with _LOCK:
+        entry = _ENTRIES.get(key)
+        if entry is not None:
+            entry.handles += 1
+            return entry.proxy
+        key_lock = _KEY_LOCKS.setdefault(key, threading.Lock())
+
+    # 同一索引的并发首次加载只执行一次；不同索引之间互不阻塞
+    with key_lock:
+        with _LOCK:
+            entry = _ENTRIES.get(key)
+        if entry is None:
+            if embeddings is None:
+                embeddings = get_embeddings(embedding_model)
+            entry = _RegistryEntry(key, embeddings)
+            with _LOCK:
+                _ENTRIES[key] = entry
+            print(f"[VectorStore] 已加载 {key[0]}（{entry.loaded.load_seconds:.2f}s），后续 Agent 将共享该索引。")
+        with _LOCK:
+            entry.handles += 1
+        return entry.proxy
+
+
+def index_version(vectorstore_path: str) -> str:
+    """基于 index.faiss 的修改时间与大小生成版本戳；重建索引后版本随之变化。"""
+    try:
+        st = os.stat(os.path.join(os.path.abspath(vectorstore_path), "index.faiss"))
+    except OSError:
+        return "missing"
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def loaded_index_version(vectorstore_path: str, embedding_model: str = DEFAULT_EMBEDDING_MODEL) -> str:
+    """已加载索引的版本戳（必要时先按磁盘版本重新加载）；尚未加载时退回磁盘上的版本戳。"""
+    with _LOCK:
+        entry = _ENTRIES.get((os.path.abspath(vectorstore_path), embedding_model))
+    if entry is None:
+        return index_version(vectorstore_path)
+    return entry.current().version
+
+
+def invalidate(vectorstore_path: Optional[str] = None) -> None:
+    """丢弃已加载的索引（全部或指定路径），下次获取时重新加载。已发放的代理仍指向旧索引。"""
+    with _LOCK:
+        if vectorstore_path is None:
+            _ENTRIES.clear()
+            return
+        path = os.path.abspath(vectorstore_path)
+        for key in [k for k in _ENTRIES if k[0] == path]:
+            _ENTRIES.pop(key, None)
+
+
+def registry_stats() -> List[Dict[str, Any]]:
+    """各已加载索引的向量数、维度与估算内存占用（字节）。"""
+    with _LOCK:
+        entries = list(_ENTRIES.values())
+    return [entry.stats() for entry in entries]
+
+
+def retrieval_cache_stats() -> List[Dict[str, Any]]:
+    with _LOCK:
+        entries = list(_ENTRIES.values())
+    return [entry.cache.stats() for entry in entries if entry.cache is not None]
+
+
+def embedding_cache_stats() -> List[Dict[str, Any]]:
+    with _LOCK:
+        embeddings = list(_EMBEDDINGS.values())
+    return [e.stats() for e in embeddings]
+
+
+register_stats_provider("vectorstores", registry_stats)
+register_stats_provider("embedding_cache", embedding_cache_stats)
+register_stats_provider("retrieval_cache", retrieval_cache_stats)